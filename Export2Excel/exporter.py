@@ -1,120 +1,310 @@
+import io
 import os
 import sqlite3
-from typing import Optional, List, Tuple
+from contextlib import closing, contextmanager
+from functools import lru_cache
+from itertools import chain, islice
+from typing import Optional, List, Tuple, Iterable, Iterator, Sequence
 from datetime import datetime
+from pathlib import Path
 
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, Alignment, PatternFill, numbers
-
-
-def _fetch_rows(db_path: str, username: str, start_date: Optional[str] = None, end_date: Optional[str] = None) -> Tuple[List[str], List[Tuple]]:
-    conn = sqlite3.connect(db_path)
-    try:
-        cur = conn.cursor()
+from openpyxl.utils import get_column_letter
+
+try:
+    import xlsxwriter
+except ImportError:  # optional backend, see export_to_excel(backend=...)
+    xlsxwriter = None
+
+
+# Styles are immutable once assigned, so one instance per style is shared by all cells
+_HEADER_FONT = Font(bold=True)
+_HEADER_FILL = PatternFill("solid", fgColor="FFDDDDDD")
+_HEADER_ALIGN = Alignment(horizontal="center", vertical="center")
+_BODY_ALIGN = Alignment(horizontal="left", vertical="center")
+
+
+# Колонки выгрузки в итоговом порядке (quantity сразу после product_name);
+# file_path, created_at, discount и username в отчёт не попадают
+_OUTPUT_COLUMNS = (
+    "id",
+    "chequeid",
+    "date",
+    "product_name",
+    "quantity",
+    "price",
+    "category1",
+    "category2",
+    "category3",
+    "organization",
+    "description",
+)
+
+_PURCHASES_COLUMNS = frozenset({
+    "id", "chequeid", "file_path", "date", "created_at", "product_name", "quantity", "price",
+    "discount", "category1", "category2", "category3", "organization", "username", "description",
+})
+
+
+def _select_columns_sql(columns: Tuple[str, ...]) -> str:
+    unknown = [col for col in columns if col not in _PURCHASES_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown purchases columns: {unknown}")
+    return ", ".join(columns)
+
+
+_SELECT_OUTPUT_SQL = f"SELECT {_select_columns_sql(_OUTPUT_COLUMNS)} FROM purchases"
+
+
+@contextmanager
+def _iter_rows(db_path: str, username: str, start_date: Optional[str] = None, end_date: Optional[str] = None, chunk_size: int = 1000) -> Iterator[Tuple[List[str], Iterator[Tuple]]]:
+    """Отдаёт (columns, rows), где rows читаются из курсора порциями по chunk_size."""
+    # Только чтение: без транзакций и блокировки на запись, файл читается через mmap
+    uri = f"{Path(db_path).absolute().as_uri()}?mode=ro"
+    with closing(sqlite3.connect(uri, uri=True, isolation_level=None)) as conn, closing(conn.cursor()) as cur:
+        conn.row_factory = None
+        conn.execute("PRAGMA query_only=1")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-20000")
+        cur.arraysize = chunk_size
         if start_date and end_date:
             cur.execute(
-                "SELECT * FROM purchases WHERE date >= ? AND date <= ? AND username = ? ORDER BY date DESC, id ASC",
+                f"{_SELECT_OUTPUT_SQL} WHERE date >= ? AND date <= ? AND username = ? ORDER BY date DESC, id ASC",
                 (start_date, end_date, username),
             )
         else:
             cur.execute(
-                "SELECT * FROM purchases WHERE username = ? ORDER BY date DESC, id ASC",
+                f"{_SELECT_OUTPUT_SQL} WHERE username = ? ORDER BY date DESC, id ASC",
                 (username,),
             )
-        rows = cur.fetchall()
         columns = [d[0] for d in cur.description]
-        return columns, rows
-    finally:
-        conn.close()
 
+        def _rows() -> Iterator[Tuple]:
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield from rows
 
-def _is_price_column(col_name: str) -> bool:
-    return col_name in {"price", "discount"}
+        yield columns, _rows()
 
 
-def _is_date_column(col_name: str) -> bool:
-    return col_name in {"date", "created_at"}
+# Колонки с денежным форматом и с датами
+_PRICE_COLS = frozenset({"price", "discount"})
+_DATE_COLS = frozenset({"date", "created_at"})
 
 
-def _coerce_cell_value(col: str, val):
+def _coerce_price(val):
     if val is None:
         return None
-    if _is_price_column(col):
-        try:
-            return float(val)
-        except Exception:
-            return val
-    if _is_date_column(col):
-        # Return parsed datetime when possible; leave string otherwise
-        try:
-            if val is None:
-                return None
-            s = str(val)
-            # dd.mm.yyyy
-            if "." in s and len(s) >= 10:
-                return datetime.strptime(s[:10], "%d.%m.%Y")
-            # ISO 8601
-            s2 = s.replace("Z", "+00:00")
-            return datetime.fromisoformat(s2[:26])
-        except Exception:
-            return str(val)
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return val
+
+
+def _coerce_date(val):
+    # Return parsed datetime when possible; leave string otherwise
+    if val is None:
+        return None
+    if isinstance(val, datetime):
+        return val
+    s = val if isinstance(val, str) else str(val)
+    try:
+        # dd.mm.yyyy
+        if len(s) >= 10 and s[2] == "." and s[5] == ".":
+            return datetime(int(s[6:10]), int(s[3:5]), int(s[0:2]))
+        # yyyy-mm-dd (ISO 8601)
+        if len(s) >= 10 and s[4] == "-" and s[7] == "-":
+            return datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]))
+    except ValueError:
+        pass
+    return s
+
+
+def _coerce_generic(val):
     # Try int/float otherwise keep as-is
+    if val is None:
+        return None
     if isinstance(val, (int, float)):
         return val
+    s = val if isinstance(val, str) else str(val)
+    has_comma = "," in s
+    if has_comma or "." in s:
+        try:
+            return float(s.replace(",", ".") if has_comma else s)
+        except ValueError:
+            return val
     try:
-        if "." in str(val) or "," in str(val):
-            return float(str(val).replace(",", "."))
-        return int(val)
-    except Exception:
+        return int(s)
+    except ValueError:
         return val
 
 
-def _auto_fit_columns(ws) -> None:
-    for column_cells in ws.columns:
-        max_len = 0
-        col_letter = column_cells[0].column_letter
-        for cell in column_cells:
-            try:
-                v = cell.value
-                s = v if isinstance(v, str) else ("" if v is None else str(v))
-                if len(s) > max_len:
-                    max_len = len(s)
-            except Exception:
-                pass
-        ws.column_dimensions[col_letter].width = min(max(10, max_len + 2), 60)
+def _make_coercer(col_name: str):
+    if col_name in _PRICE_COLS:
+        return _coerce_price
+    if col_name in _DATE_COLS:
+        return _coerce_date
+    return _coerce_generic
+
+
+# Сколько первых строк просматривается для подбора ширины колонок
+_WIDTH_SAMPLE_ROWS = 500
+
+
+# Предел размера кеша длин для одной колонки
+_WIDTH_CACHE_SIZE = 4096
+
+
+def _measure_price(v) -> int:
+    # Цены отображаются в формате 0.00
+    if isinstance(v, (int, float)):
+        return len(f"{v:.2f}")
+    return len(v) if isinstance(v, str) else len(str(v))
+
+
+def _make_width_measurer(col_name: Optional[str] = None):
+    """Функция длины значения для колонки; str() дробных чисел кешируется по значению."""
+    if col_name in _PRICE_COLS:
+        return _measure_price
+    cache: dict = {}
+
+    def measure(v) -> int:
+        if isinstance(v, str):
+            return len(v)
+        if isinstance(v, datetime):
+            return 10  # dd.mm.yyyy
+        if not isinstance(v, float):
+            return len(str(v))
+        n = cache.get(v)
+        if n is None:
+            n = len(str(v))
+            if len(cache) < _WIDTH_CACHE_SIZE:
+                cache[v] = n
+        return n
+
+    return measure
+
+
+def _estimate_column_widths(headers: Sequence[str], rows: Iterable[Sequence], columns: Optional[Sequence[str]] = None, sample_limit: int = _WIDTH_SAMPLE_ROWS) -> List[int]:
+    """Максимальная длина значения по колонкам: заголовок плюс первые sample_limit строк."""
+    max_len = [len(h) for h in headers]
+    measurers = [_make_width_measurer(col_name) for col_name in (columns or [None] * len(headers))]
+    for row in islice(rows, sample_limit):
+        for j, v in enumerate(row):
+            if v is None:
+                continue
+            n = measurers[j](v)
+            if n > max_len[j]:
+                max_len[j] = n
+    return max_len
+
+
+def _column_width(max_len: int) -> int:
+    return min(max(10, max_len + 2), 60)
+
+
+def _apply_column_widths(ws, max_len: Sequence[int]) -> None:
+    for j, n in enumerate(max_len, start=1):
+        ws.column_dimensions[get_column_letter(j)].width = _column_width(n)
 
 
 def _apply_header_style(cell) -> None:
-    cell.font = Font(bold=True)
-    cell.fill = PatternFill("solid", fgColor="DDDDDD")
-    cell.alignment = Alignment(horizontal="center", vertical="center")
+    cell.font = _HEADER_FONT
+    cell.fill = _HEADER_FILL
+    cell.alignment = _HEADER_ALIGN
 
 
-def _apply_body_style(cell, col_name: str) -> None:
-    cell.alignment = Alignment(horizontal="left", vertical="center")
-    if _is_price_column(col_name):
-        cell.number_format = numbers.FORMAT_NUMBER_00
-    elif _is_date_column(col_name):
-        # Ensure date formatting dd.mm.yyyy
-        try:
-            if isinstance(cell.value, datetime):
-                cell.number_format = "dd.mm.yyyy"
-            else:
-                # Try parse strings once more
-                v = str(cell.value)
-                dt = None
-                if "." in v and len(v) >= 10:
-                    dt = datetime.strptime(v[:10], "%d.%m.%Y")
-                elif "-" in v and len(v) >= 10:
-                    # handle YYYY-MM-DD
-                    dt = datetime.strptime(v[:10], "%Y-%m-%d")
-                if dt:
-                    cell.value = dt
-                    cell.number_format = "dd.mm.yyyy"
-                else:
-                    cell.number_format = "@"
-        except Exception:
-            cell.number_format = "@"
+def _make_header_cell(ws, text: str) -> WriteOnlyCell:
+    cell = WriteOnlyCell(ws, value=text)
+    _apply_header_style(cell)
+    return cell
+
+
+def _style_price_cell(cell) -> None:
+    cell.alignment = _BODY_ALIGN
+    cell.number_format = numbers.FORMAT_NUMBER_00
+
+
+def _style_date_cell(cell) -> None:
+    # Значение уже приведено в _coerce_date: datetime или исходная строка
+    cell.alignment = _BODY_ALIGN
+    cell.number_format = "dd.mm.yyyy" if isinstance(cell.value, datetime) else "@"
+
+
+def _style_price(ws, value):
+    if value is None:
+        return None
+    cell = WriteOnlyCell(ws, value=value)
+    _style_price_cell(cell)
+    return cell
+
+
+def _style_date(ws, value):
+    if value is None:
+        return None
+    cell = WriteOnlyCell(ws, value=value)
+    _style_date_cell(cell)
+    return cell
+
+
+def _style_generic(ws, value):
+    if value is None:
+        return None
+    cell = WriteOnlyCell(ws, value=value)
+    cell.alignment = _BODY_ALIGN
+    return cell
+
+
+def _make_styler(col_name: str):
+    """Выбирает оформление колонки: у всех ячеек тела выравнивание влево, у цен и дат еще number_format."""
+    if col_name in _PRICE_COLS:
+        return _style_price
+    if col_name in _DATE_COLS:
+        return _style_date
+    return _style_generic
+
+
+def _write_purchases_sheet(wb: Workbook, filtered_columns: List[str], rows: Iterable[Sequence]) -> None:
+    """Пишет лист Purchases; rows - исходные значения в порядке filtered_columns."""
+    ws = wb.create_sheet("Purchases")
+    headers = [_RU_HEADERS.get(col_name, col_name) for col_name in filtered_columns]
+
+    # Тип колонки определяется один раз, а не для каждой ячейки
+    coercers = [_make_coercer(col_name) for col_name in filtered_columns]
+    stylers = [_make_styler(col_name) for col_name in filtered_columns]
+    body = ([coerce(v) for coerce, v in zip(coercers, row)] for row in rows)
+
+    # В write-only режиме ширины и закрепление пишутся вместе с первой строкой,
+    # поэтому ширины подбираются по первым строкам потока
+    sample = list(islice(body, _WIDTH_SAMPLE_ROWS))
+    _apply_column_widths(ws, _estimate_column_widths(headers, sample, filtered_columns))
+    ws.freeze_panes = "A2"
+
+    ws.append([_make_header_cell(ws, header_text) for header_text in headers])
+    row_count = 0
+    for values in chain(sample, body):
+        ws.append([style(ws, v) for style, v in zip(stylers, values)])
+        row_count += 1
+
+    # Autofilter over full data range
+    last_col_letter = get_column_letter(len(filtered_columns))
+    ws.auto_filter.ref = f"A1:{last_col_letter}{row_count + 1}"
+
+
+# Каталоги выгрузок, уже созданные в этом процессе
+_ensured_dirs: set = set()
+
+
+def _ensure_dir(path: str) -> None:
+    d = os.path.dirname(path)
+    if d and d not in _ensured_dirs:
+        os.makedirs(d, exist_ok=True)
+        _ensured_dirs.add(d)
 
 
 _RU_HEADERS = {
@@ -136,57 +326,97 @@ _RU_HEADERS = {
 }
 
 
-def export_to_excel(db_path: str, output_path: str, username: str, start_date: Optional[str] = None, end_date: Optional[str] = None) -> str:
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    columns, rows = _fetch_rows(db_path, username, start_date, end_date)
+def export_to_excel(db_path: str, output_path: str, username: str, start_date: Optional[str] = None, end_date: Optional[str] = None, backend: Optional[str] = None) -> str:
+    """
+    Выгружает покупки пользователя в Excel.
 
-    # Исключаем из вывода: file_path, created_at, discount, username
-    excluded_columns = {"file_path", "created_at", "discount", "username"}
-    filtered_columns = [col for col in columns if col not in excluded_columns]
-    column_indices = [i for i, col in enumerate(columns) if col not in excluded_columns]
-    
-    # Перемещаем quantity сразу после product_name
-    if "product_name" in filtered_columns and "quantity" in filtered_columns:
-        product_idx = filtered_columns.index("product_name")
-        quantity_idx = filtered_columns.index("quantity")
-        if quantity_idx != product_idx + 1:
-            # Удаляем quantity из текущей позиции
-            filtered_columns.pop(quantity_idx)
-            orig_quantity_idx = column_indices.pop(quantity_idx)
-            # Вставляем quantity после product_name
-            filtered_columns.insert(product_idx + 1, "quantity")
-            column_indices.insert(product_idx + 1, orig_quantity_idx)
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Purchases"
-
-    # Header row with RU descriptions
-    for col_idx, col_name in enumerate(filtered_columns, start=1):
-        header_text = _RU_HEADERS.get(col_name, col_name)
-        c = ws.cell(row=1, column=col_idx, value=header_text)
-        _apply_header_style(c)
-
-    # Freeze header
-    ws.freeze_panes = "A2"
+    backend: "openpyxl" (по умолчанию) или "xlsxwriter"; если не задан, берётся
+    из переменной окружения EXCEL_BACKEND.
+    """
+    _ensure_dir(output_path)
+    backend = (backend or os.getenv("EXCEL_BACKEND") or "openpyxl").strip().lower()
+    if backend == "xlsxwriter" and xlsxwriter is None:
+        raise RuntimeError("xlsxwriter package is required for EXCEL_BACKEND=xlsxwriter")
+
+    with _iter_rows(db_path, username, start_date, end_date) as (columns, rows):
+        first = next(rows, None)
+        if first is None:
+            # Пустая выгрузка: пишем заранее собранный файл с одним заголовком
+            with open(output_path, "wb") as f:
+                f.write(_empty_report_bytes(tuple(columns)))
+            return output_path
+        rows = chain((first,), rows)
+
+        if backend == "xlsxwriter":
+            return _write_purchases_xlsxwriter(output_path, columns, rows)
+
+        wb = Workbook(write_only=True)
+        _write_purchases_sheet(wb, columns, rows)
 
-    # Body rows
-    for r_idx, row in enumerate(rows, start=2):
-        for c_idx, orig_idx in enumerate(column_indices, start=1):
-            col_name = filtered_columns[c_idx - 1]
-            val = row[orig_idx]
-            coerced = _coerce_cell_value(col_name, val)
-            cell = ws.cell(row=r_idx, column=c_idx, value=coerced)
-            _apply_body_style(cell, col_name)
+    wb.save(output_path)
+    return output_path
 
-    # Autofilter over full data range
-    last_row = ws.max_row
-    last_col_letter = ws.cell(row=1, column=len(filtered_columns)).column_letter
-    ws.auto_filter.ref = f"A1:{last_col_letter}{last_row}"
 
-    _auto_fit_columns(ws)
+@lru_cache(maxsize=4)
+def _empty_report_bytes(columns: Tuple[str, ...]) -> bytes:
+    """Книга только с заголовком; собирается один раз на набор колонок."""
+    wb = Workbook(write_only=True)
+    _write_purchases_sheet(wb, list(columns), iter(()))
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
 
-    wb.save(output_path)
+
+def _write_purchases_xlsxwriter(output_path: str, columns: List[str], rows: Iterable[Sequence]) -> str:
+    """Та же выгрузка через xlsxwriter в режиме constant_memory: строки сбрасываются на диск сразу."""
+    wb = xlsxwriter.Workbook(output_path, {"constant_memory": True, "strings_to_numbers": False})
+    try:
+        ws = wb.add_worksheet("Purchases")
+        header_fmt = wb.add_format({"bold": True, "bg_color": "#DDDDDD", "align": "center", "valign": "vcenter"})
+        price_fmt = wb.add_format({"num_format": "0.00", "align": "left", "valign": "vcenter"})
+        date_fmt = wb.add_format({"num_format": "dd.mm.yyyy", "align": "left", "valign": "vcenter"})
+        text_fmt = wb.add_format({"num_format": "@", "align": "left", "valign": "vcenter"})
+        body_fmt = wb.add_format({"align": "left", "valign": "vcenter"})
+
+        def write_price(r: int, c: int, v) -> None:
+            if isinstance(v, (int, float)):
+                ws.write_number(r, c, v, price_fmt)
+            else:
+                ws.write(r, c, v, price_fmt)
+
+        def write_date(r: int, c: int, v) -> None:
+            if isinstance(v, datetime):
+                ws.write_datetime(r, c, v, date_fmt)
+            else:
+                ws.write_string(r, c, str(v), text_fmt)
+
+        def write_generic(r: int, c: int, v) -> None:
+            ws.write(r, c, v, body_fmt)
+
+        headers = [_RU_HEADERS.get(col_name, col_name) for col_name in columns]
+        coercers = [_make_coercer(col_name) for col_name in columns]
+        writers = [
+            write_price if col_name in _PRICE_COLS else write_date if col_name in _DATE_COLS else write_generic
+            for col_name in columns
+        ]
+        body = ([coerce(v) for coerce, v in zip(coercers, row)] for row in rows)
+
+        # constant_memory пишет строки сразу, поэтому ширины задаются заранее по первым строкам
+        sample = list(islice(body, _WIDTH_SAMPLE_ROWS))
+        for j, n in enumerate(_estimate_column_widths(headers, sample, columns)):
+            ws.set_column(j, j, _column_width(n))
+        ws.freeze_panes(1, 0)
+
+        ws.write_row(0, 0, headers, header_fmt)
+        r_idx = 0
+        for r_idx, values in enumerate(chain(sample, body), start=1):
+            for c_idx, (write, v) in enumerate(zip(writers, values)):
+                if v is not None:
+                    write(r_idx, c_idx, v)
+
+        ws.autofilter(0, 0, r_idx, len(columns) - 1)
+    finally:
+        wb.close()
     return output_path
 
 
@@ -202,7 +432,7 @@ def export_grouped_to_excel(grouped_data: List[dict], output_path: str, group_fi
     Returns:
         Путь к сохраненному файлу
     """
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    _ensure_dir(output_path)
     
     field_names = {
         "category1": "категория 1 уровня",
@@ -214,102 +444,63 @@ def export_grouped_to_excel(grouped_data: List[dict], output_path: str, group_fi
     
     header_name = field_names.get(group_field_name, group_field_name)
     
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Grouped"
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Grouped")
     
-    # Заголовки
     headers = [header_name, "количество позиций", "количество чеков", "сумма"]
-    for col_idx, header in enumerate(headers, start=1):
-        c = ws.cell(row=1, column=col_idx, value=header)
-        _apply_header_style(c)
-    
-    # Данные
-    for r_idx, item in enumerate(grouped_data, start=2):
-        ws.cell(row=r_idx, column=1, value=item.get("group_name") or "")
-        ws.cell(row=r_idx, column=2, value=item.get("count", 0))
-        ws.cell(row=r_idx, column=3, value=item.get("cheque_count", 0))
-        total_cell = ws.cell(row=r_idx, column=4, value=float(item.get("total", 0)))
-        total_cell.number_format = numbers.FORMAT_NUMBER_00
-        _apply_body_style(total_cell, "total")
+    rows = [
+        [
+            item.get("group_name") or "",
+            item.get("count", 0),
+            item.get("cheque_count", 0),
+            float(item.get("total", 0)),
+        ]
+        for item in grouped_data
+    ]
     
-    # Freeze header
+    # В write-only режиме ширины и закрепление пишутся вместе с первой строкой
+    _apply_column_widths(ws, _estimate_column_widths(headers, rows, [None, None, None, "price"]))
     ws.freeze_panes = "A2"
     
-    # Autofilter
-    last_row = ws.max_row
-    ws.auto_filter.ref = f"A1:D{last_row}"
+    # Заголовок готовыми ячейками, в данных стилизуется только колонка суммы
+    ws.append([_make_header_cell(ws, h) for h in headers])
+    for name, count, cheque_count, total in rows:
+        ws.append([name, count, cheque_count, _style_price(ws, total)])
     
-    _auto_fit_columns(ws)
+    # Autofilter
+    ws.auto_filter.ref = f"A1:D{len(rows) + 1}"
     
     wb.save(output_path)
     return output_path
 
 
-def _export_filtered_to_excel(filtered_data: List[dict], output_path: str) -> str:
+def _export_filtered_to_excel(filtered_data: Iterable[dict], output_path: str) -> str:
     """
     Экспортирует отфильтрованные данные в Excel.
     
     Args:
-        filtered_data: Список словарей с данными записей
+        filtered_data: Список или итератор словарей с данными записей
         output_path: Путь к выходному файлу
     
     Returns:
         Путь к сохраненному файлу
     """
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    _ensure_dir(output_path)
     
-    if not filtered_data:
+    records = iter(filtered_data)
+    first = next(records, None)
+    if first is None:
         raise ValueError("No data to export")
     
-    # Получаем колонки из первой записи
-    columns = list(filtered_data[0].keys())
-    
-    # Исключаем из вывода: file_path, created_at, discount, username
-    excluded_columns = {"file_path", "created_at", "discount", "username"}
-    filtered_columns = [col for col in columns if col not in excluded_columns]
-    column_indices = [i for i, col in enumerate(columns) if col not in excluded_columns]
-    
-    # Перемещаем quantity сразу после product_name
-    if "product_name" in filtered_columns and "quantity" in filtered_columns:
-        product_idx = filtered_columns.index("product_name")
-        quantity_idx = filtered_columns.index("quantity")
-        if quantity_idx != product_idx + 1:
-            filtered_columns.pop(quantity_idx)
-            orig_quantity_idx = column_indices.pop(quantity_idx)
-            filtered_columns.insert(product_idx + 1, "quantity")
-            column_indices.insert(product_idx + 1, orig_quantity_idx)
-    
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Purchases"
-    
-    # Header row with RU descriptions
-    for col_idx, col_name in enumerate(filtered_columns, start=1):
-        header_text = _RU_HEADERS.get(col_name, col_name)
-        c = ws.cell(row=1, column=col_idx, value=header_text)
-        _apply_header_style(c)
-    
-    # Freeze header
-    ws.freeze_panes = "A2"
-    
-    # Body rows
-    for r_idx, row_dict in enumerate(filtered_data, start=2):
-        row_values = [row_dict.get(col) for col in columns]
-        for c_idx, orig_idx in enumerate(column_indices, start=1):
-            col_name = filtered_columns[c_idx - 1]
-            val = row_values[orig_idx]
-            coerced = _coerce_cell_value(col_name, val)
-            cell = ws.cell(row=r_idx, column=c_idx, value=coerced)
-            _apply_body_style(cell, col_name)
-    
-    # Autofilter
-    last_row = ws.max_row
-    last_col_letter = ws.cell(row=1, column=len(filtered_columns)).column_letter
-    ws.auto_filter.ref = f"A1:{last_col_letter}{last_row}"
-    
-    _auto_fit_columns(ws)
-    
+    # Колонки в каноническом порядке выгрузки; прочие поля записи (кроме служебных) идут следом
+    excluded_columns = {"file_path", "created_at", "discount", "username", "date_ymd"}
+    output_cols = tuple(c for c in _OUTPUT_COLUMNS if c in first) + tuple(
+        c for c in first if c not in _OUTPUT_COLUMNS and c not in excluded_columns
+    )
+    rows = ([row_dict.get(c) for c in output_cols] for row_dict in chain((first,), records))
+
+    wb = Workbook(write_only=True)
+    _write_purchases_sheet(wb, list(output_cols), rows)
+
     wb.save(output_path)
     return output_path
-
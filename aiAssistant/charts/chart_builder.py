@@ -1,26 +1,70 @@
 """Chart builder for generating pie charts from grouped data."""
 import io
-import matplotlib
-matplotlib.use('Agg')  # Use non-interactive backend
-import matplotlib.pyplot as plt
-from typing import List, Dict
+import os
+import importlib.util
+import threading
+from functools import lru_cache
+from itertools import accumulate
+from math import cos, sin, radians
+from typing import List, Dict, Optional, Tuple
 
+from PIL import Image, ImageDraw, ImageFont
 
-def create_pie_chart(grouped_data: List[Dict], group_field_name: str) -> io.BytesIO:
-    """
-    Создает круговую диаграмму из сгруппированных данных.
-    
-    Args:
-        grouped_data: Список словарей с полями ["group_name", "total"]
-        group_field_name: Название поля группировки (для заголовка)
-    
-    Returns:
-        BytesIO объект с изображением PNG
-    """
+
+# Палитра Set3 (как plt.cm.Set3)
+_PALETTE = (
+    "#8dd3c7", "#ffffb3", "#bebada", "#fb8072", "#80b1d3", "#fdb462",
+    "#b3de69", "#fccde5", "#d9d9d9", "#bc80bd", "#ccebc5", "#ffed6f",
+)
+
+_FIELD_NAMES = {
+    "category1": "категориям 1 уровня",
+    "category2": "категориям 2 уровня",
+    "category3": "категориям 3 уровня",
+    "organization": "организациям",
+    "description": "комментариям"
+}
+
+# Фигура matplotlib переиспользуется между вызовами; matplotlib не потокобезопасен
+_MPL_LOCK = threading.Lock()
+_MPL_FIG = None
+
+# Геометрия диаграммы Pillow
+_WIDTH = 600
+_TITLE_HEIGHT = 50
+_PIE_BOX = (125, _TITLE_HEIGHT + 10, 475, _TITLE_HEIGHT + 360)
+_LEGEND_TOP = _TITLE_HEIGHT + 380
+_LEGEND_LINE = 20
+_START_ANGLE = 75
+
+# Шрифты с кириллицей и знаком ₽: системные, затем из состава matplotlib
+_FONT_CANDIDATES = ("DejaVuSans.ttf", "arial.ttf")
+_BOLD_FONT_CANDIDATES = ("DejaVuSans-Bold.ttf", "arialbd.ttf")
+
+
+def _matplotlib_font_path(file_name: str) -> Optional[str]:
+    spec = importlib.util.find_spec("matplotlib")
+    if spec is None or not spec.origin:
+        return None
+    return os.path.join(os.path.dirname(spec.origin), "mpl-data", "fonts", "ttf", file_name)
+
+
+@lru_cache(maxsize=None)
+def _load_font(size: int, bold: bool = False):
+    candidates = _BOLD_FONT_CANDIDATES if bold else _FONT_CANDIDATES
+    mpl_path = _matplotlib_font_path(candidates[0])
+    for name in candidates + ((mpl_path,) if mpl_path else ()):
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size)
+
+
+def _extract_values(grouped_data: List[Dict]) -> Tuple[List[str], List[float]]:
     if not grouped_data:
         raise ValueError("Empty data for chart")
-    
-    # Извлекаем данные
+
     labels = []
     values = []
     for item in grouped_data:
@@ -29,77 +73,158 @@ def create_pie_chart(grouped_data: List[Dict], group_field_name: str) -> io.Byte
         if total > 0:  # Пропускаем нулевые значения
             labels.append(str(group_name))
             values.append(total)
-    
+
     if not values:
         raise ValueError("No positive values in data")
-    
+    return labels, values
+
+
+def _legend_labels(labels: List[str], values: List[float], total_sum: float) -> List[str]:
+    legend_labels = []
+    for label, value in zip(labels, values):
+        percent = (value / total_sum) * 100 if total_sum > 0 else 0
+        legend_labels.append(f"{label}: {value:.2f} ₽ ({percent:.1f}%)")
+    return legend_labels
+
+
+def create_pie_chart(grouped_data: List[Dict], group_field_name: str, backend: Optional[str] = None) -> io.BytesIO:
+    """
+    Создает круговую диаграмму из сгруппированных данных.
+
+    Args:
+        grouped_data: Список словарей с полями ["group_name", "total"]
+        group_field_name: Название поля группировки (для заголовка)
+        backend: "pillow" (по умолчанию) или "matplotlib"; по умолчанию берется из CHART_BACKEND
+
+    Returns:
+        BytesIO объект с изображением PNG
+    """
+    labels, values = _extract_values(grouped_data)
+    title_text = _FIELD_NAMES.get(group_field_name, group_field_name)
+    title = f"Распределение сумм по {title_text}"
+
+    backend = (backend or os.getenv("CHART_BACKEND") or "pillow").lower()
+    if backend == "matplotlib":
+        return _create_pie_chart_matplotlib(labels, values, title)
+    return _create_pie_chart_pillow(labels, values, title)
+
+
+def _create_pie_chart_pillow(labels: List[str], values: List[float], title: str) -> io.BytesIO:
+    """Рисует диаграмму напрямую через ImageDraw, без matplotlib."""
+    total_sum = sum(values)
+    num_items = len(values)
+
+    # Легенда снизу, две колонки при большом количестве элементов
+    ncol = 2 if num_items > 15 else 1
+    legend_rows = -(-num_items // ncol)
+    height = _LEGEND_TOP + legend_rows * _LEGEND_LINE + 20
+
+    img = Image.new("RGB", (_WIDTH, height), "white")
+    draw = ImageDraw.Draw(img)
+    title_font = _load_font(18, bold=True)
+    label_font = _load_font(12, bold=True)
+    legend_font = _load_font(11) if ncol == 1 else _load_font(10)
+
+    draw.text((_WIDTH // 2, _TITLE_HEIGHT // 2), title, font=title_font, fill="black", anchor="mm")
+
+    # Сектора идут против часовой стрелки от 75°, как в matplotlib;
+    # в Pillow углы отсчитываются по часовой, поэтому берем их со знаком минус
+    bounds = [-_START_ANGLE - a for a in accumulate((360 * v / total_sum for v in values), initial=0)]
+    x0, y0, x1, y1 = _PIE_BOX
+    cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+    label_radius = (x1 - x0) * 0.3
+    for i, value in enumerate(values):
+        start, end = bounds[i + 1], bounds[i]
+        draw.pieslice(_PIE_BOX, start, end, fill=_PALETTE[i % len(_PALETTE)], outline="white")
+        mid = radians((start + end) / 2)
+        draw.text(
+            (cx + label_radius * cos(mid), cy + label_radius * sin(mid)),
+            f"{value / total_sum * 100:.1f}%",
+            font=label_font,
+            fill="black",
+            anchor="mm",
+        )
+
+    col_width = _WIDTH // ncol
+    for i, text in enumerate(_legend_labels(labels, values, total_sum)):
+        col, row = divmod(i, legend_rows)
+        x = col * col_width + 20
+        y = _LEGEND_TOP + row * _LEGEND_LINE
+        draw.rectangle((x, y + 3, x + 12, y + 15), fill=_PALETTE[i % len(_PALETTE)], outline="gray")
+        draw.text((x + 18, y), text, font=legend_font, fill="black")
+
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", optimize=False, compress_level=1)
+    buf.seek(0)
+    return buf
+
+
+def _get_matplotlib_figure():
+    global _MPL_FIG
+    if _MPL_FIG is None:
+        from matplotlib.figure import Figure
+        _MPL_FIG = Figure(figsize=(6, 6))
+    return _MPL_FIG
+
+
+def _create_pie_chart_matplotlib(labels: List[str], values: List[float], title: str) -> io.BytesIO:
     # Вычисляем общую сумму для расчета процентов
     total_sum = sum(values)
-    
+
     # Динамический расчет размера фигуры на основе количества элементов
     num_items = len(labels)
     base_height = 6
     height = base_height + max(0, (num_items - 5) * 0.3)
-    fig, ax = plt.subplots(figsize=(6, height))
-    
-    # Создаем круговую диаграмму
-    colors = plt.cm.Set3(range(len(values)))  # Контрастные цвета
-    wedges, texts, autotexts = ax.pie(
-        values,
-        labels=None,  # Без подписей на секторах
-        autopct='%1.1f%%',  # Процент на секторах
-        startangle=75,
-        colors=colors,
-        textprops={'fontsize': 10, 'weight': 'bold'}
-    )
-    
-    # Заголовок
-    field_names = {
-        "category1": "категориям 1 уровня",
-        "category2": "категориям 2 уровня",
-        "category3": "категориям 3 уровня",
-        "organization": "организациям",
-        "description": "комментариям"
-    }
-    title_text = field_names.get(group_field_name, group_field_name)
-    ax.set_title(f"Распределение сумм по {title_text}", fontsize=14, fontweight='bold', pad=20)
-    
-    # Легенда снизу с названиями, суммами и процентами
-    legend_labels = []
-    for label, value in zip(labels, values):
-        percent = (value / total_sum) * 100 if total_sum > 0 else 0
-        legend_labels.append(f"{label}: {value:.2f} ₽ ({percent:.1f}%)")
-    
+
     # Оптимизация легенды: используем несколько колонок при большом количестве элементов
     ncol = 2 if num_items > 15 else 1
-    
+
     # Динамический расчет отступа легенды от графика
     legend_y_offset = -0.3 - max(0, (num_items - 10) * 0.02)
-    
-    ax.legend(
-        wedges,
-        legend_labels,
-        loc="center",
-        bbox_to_anchor=(0.5, legend_y_offset),
-        ncol=ncol,
-        fontsize=9
-    )
-    
+
     # Динамический расчет отступа снизу
     bottom_margin = 0.2 + min(0.5, num_items * 0.02)
-    plt.subplots_adjust(bottom=bottom_margin)
-    plt.tight_layout()
-    
-    # Сохраняем в BytesIO
+
     buf = io.BytesIO()
-    plt.savefig(buf, format='png', dpi=100, bbox_inches='tight')
-    buf.seek(0)
-    plt.close(fig)
-    
-    return buf
+    with _MPL_LOCK:
+        fig = _get_matplotlib_figure()
+        fig.clear()
+        fig.set_size_inches(6, height)
+        ax = fig.add_subplot(111)
 
+        # Создаем круговую диаграмму
+        wedges, texts, autotexts = ax.pie(
+            values,
+            labels=None,  # Без подписей на секторах
+            autopct='%1.1f%%',  # Процент на секторах
+            startangle=_START_ANGLE,
+            colors=[_PALETTE[i % len(_PALETTE)] for i in range(num_items)],
+            textprops={'fontsize': 10, 'weight': 'bold'}
+        )
 
+        ax.set_title(title, fontsize=14, fontweight='bold', pad=20)
 
+        ax.legend(
+            wedges,
+            _legend_labels(labels, values, total_sum),
+            loc="center",
+            bbox_to_anchor=(0.5, legend_y_offset),
+            ncol=ncol,
+            fontsize=9
+        )
 
+        fig.subplots_adjust(bottom=bottom_margin)
+        fig.tight_layout()
 
+        # Сохраняем в BytesIO
+        # Быстрое сжатие PNG; для длинных легенд снижаем dpi
+        fig.savefig(
+            buf,
+            format='png',
+            dpi=80 if num_items > 20 else 100,
+            bbox_inches='tight',
+            pil_kwargs={'compress_level': 1},
+        )
+    buf.seek(0)
 
+    return buf
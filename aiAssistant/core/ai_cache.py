@@ -0,0 +1,298 @@
+"""Caches of chat.completions responses: exact-match (in-process and SQLite) and semantic."""
+import hashlib
+import json
+import logging
+import os
+import pickle
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # orjson не обязателен
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Инструменты, меняющие данные: ответы с ними не кешируются
+_MUTATING_TOOLS = frozenset({"add_item_to_cheque", "delete_cheque"})
+_MUTATING_TOOL_PREFIXES = ("update_",)
+# Семантический кеш отдает только вызовы чтения
+_READ_ONLY_TOOL_PREFIXES = ("get_", "fetch_")
+
+_DIGITS_RE = re.compile(r"\d+")
+
+
+if orjson is not None:
+    def dumps_sorted(obj: Any) -> bytes:
+        """JSON с отсортированными ключами в UTF-8; на нем строятся ключи кеша."""
+        return orjson.dumps(obj, default=str, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+else:
+    def dumps_sorted(obj: Any) -> bytes:
+        """JSON с отсортированными ключами в UTF-8; на нем строятся ключи кеша."""
+        return json.dumps(obj, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+
+
+def is_read_only_tool(name: str) -> bool:
+    return name.startswith(_READ_ONLY_TOOL_PREFIXES)
+
+
+def make_cache_key(model: str, messages: List[Dict], tools: Optional[List[Dict]], temperature: float) -> str:
+    """sha256 от модели, сообщений, инструментов и температуры."""
+    raw = dumps_sorted({"m": model, "msgs": messages, "tools": tools, "t": temperature})
+    return hashlib.sha256(raw).hexdigest()
+
+
+def is_cacheable(payload: Dict[str, Any]) -> bool:
+    """Кешируются только успешные ответы без вызовов изменяющих инструментов."""
+    if payload.get("error"):
+        return False
+    for tool_call in payload.get("tool_calls") or ():
+        name = tool_call.function.name
+        if name in _MUTATING_TOOLS or name.startswith(_MUTATING_TOOL_PREFIXES):
+            return False
+    return True
+
+
+class ResponseCache:
+    """LRU с TTL: key -> (expiry_ts, payload)."""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 600.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expiry_ts, payload = entry
+            if expiry_ts < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return payload
+
+    def set(self, key: str, payload: Dict[str, Any], ttl: Optional[float] = None) -> None:
+        expiry_ts = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expiry_ts, payload)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteResponseCache:
+    """
+    Тот же кеш ответов, но в SQLite: переживает перезапуск и общий для нескольких процессов.
+
+    Ответ хранится pickle-ом (tool_calls - объекты SDK), просроченные записи
+    удаляет фоновый поток раз в purge_interval секунд.
+    """
+
+    def __init__(self, path: str, ttl: float = 600.0, purge_interval: float = 3600.0):
+        self.path = path
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, payload BLOB, expires_at INTEGER, hits INTEGER DEFAULT 0)"
+            )
+        self.purge()
+        self._stop = threading.Event()
+        self._purger = threading.Thread(target=self._purge_loop, args=(purge_interval,), name="llm-cache-purge", daemon=True)
+        self._purger.start()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "UPDATE llm_cache SET hits = hits + 1 WHERE key = ? AND expires_at >= ? RETURNING payload",
+                (key, int(time.time())),
+            ).fetchone()
+        if row is None:
+            return None
+        try:
+            return pickle.loads(row[0])
+        except Exception as e:
+            logger.warning("Broken llm_cache entry skipped: %s", e)
+            return None
+
+    def set(self, key: str, payload: Dict[str, Any], ttl: Optional[float] = None) -> None:
+        expires_at = int(time.time() + (self.ttl if ttl is None else ttl))
+        blob = pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, payload, expires_at, hits) VALUES (?, ?, ?, 0)",
+                (key, blob, expires_at),
+            )
+
+    def purge(self) -> int:
+        with self._lock:
+            return self._conn.execute("DELETE FROM llm_cache WHERE expires_at < strftime('%s','now')").rowcount
+
+    def _purge_loop(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            try:
+                self.purge()
+            except sqlite3.Error as e:
+                logger.warning("llm_cache purge failed: %s", e)
+
+    def close(self) -> None:
+        self._stop.set()
+        with self._lock:
+            self._conn.close()
+
+
+def last_user_text(messages: List[Dict]) -> Optional[str]:
+    for msg in reversed(messages):
+        if msg.get("role") == "user":
+            content = msg.get("content")
+            return content if isinstance(content, str) and content.strip() else None
+    return None
+
+
+def context_namespace(model: str, messages: List[Dict], tools: Optional[List[Dict]]) -> str:
+    """Семантический кеш сравнивает запросы только при одинаковых модели, инструментах и системных сообщениях."""
+    system = [m.get("content") for m in messages if m.get("role") == "system"]
+    return make_cache_key(model, system, tools, 0.0)
+
+
+class SemanticCache:
+    """
+    Кеш ответов по близости эмбеддинга последнего сообщения пользователя.
+
+    Векторы нормированы, поэтому сходство - это E @ q. Хранятся только ответы,
+    все tool_calls которых - инструменты чтения (get_*/fetch_*); числа в запросе
+    должны совпадать, чтобы "за 7 дней" не отдавалось на "за 10 дней".
+    """
+
+    def __init__(self, threshold: float = 0.92, max_size: int = 1000, ttl: float = 3600.0, path: Optional[str] = None):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self._vectors: Optional[np.ndarray] = None
+        self._meta: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        if path and os.path.isfile(path):
+            self.load(path)
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(v))
+        return v / norm if norm else v
+
+    @staticmethod
+    def is_read_only(payload: Dict[str, Any]) -> bool:
+        tool_calls = payload.get("tool_calls")
+        if not tool_calls or payload.get("error"):
+            return False
+        return all(is_read_only_tool(tc.function.name) for tc in tool_calls)
+
+    def lookup(self, namespace: str, text: str, vector) -> Optional[Dict[str, Any]]:
+        q = self._normalize(vector)
+        digits = _DIGITS_RE.findall(text)
+        now = time.time()
+        with self._lock:
+            if self._vectors is None or not self._meta or self._vectors.shape[1] != q.shape[0]:
+                return None
+            sims = self._vectors @ q
+            # Проверяем кандидатов выше порога от самого похожего
+            for i in np.argsort(sims)[::-1]:
+                if sims[i] < self.threshold:
+                    break
+                meta = self._meta[i]
+                if meta["namespace"] == namespace and meta["digits"] == digits and meta["expires"] >= now:
+                    return self._restore(meta["payload"])
+        return None
+
+    def add(self, namespace: str, text: str, vector, payload: Dict[str, Any]) -> None:
+        if not self.is_read_only(payload):
+            return
+        q = self._normalize(vector)
+        meta = {
+            "namespace": namespace,
+            "digits": _DIGITS_RE.findall(text),
+            "expires": time.time() + self.ttl,
+            "payload": self._dump(payload),
+        }
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != q.shape[0]:
+                self._vectors = q[None, :]
+                self._meta = [meta]
+                return
+            self._vectors = np.vstack((self._vectors, q))
+            self._meta.append(meta)
+            # Вытесняем самые старые записи
+            overflow = len(self._meta) - self.max_size
+            if overflow > 0:
+                self._vectors = self._vectors[overflow:]
+                self._meta = self._meta[overflow:]
+
+    @staticmethod
+    def _dump(payload: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "content": payload.get("content"),
+            "tool_calls": [
+                {"id": tc.id, "name": tc.function.name, "arguments": tc.function.arguments}
+                for tc in payload["tool_calls"]
+            ],
+        }
+
+    @staticmethod
+    def _restore(stored: Dict[str, Any]) -> Dict[str, Any]:
+        tool_calls = [
+            SimpleNamespace(id=tc["id"], type="function", function=SimpleNamespace(name=tc["name"], arguments=tc["arguments"]))
+            for tc in stored["tool_calls"]
+        ]
+        return {"content": stored["content"], "tool_calls": tool_calls, "error": None}
+
+    def save(self, path: Optional[str] = None) -> None:
+        path = path or self.path
+        if not path:
+            return
+        with self._lock:
+            if self._vectors is None or not self._meta:
+                return
+            vectors = self._vectors
+            meta = json.dumps(self._meta, ensure_ascii=False)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez(path, E=vectors, meta=np.array(meta))
+
+    def load(self, path: str) -> None:
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                vectors = data["E"].astype(np.float32)
+                meta = json.loads(str(data["meta"]))
+        except (OSError, ValueError, KeyError):
+            return
+        now = time.time()
+        keep = [i for i, m in enumerate(meta) if m.get("expires", 0) >= now]
+        with self._lock:
+            self._vectors = vectors[keep] if keep else None
+            self._meta = [meta[i] for i in keep]
+
+    def __len__(self) -> int:
+        return len(self._meta)
@@ -1,37 +1,270 @@
 """OpenAI API client for AI assistant."""
 import os
+import re
 import json
+import time
+import pickle
+import sqlite3
+import atexit
+import hashlib
+import random
+import asyncio
+import threading
+import inspect
 import logging
-from typing import List, Dict, Any, Optional
-from openai import OpenAI
+from functools import lru_cache
+from types import SimpleNamespace
+from typing import List, Dict, Any, Optional, Callable, Sequence, Tuple, Awaitable, Generator
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
 from openai import APIError, APITimeoutError, APIConnectionError, RateLimitError
 
+from aiAssistant.core.ai_cache import (
+    ResponseCache,
+    SQLiteResponseCache,
+    SemanticCache,
+    dumps_sorted,
+    make_cache_key,
+    is_cacheable,
+    is_read_only_tool,
+    last_user_text,
+    context_namespace,
+)
+from aiAssistant.core.rate_limiter import RateLimiter, estimate_tokens
+from aiAssistant.core.token_budget import trim_messages
+from aiAssistant.core.tools import TOOLS
+
+try:
+    import httpx
+except ImportError:  # лимиты пула задаются только при наличии httpx
+    httpx = None
+
+try:
+    import h2  # noqa: F401
+    _HTTP2 = True
+except ImportError:  # HTTP/2 требует пакет h2 (pip install httpx[http2])
+    _HTTP2 = False
+
 logger = logging.getLogger(__name__)
 
+# Сколько вызовов инструментов выполняется одновременно
+_TOOL_CONCURRENCY = 8
+
+# Повторы временных ошибок: экспоненциальная задержка с полным джиттером
+_MAX_ATTEMPTS = 3
+_BACKOFF_CAP = 8.0
+_RETRYABLE_ERRORS = (APITimeoutError, APIConnectionError, RateLimitError)
+
+# Код ошибки в ответе get_response; порядок важен: APITimeoutError наследует APIConnectionError, тот - APIError
+_ERROR_CODES = {
+    APITimeoutError: "timeout",
+    RateLimitError: "rate_limit",
+    APIConnectionError: "connection",
+    APIError: "api_error",
+}
+
+def _http_client_kwargs() -> Dict[str, Any]:
+    kwargs: Dict[str, Any] = {"http2": _HTTP2}
+    if httpx is not None:
+        kwargs["limits"] = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+    return kwargs
+
+
+# Один клиент на ключ на весь процесс: пул соединений и TLS-сессии переиспользуются.
+# Повторы делает get_response сам, встроенные повторы SDK отключены
+@lru_cache(maxsize=4)
+def _get_openai(api_key: str) -> OpenAI:
+    return OpenAI(api_key=api_key, timeout=90.0, max_retries=0, http_client=DefaultHttpxClient(**_http_client_kwargs()))
+
+
+@lru_cache(maxsize=4)
+def _get_async_openai(api_key: str) -> AsyncOpenAI:
+    return AsyncOpenAI(api_key=api_key, timeout=90.0, max_retries=0, http_client=DefaultAsyncHttpxClient(**_http_client_kwargs()))
+
+
+# Один лимитер на ключ: бот и парсер чеков расходуют общие RPM/TPM аккаунта
+@lru_cache(maxsize=4)
+def _get_rate_limiter(api_key: str) -> RateLimiter:
+    from config import OPENAI_RPM, OPENAI_TPM
+    return RateLimiter(OPENAI_RPM, OPENAI_TPM)
+
+
+# Один SQLite-кеш на файл на процесс: одно соединение, одна очистка при старте и один поток очистки
+_persistent_caches: Dict[str, SQLiteResponseCache] = {}
+_persistent_caches_lock = threading.Lock()
+
+
+def _get_persistent_cache(path: str) -> Optional[SQLiteResponseCache]:
+    with _persistent_caches_lock:
+        cache = _persistent_caches.get(path)
+        if cache is None:
+            try:
+                cache = _persistent_caches[path] = SQLiteResponseCache(path, ttl=600)
+            except sqlite3.Error as e:
+                logger.warning("Persistent LLM cache disabled: %s", e)
+        return cache
+
+
+def close_persistent_caches() -> None:
+    """Останавливает потоки очистки и закрывает соединения SQLite-кешей ответов."""
+    with _persistent_caches_lock:
+        caches = list(_persistent_caches.values())
+        _persistent_caches.clear()
+    for cache in caches:
+        cache.close()
+
+
+# Проверенные ключи запоминаются: повторные AIClient() не проверяют ключ заново
+@lru_cache(maxsize=4)
+def _validate_api_key(api_key: Optional[str]) -> None:
+    if not api_key or api_key == "YOUR_OPENAI_KEY" or api_key.strip() == "":
+        raise RuntimeError(
+            "OPENAI_API_KEY не установлен!\n"
+            "Установите ключ одним из способов:\n"
+            "1. В файле .env: OPENAI_API_KEY=sk-...\n"
+            "2. В config.py: раскомментируйте строку 32\n"
+            "3. Глобальная переменная: set OPENAI_API_KEY=sk-..."
+        )
+
+    if not api_key.startswith("sk-"):
+        raise RuntimeError(
+            f"OPENAI_API_KEY имеет неверный формат!\n"
+            f"Ключ должен начинаться с 'sk-'\n"
+            f"Текущее значение: {api_key[:10]}..."
+        )
+
+
+def _warmup(client: OpenAI, model: str) -> None:
+    try:
+        client.models.retrieve(model, timeout=10.0)
+    except Exception as e:
+        logger.debug("OpenAI warmup failed: %s", e)
+
+
+# Прогрев пула один раз на ключ: TLS-рукопожатие делается до первого запроса пользователя
+@lru_cache(maxsize=4)
+def _start_warmup(api_key: str, model: str) -> threading.Thread:
+    thread = threading.Thread(target=_warmup, args=(_get_openai(api_key), model), name="openai-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+# Признаки ошибок в тексте исключения: одно сканирование, категория по имени группы
+_ERR_RE = re.compile(
+    r"(?P<timeout>timeout|timed out)|(?P<rate>rate limit|429)|(?P<forbid>403|forbidden|unsupported_country|region)|(?P<conn>connection|network)",
+    re.IGNORECASE,
+)
+_STATUS_KINDS = {403: "forbid", 401: "auth", 429: "rate"}
+_ERROR_MESSAGES = {
+    "timeout": "Запрос занял слишком много времени. Попробуйте упростить запрос или повторить позже",
+    "rate": "Слишком много запросов. Подождите немного и попробуйте снова",
+    "forbid": "Сейчас не могу обработать запрос. Попробуйте позже или уточните запрос",
+    "auth": "Проблема с доступом. Попробуйте позже",
+    "conn": "Проблема с подключением. Проверьте интернет и попробуйте снова",
+    "unknown": "Не удалось обработать запрос. Попробуйте переформулировать или повторить позже",
+}
+
+
+def _classify_error(error: Exception) -> Optional[str]:
+    """Категория ошибки в прежнем порядке приоритетов: тип исключения, затем признаки в тексте."""
+    if isinstance(error, APITimeoutError):
+        return "timeout"
+    kinds = {m.lastgroup for m in _ERR_RE.finditer(str(error))}
+    if "timeout" in kinds:
+        return "timeout"
+    if isinstance(error, RateLimitError) or "rate" in kinds:
+        return "rate"
+    if isinstance(error, APIError):
+        kind = _STATUS_KINDS.get(getattr(error, "status_code", None))
+        if kind:
+            return kind
+    if "forbid" in kinds:
+        return "forbid"
+    if isinstance(error, APIConnectionError) or "conn" in kinds:
+        return "conn"
+    return None
+
+
+def _retry_delay(attempt: int, error: Exception) -> float:
+    """Retry-After из ответа, если он есть, иначе min(cap, 2**attempt) * random()."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return min(_BACKOFF_CAP, max(0.0, float(retry_after)))
+        except ValueError:
+            pass
+    return min(_BACKOFF_CAP, 2 ** attempt) * random.random()
+
+
+# Описание инструментов собирается один раз при импорте (см. aiAssistant/core/tools.py)
+_TOOLS_DEFINITION: Tuple[Dict, ...] = tuple(TOOLS)
+# Сериализованный вид и его хеш считаются один раз: ключ кеша ответов не сериализует инструменты заново
+_TOOLS_JSON = dumps_sorted(_TOOLS_DEFINITION)
+_TOOLS_DIGEST = hashlib.sha256(_TOOLS_JSON).hexdigest()
+
+
+def _user_kwargs(user: Optional[str]) -> Dict[str, str]:
+    """
+    Стабильный идентификатор пользователя для OpenAI (поле user), в виде хеша.
+
+    Вместе с неизменным префиксом (системный промпт и _TOOLS_DEFINITION) помогает
+    запросам одного пользователя попадать в кеш префикса на стороне OpenAI.
+    """
+    if not user:
+        return {}
+    return {"user": hashlib.sha256(user.encode("utf-8")).hexdigest()[:32]}
+
+
+def _tools_key(tools):
+    return _TOOLS_DIGEST if tools is _TOOLS_DEFINITION else tools
+
+
+class _StreamAccumulator:
+    """Собирает content и tool_calls из дельт потока в ответ той же формы, что у get_response."""
+
+    def __init__(self):
+        self._parts: List[str] = []
+        self._tool_calls: Dict[int, Dict[str, str]] = {}
+
+    def feed(self, chunk) -> Optional[str]:
+        """Учитывает кусок потока; возвращает текст для показа или None."""
+        if not chunk.choices:
+            return None
+        delta = chunk.choices[0].delta
+        for tc in delta.tool_calls or ():
+            entry = self._tool_calls.setdefault(tc.index, {"id": "", "name": "", "arguments": ""})
+            if tc.id:
+                entry["id"] = tc.id
+            if tc.function is not None:
+                entry["name"] += tc.function.name or ""
+                entry["arguments"] += tc.function.arguments or ""
+        if not delta.content:
+            return None
+        self._parts.append(delta.content)
+        # Пока собираются вызовы инструментов, текст не показываем
+        return None if self._tool_calls else delta.content
+
+    def result(self) -> Dict[str, Any]:
+        tool_calls = [
+            SimpleNamespace(
+                id=entry["id"],
+                type="function",
+                function=SimpleNamespace(name=entry["name"], arguments=entry["arguments"]),
+            )
+            for _, entry in sorted(self._tool_calls.items())
+        ]
+        return {"content": "".join(self._parts) or None, "tool_calls": tool_calls or None, "error": None}
+
 
 class AIClient:
     def __init__(self, api_key: Optional[str] = None):
         from config import OPENAI_API_KEY
         self.api_key = api_key or OPENAI_API_KEY
-        
-        if not self.api_key or self.api_key == "YOUR_OPENAI_KEY" or self.api_key.strip() == "":
-            raise RuntimeError(
-                "OPENAI_API_KEY не установлен!\n"
-                "Установите ключ одним из способов:\n"
-                "1. В файле .env: OPENAI_API_KEY=sk-...\n"
-                "2. В config.py: раскомментируйте строку 32\n"
-                "3. Глобальная переменная: set OPENAI_API_KEY=sk-..."
-            )
-        
-        if not self.api_key.startswith("sk-"):
-            raise RuntimeError(
-                f"OPENAI_API_KEY имеет неверный формат!\n"
-                f"Ключ должен начинаться с 'sk-'\n"
-                f"Текущее значение: {self.api_key[:10]}..."
-            )
-        
+        _validate_api_key(self.api_key)
+
         try:
-            self.client = OpenAI(api_key=self.api_key, timeout=90.0)
+            self.client = _get_openai(self.api_key)
+            self.aclient = _get_async_openai(self.api_key)
         except Exception as e:
             raise RuntimeError(
                 f"Ошибка инициализации OpenAI клиента!\n"
@@ -40,529 +273,276 @@ class AIClient:
             )
         
         self.model = "gpt-4o-mini"
+        self.temperature = 0.3
+        # Повторяющиеся запросы отдаются из кеша без обращения к API
+        self._response_cache = ResponseCache(max_size=1024, ttl=600)
+        # Второй уровень в SQLite переживает перезапуск бота
+        from config import LLM_CACHE_PATH
+        self._persistent_cache: Optional[SQLiteResponseCache] = None
+        if LLM_CACHE_PATH:
+            self._persistent_cache = _get_persistent_cache(LLM_CACHE_PATH)
+
+        # Ограничение частоты до запроса, а не реакция на 429
+        self._rate_limiter = _get_rate_limiter(self.api_key)
+        from config import OPENAI_MAX_INPUT_TOKENS
+        self.max_input_tokens = OPENAI_MAX_INPUT_TOKENS
+
+        # Перефразированные запросы (по эмбеддингу) - опционально, см. SEMANTIC_CACHE
+        from config import SEMANTIC_CACHE_ENABLED, SEMANTIC_CACHE_PATH
+        self.embedding_model = "text-embedding-3-small"
+        self._semantic_cache: Optional[SemanticCache] = None
+        if SEMANTIC_CACHE_ENABLED:
+            self._semantic_cache = SemanticCache(path=SEMANTIC_CACHE_PATH)
+            atexit.register(self._semantic_cache.save)
+
+        from config import OPENAI_WARMUP
+        if OPENAI_WARMUP:
+            _start_warmup(self.api_key, self.model)
     
+    async def awarmup(self) -> None:
+        """Прогревает пул AsyncOpenAI; вызывается в цикле событий бота, к которому привязаны его соединения."""
+        try:
+            await self.aclient.models.retrieve(self.model, timeout=10.0)
+        except Exception as e:
+            logger.debug("OpenAI async warmup failed: %s", e)
+
     def _get_user_friendly_error_message(self, error: Exception) -> str:
         """Преобразует техническую ошибку в понятное сообщение для пользователя."""
-        error_str = str(error).lower()
-        error_type = type(error).__name__
-        
-        if isinstance(error, APITimeoutError) or "timeout" in error_str or "timed out" in error_str:
-            return "Запрос занял слишком много времени. Попробуйте упростить запрос или повторить позже"
-        
-        if isinstance(error, RateLimitError) or "rate limit" in error_str or "429" in error_str:
-            return "Слишком много запросов. Подождите немного и попробуйте снова"
-        
-        if isinstance(error, APIError):
-            status_code = getattr(error, 'status_code', None)
-            if status_code == 403:
-                return "Сейчас не могу обработать запрос. Попробуйте позже или уточните запрос"
-            if status_code == 401:
-                return "Проблема с доступом. Попробуйте позже"
-            if status_code == 429:
-                return "Слишком много запросов. Подождите немного и попробуйте снова"
-        
-        if "403" in error_str or "forbidden" in error_str or "unsupported_country" in error_str or "region" in error_str:
-            return "Сейчас не могу обработать запрос. Попробуйте позже или уточните запрос"
-        
-        if isinstance(error, APIConnectionError) or "connection" in error_str or "network" in error_str:
-            return "Проблема с подключением. Проверьте интернет и попробуйте снова"
-        
-        logger.error(f"Unhandled API error type: {error_type}, message: {str(error)}")
-        return "Не удалось обработать запрос. Попробуйте переформулировать или повторить позже"
+        kind = _classify_error(error)
+        if kind is None:
+            logger.error("Unhandled API error type: %s, message: %s", type(error).__name__, error)
+            kind = "unknown"
+        return _ERROR_MESSAGES[kind]
     
-    def get_response(self, messages: List[Dict[str, str]], tools: Optional[List[Dict]] = None) -> Dict[str, Any]:
+    def _embed(self, text: str) -> List[float]:
+        response = self.client.embeddings.create(model=self.embedding_model, input=text)
+        return response.data[0].embedding
+
+    async def _aembed(self, text: str) -> List[float]:
+        response = await self.aclient.embeddings.create(model=self.embedding_model, input=text)
+        return response.data[0].embedding
+
+    def _semantic_lookup(self, messages: List[Dict[str, str]], tools: Optional[List[Dict]]):
+        """(hit, namespace, text, vector) или None, если семантический кеш выключен или неприменим."""
+        text = last_user_text(messages) if self._semantic_cache is not None else None
+        if text is None:
+            return None
         try:
-            if tools:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    tools=tools,
-                    tool_choice="auto",
-                    temperature=0.3,
-                    timeout=90.0
-                )
-            else:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    temperature=0.3,
-                    timeout=90.0
-                )
-            
-            return {
-                "content": response.choices[0].message.content,
-                "tool_calls": response.choices[0].message.tool_calls if hasattr(response.choices[0].message, 'tool_calls') else None,
-                "error": None
-            }
-        except APITimeoutError as e:
-            logger.error(f"API timeout error: {str(e)}")
-            user_message = self._get_user_friendly_error_message(e)
-            return {"content": user_message, "tool_calls": None, "error": "timeout"}
-        except RateLimitError as e:
-            logger.error(f"Rate limit error: {str(e)}")
-            user_message = self._get_user_friendly_error_message(e)
-            return {"content": user_message, "tool_calls": None, "error": "rate_limit"}
-        except APIError as e:
-            logger.error(f"API error (code: {getattr(e, 'status_code', 'unknown')}): {str(e)}")
-            user_message = self._get_user_friendly_error_message(e)
-            return {"content": user_message, "tool_calls": None, "error": "api_error"}
-        except APIConnectionError as e:
-            logger.error(f"API connection error: {str(e)}")
-            user_message = self._get_user_friendly_error_message(e)
-            return {"content": user_message, "tool_calls": None, "error": "connection"}
+            vector = self._embed(text)
         except Exception as e:
-            logger.error(f"Unexpected error in get_response: {type(e).__name__}: {str(e)}")
-            user_message = self._get_user_friendly_error_message(e)
-            return {"content": user_message, "tool_calls": None, "error": "unknown"}
-    
-    def get_tools_definition(self) -> List[Dict]:
-        return [
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_last_n_days",
-                    "description": "Получить записи за последние N дней (включая сегодня). Например: 'за последние 7 дней' - используй эту функцию с n=7",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "n": {"type": "integer", "description": "Количество дней"}
-                        },
-                        "required": ["n"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "export_all_to_excel",
-                    "description": "Выгрузить все записи текущего пользователя в Excel-файл (.dbData/Report.xlsx)",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {},
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "export_to_excel_by_period",
-                    "description": "Выгрузить записи за период в Excel-файл (.dbData/Report.xlsx). Используй совместно с датами из хелперов периодов.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "start_date": {"type": "string", "description": "Дата начала DD.MM.YYYY"},
-                            "end_date": {"type": "string", "description": "Дата конца DD.MM.YYYY"}
-                        },
-                        "required": ["start_date", "end_date"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "export_group_items_to_excel",
-                    "description": "Выгрузить в Excel все детальные записи (карточки товаров) по указанному сгруппированному значению из предыдущего запроса. Использует период (даты) из последнего запроса группировки. Например: 'выгрузи в эксель все карточки по категории Продукты питания' - выгрузит все записи где category1='Продукты питания' за тот же период, что был в предыдущем запросе.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "group_value": {"type": "string", "description": "Значение группы для фильтрации (например: 'Продукты питания', 'Электроника', название организации и т.д.). Должно точно совпадать с одним из значений в результатах предыдущего запроса группировки."}
-                        },
-                        "required": ["group_value"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_current_week",
-                    "description": "Получить записи за текущую неделю (с понедельника по сегодня). Используй для запроса 'за неделю'",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {}
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_current_month",
-                    "description": "Получить записи за текущий месяц (с 1 числа по сегодня). Используй для запроса 'за месяц'",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {}
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_yesterday",
-                    "description": "Получить записи за вчерашний день. Используй для запросов вида 'вчера', 'вчерашний день', 'last day'",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {}
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_previous_month",
-                    "description": "Получить записи за прошлый календарный месяц (полностью). Используй для запросов 'прошлый месяц', 'last month'",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {}
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_previous_year",
-                    "description": "Получить записи за предыдущий календарный год. Используй для запросов 'прошлый год', 'last year'",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {}
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "fetch_by_period",
-                    "description": "Получить записи покупок за конкретный период. Используй когда пользователь указывает точные даты",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "start_date": {"type": "string", "description": "Дата начала в формате DD.MM.YYYY"},
-                            "end_date": {"type": "string", "description": "Дата конца в формате DD.MM.YYYY"}
-                        },
-                        "required": ["start_date", "end_date"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_summary_last_n_days",
-                    "description": "Получить общую сумму за последние N дней. Используй для 'общая сумма за 7 дней', 'сколько потратил за 30 дней' и т.п.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "n": {"type": "integer", "description": "Количество дней"}
-                        },
-                        "required": ["n"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_summary_week",
-                    "description": "Получить общую сумму за текущую неделю (с понедельника). Используй для 'сумма за неделю'",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {}
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_summary_month",
-                    "description": "Получить общую сумму за текущий месяц. Используй для 'сумма за месяц'",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {}
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_summary",
-                    "description": "Получить общую сумму за конкретный период. Используй когда пользователь указывает точные даты",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "start_date": {"type": "string", "description": "Дата начала в формате DD.MM.YYYY"},
-                            "end_date": {"type": "string", "description": "Дата конца в формате DD.MM.YYYY"}
-                        },
-                        "required": ["start_date", "end_date"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_cheque_by_id",
-                    "description": "Получить чек текущего пользователя по номеру",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "chequeid": {"type": "integer", "description": "Номер чека"}
-                        },
-                        "required": ["chequeid"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_last_cheque",
-                    "description": "Получить последний чек текущего пользователя",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {}
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "delete_cheque",
-                    "description": "Удалить чек текущего пользователя по номеру. Если номер не указан, используется последний просмотренный чек",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "chequeid": {"type": "integer", "description": "Номер чека (необязательно, если не указан - используется последний просмотренный)"}
-                        },
-                        "required": []
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "add_item_to_cheque",
-                    "description": "Добавить новую товарную позицию в существующий чек. Автоматически заполняются дата, организация из чека, категории через AI-классификацию. Если номер чека не указан, используется последний просмотренный чек",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "chequeid": {"type": "integer", "description": "Номер чека (необязательно, если не указан - используется последний просмотренный)"},
-                            "product_name": {"type": "string", "description": "Название товара"},
-                            "price": {"type": "number", "description": "Цена товара"},
-                            "quantity": {"type": "number", "description": "Количество (по умолчанию 1, допускает дробные значения)"},
-                            "discount": {"type": "number", "description": "Скидка (по умолчанию 0)"}
-                        },
-                        "required": ["product_name", "price"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "fetch_by_category",
-                    "description": "Получить покупки текущего пользователя по категории",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "level": {"type": "integer", "description": "Уровень категории (1, 2 или 3)"},
-                            "name": {"type": "string", "description": "Название категории"}
-                        },
-                        "required": ["level", "name"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "fetch_by_organization",
-                    "description": "Получить покупки текущего пользователя по организации. Ищет по вхождению текста (например: 'лента' найдет 'Лента', 'ЛЕНТА', 'Магазин Лента' и т.д.)",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "organization": {"type": "string", "description": "Название или часть названия организации"}
-                        },
-                        "required": ["organization"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "fetch_by_product_name",
-                    "description": "Получить покупки по названию товара. Ищет по вхождению текста (например: 'молоко' найдет 'Молоко', 'Молоко 2.5%', 'Молоко домик' и т.д.)",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "product_name": {"type": "string", "description": "Название или часть названия товара"}
-                        },
-                        "required": ["product_name"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "fetch_by_description",
-                    "description": "Получить покупки по комментарию/описанию. Ищет по вхождению текста в поле description",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "description": {"type": "string", "description": "Текст для поиска в комментариях"}
-                        },
-                        "required": ["description"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "update_description_by_cheque",
-                    "description": "Добавить или изменить комментарий к чеку текущего пользователя. Если номер чека не указан, используется последний просмотренный чек. ВСЕГДА передавай параметр 'description' с текстом комментария",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "chequeid": {"type": "integer", "description": "Номер чека (необязательно, если не указан - используется последний просмотренный)"},
-                            "description": {"type": "string", "description": "Текст комментария (обязательно, например: 'авоська', 'рабочие расходы' и т.д.)"}
-                        },
-                        "required": ["description"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "update_description_by_organization",
-                    "description": "Добавить комментарий ко всем чекам текущего пользователя в указанной организации",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "organization": {"type": "string", "description": "Название организации"},
-                            "description": {"type": "string", "description": "Текст комментария"}
-                        },
-                        "required": ["organization", "description"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "update_record",
-                    "description": "Обновить конкретное поле записи по ID. ID = номер позиции (строки) в чеке, который показывается рядом с товаром. Используй для команд вида 'Позиция 102 измени цену 123.45' или 'Измени наименование товара в позиции 102 …'",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "record_id": {"type": "integer", "description": "ID записи"},
-                            "field": {"type": "string", "description": "Название поля (price, discount, product_name, description, quantity, category1, category2, category3, organization, date)"},
-                            "value": {"type": "string", "description": "Новое значение"}
-                        },
-                        "required": ["record_id", "field", "value"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "update_field_by_cheque",
-                    "description": "Обновить поле у всех записей конкретного чека текущего пользователя (например, дату у чека). Если номер чека не указан, используется последний просмотренный чек",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "chequeid": {"type": "integer", "description": "Номер чека (необязательно, если не указан - используется последний просмотренный)"},
-                            "field": {"type": "string", "description": "Поле (например, date, description, organization)"},
-                            "value": {"type": "string", "description": "Новое значение"}
-                        },
-                        "required": ["field", "value"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_grouped_by_category1",
-                    "description": "Группировка по категории 1 уровня за период. Показывает сумму по каждой категории. Если пользователь просит график или диаграмму, используй эту функцию - она автоматически построит круговую диаграмму. ВАЖНО: всегда используй текущий год (2025) в датах, никогда не используй старые годы типа 2023!",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "start_date": {"type": "string", "description": "Дата начала DD.MM.YYYY. ВСЕГДА используй текущий год (2025), никогда не используй старые годы!"},
-                            "end_date": {"type": "string", "description": "Дата конца DD.MM.YYYY. ВСЕГДА используй текущий год (2025), никогда не используй старые годы!"}
-                        },
-                        "required": ["start_date", "end_date"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_grouped_by_category2",
-                    "description": "Группировка по категории 2 уровня за период. Показывает сумму по каждой категории. Если пользователь просит график или диаграмму, используй эту функцию - она автоматически построит круговую диаграмму. ВАЖНО: всегда используй текущий год (2025) в датах, никогда не используй старые годы типа 2023!",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "start_date": {"type": "string", "description": "Дата начала DD.MM.YYYY. ВСЕГДА используй текущий год (2025), никогда не используй старые годы!"},
-                            "end_date": {"type": "string", "description": "Дата конца DD.MM.YYYY. ВСЕГДА используй текущий год (2025), никогда не используй старые годы!"}
-                        },
-                        "required": ["start_date", "end_date"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_grouped_stats_filtered",
-                    "description": "Группировка по полю (category1/2/3, organization, description) за период с дополнительными фильтрами (например: category1=Напитки). Если пользователь просит график или диаграмму, используй эту функцию - она автоматически построит круговую диаграмму. ВАЖНО: всегда используй текущий год (2025) в датах, никогда не используй старые годы типа 2023!",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "field": {"type": "string", "description": "Поле группировки: category1|category2|category3|organization|description"},
-                            "start_date": {"type": "string", "description": "Дата начала DD.MM.YYYY. ВСЕГДА используй текущий год (2025), никогда не используй старые годы!"},
-                            "end_date": {"type": "string", "description": "Дата конца DD.MM.YYYY. ВСЕГДА используй текущий год (2025), никогда не используй старые годы!"},
-                            "filters": {
-                                "type": "object",
-                                "description": "Доп. фильтры: словарь {field: value}",
-                                "additionalProperties": {"type": "string"}
-                            }
-                        },
-                        "required": ["field", "start_date", "end_date"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_grouped_by_category3",
-                    "description": "Группировка по категории 3 уровня за период. Показывает сумму по каждой категории. Если пользователь просит график или диаграмму, используй эту функцию - она автоматически построит круговую диаграмму. ВАЖНО: всегда используй текущий год (2025) в датах, никогда не используй старые годы типа 2023!",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "start_date": {"type": "string", "description": "Дата начала DD.MM.YYYY. ВСЕГДА используй текущий год (2025), никогда не используй старые годы!"},
-                            "end_date": {"type": "string", "description": "Дата конца DD.MM.YYYY. ВСЕГДА используй текущий год (2025), никогда не используй старые годы!"}
-                        },
-                        "required": ["start_date", "end_date"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_grouped_by_organization",
-                    "description": "Группировка по организациям за период. Показывает сумму по каждой организации. Если пользователь просит график или диаграмму, используй эту функцию - она автоматически построит круговую диаграмму. ВАЖНО: всегда используй текущий год (2025) в датах, никогда не используй старые годы типа 2023!",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "start_date": {"type": "string", "description": "Дата начала DD.MM.YYYY. ВСЕГДА используй текущий год (2025), никогда не используй старые годы!"},
-                            "end_date": {"type": "string", "description": "Дата конца DD.MM.YYYY. ВСЕГДА используй текущий год (2025), никогда не используй старые годы!"}
-                        },
-                        "required": ["start_date", "end_date"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_grouped_by_description",
-                    "description": "Группировка по комментариям/тегам за период. Показывает сумму по каждому комментарию. Если пользователь просит график или диаграмму, используй эту функцию - она автоматически построит круговую диаграмму. ВАЖНО: всегда используй текущий год (2025) в датах, никогда не используй старые годы типа 2023!",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "start_date": {"type": "string", "description": "Дата начала DD.MM.YYYY. ВСЕГДА используй текущий год (2025), никогда не используй старые годы!"},
-                            "end_date": {"type": "string", "description": "Дата конца DD.MM.YYYY. ВСЕГДА используй текущий год (2025), никогда не используй старые годы!"}
-                        },
-                        "required": ["start_date", "end_date"]
-                    }
-                }
-            }
-        ]
+            logger.warning("Embedding request failed, semantic cache skipped: %s", e)
+            return None
+        namespace = context_namespace(self.model, messages, _tools_key(tools))
+        return self._semantic_cache.lookup(namespace, text, vector), namespace, text, vector
+
+    async def _asemantic_lookup(self, messages: List[Dict[str, str]], tools: Optional[List[Dict]]):
+        text = last_user_text(messages) if self._semantic_cache is not None else None
+        if text is None:
+            return None
+        try:
+            vector = await self._aembed(text)
+        except Exception as e:
+            logger.warning("Embedding request failed, semantic cache skipped: %s", e)
+            return None
+        namespace = context_namespace(self.model, messages, _tools_key(tools))
+        return self._semantic_cache.lookup(namespace, text, vector), namespace, text, vector
+
+    def _cache_get(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        cached = self._response_cache.get(cache_key)
+        if cached is not None or self._persistent_cache is None:
+            return cached
+        try:
+            cached = self._persistent_cache.get(cache_key)
+        except sqlite3.Error as e:
+            logger.warning("Persistent LLM cache read failed: %s", e)
+            return None
+        if cached is not None:
+            self._response_cache.set(cache_key, cached)
+        return cached
+
+    def _store_result(self, cache_key: str, semantic, result: Dict[str, Any]) -> None:
+        if is_cacheable(result):
+            self._response_cache.set(cache_key, result)
+            if self._persistent_cache is not None:
+                try:
+                    self._persistent_cache.set(cache_key, result)
+                except (sqlite3.Error, pickle.PicklingError, TypeError) as e:
+                    logger.warning("Persistent LLM cache write failed: %s", e)
+            if semantic is not None:
+                _, namespace, text, vector = semantic
+                self._semantic_cache.add(namespace, text, vector, result)
+
+    def _error_result(self, e: Exception) -> Dict[str, Any]:
+        """Логирует ошибку API и возвращает ответ с сообщением для пользователя."""
+        error_code = next((code for cls, code in _ERROR_CODES.items() if isinstance(e, cls)), "unknown")
+        logger.error("API error [%s] (code: %s): %s: %s", error_code, getattr(e, "status_code", None), type(e).__name__, e)
+        user_message = self._get_user_friendly_error_message(e)
+        return {"content": user_message, "tool_calls": None, "error": error_code}
+
+    def _trim(self, messages: List[Dict[str, str]], max_in_tokens: Optional[int] = None) -> List[Dict[str, str]]:
+        """Обрезает старую историю под бюджет входных токенов (см. OPENAI_MAX_INPUT_TOKENS)."""
+        limit = self.max_input_tokens if max_in_tokens is None else max_in_tokens
+        trimmed = trim_messages(messages, limit, self.model)
+        if len(trimmed) < len(messages):
+            logger.info("Context trimmed: %d -> %d messages", len(messages), len(trimmed))
+        return trimmed
 
+    def _request_kwargs(self, messages: List[Dict[str, str]], tools: Optional[List[Dict]], extra: Dict[str, Any]) -> Dict[str, Any]:
+        kwargs = {"model": self.model, "messages": messages, "temperature": self.temperature, "timeout": 90.0, **extra}
+        if tools:
+            kwargs["tools"] = tools
+            kwargs["tool_choice"] = "auto"
+        return kwargs
+
+    def _create(self, messages: List[Dict[str, str]], tools: Optional[List[Dict]], **extra):
+        """chat.completions.create с ограничением частоты и повтором временных ошибок."""
+        messages = self._trim(messages)
+        kwargs = self._request_kwargs(messages, tools, extra)
+        for attempt in range(_MAX_ATTEMPTS):
+            try:
+                self._rate_limiter.acquire(1, estimate_tokens(messages))
+                return self.client.chat.completions.create(**kwargs)
+            except _RETRYABLE_ERRORS as e:
+                if attempt == _MAX_ATTEMPTS - 1:
+                    raise
+                delay = _retry_delay(attempt, e)
+                logger.warning("Transient API error (%s), retry %d in %.2fs", type(e).__name__, attempt + 1, delay)
+                time.sleep(delay)
+
+    async def _acreate(self, messages: List[Dict[str, str]], tools: Optional[List[Dict]], **extra):
+        messages = self._trim(messages)
+        kwargs = self._request_kwargs(messages, tools, extra)
+        for attempt in range(_MAX_ATTEMPTS):
+            try:
+                await self._rate_limiter.aacquire(1, estimate_tokens(messages))
+                return await self.aclient.chat.completions.create(**kwargs)
+            except _RETRYABLE_ERRORS as e:
+                if attempt == _MAX_ATTEMPTS - 1:
+                    raise
+                delay = _retry_delay(attempt, e)
+                logger.warning("Transient API error (%s), retry %d in %.2fs", type(e).__name__, attempt + 1, delay)
+                await asyncio.sleep(delay)
+
+    def get_response(self, messages: List[Dict[str, str]], tools: Optional[List[Dict]] = None, user: Optional[str] = None) -> Dict[str, Any]:
+        cache_key = make_cache_key(self.model, messages, _tools_key(tools), self.temperature)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+
+        semantic = self._semantic_lookup(messages, tools)
+        if semantic is not None and semantic[0] is not None:
+            return semantic[0]
+        try:
+            response = self._create(messages, tools, **_user_kwargs(user))
+            message = response.choices[0].message
+            result = {"content": message.content, "tool_calls": message.tool_calls, "error": None}
+            self._store_result(cache_key, semantic, result)
+            return result
+        except Exception as e:
+            return self._error_result(e)
+
+    async def aget_response(self, messages: List[Dict[str, str]], tools: Optional[List[Dict]] = None, user: Optional[str] = None) -> Dict[str, Any]:
+        """Асинхронный вариант get_response через AsyncOpenAI: не занимает поток на время запроса."""
+        cache_key = make_cache_key(self.model, messages, _tools_key(tools), self.temperature)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+
+        semantic = await self._asemantic_lookup(messages, tools)
+        if semantic is not None and semantic[0] is not None:
+            return semantic[0]
+        try:
+            response = await self._acreate(messages, tools, **_user_kwargs(user))
+            message = response.choices[0].message
+            result = {"content": message.content, "tool_calls": message.tool_calls, "error": None}
+            self._store_result(cache_key, semantic, result)
+            return result
+        except Exception as e:
+            return self._error_result(e)
+
+    def stream_response(self, messages: List[Dict[str, str]], tools: Optional[List[Dict]] = None, user: Optional[str] = None) -> Generator[str, None, Dict[str, Any]]:
+        """
+        Потоковый вариант get_response: отдаёт куски текста по мере генерации.
+
+        Итоговый ответ в форме get_response возвращается как значение генератора
+        (StopIteration.value, удобно через ``result = yield from ...``).
+        """
+        cache_key = make_cache_key(self.model, messages, _tools_key(tools), self.temperature)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+
+        semantic = self._semantic_lookup(messages, tools)
+        if semantic is not None and semantic[0] is not None:
+            return semantic[0]
+        try:
+            accumulator = _StreamAccumulator()
+            for chunk in self._create(messages, tools, stream=True, **_user_kwargs(user)):
+                text = accumulator.feed(chunk)
+                if text:
+                    yield text
+            result = accumulator.result()
+        except Exception as e:
+            return self._error_result(e)
+        self._store_result(cache_key, semantic, result)
+        return result
+
+    async def astream_response(
+        self,
+        messages: List[Dict[str, str]],
+        tools: Optional[List[Dict]] = None,
+        on_delta: Optional[Callable[[str], Awaitable[None]]] = None,
+        user: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Асинхронный потоковый ответ: каждый кусок текста передаётся в on_delta, возвращается ответ как у aget_response."""
+        cache_key = make_cache_key(self.model, messages, _tools_key(tools), self.temperature)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+
+        semantic = await self._asemantic_lookup(messages, tools)
+        if semantic is not None and semantic[0] is not None:
+            return semantic[0]
+        try:
+            accumulator = _StreamAccumulator()
+            async for chunk in await self._acreate(messages, tools, stream=True, **_user_kwargs(user)):
+                text = accumulator.feed(chunk)
+                if text and on_delta is not None:
+                    await on_delta(text)
+            result = accumulator.result()
+        except Exception as e:
+            return self._error_result(e)
+        self._store_result(cache_key, semantic, result)
+        return result
+
+    async def adispatch_tool_calls(
+        self,
+        tool_calls: Sequence[Tuple[str, dict]],
+        handler: Callable[[str, dict], Any],
+        parallel: bool = True,
+    ) -> List[Any]:
+        """
+        Выполняет handler(name, args) для каждого вызова инструмента, результаты - в исходном порядке.
+
+        Синхронный handler уходит в поток. Параллельно (не больше _TOOL_CONCURRENCY)
+        выполняются только наборы из инструментов чтения; изменяющие вызовы идут по очереди.
+        """
+        async def run(name: str, args: dict):
+            if inspect.iscoroutinefunction(handler):
+                return await handler(name, args)
+            return await asyncio.to_thread(handler, name, args)
+
+        if not parallel or len(tool_calls) < 2 or not all(is_read_only_tool(name) for name, _ in tool_calls):
+            return [await run(name, args) for name, args in tool_calls]
+
+        semaphore = asyncio.Semaphore(_TOOL_CONCURRENCY)
+
+        async def run_limited(name: str, args: dict):
+            async with semaphore:
+                return await run(name, args)
+
+        return list(await asyncio.gather(*(run_limited(name, args) for name, args in tool_calls)))
+    
+    def get_tools_definition(self) -> Tuple[Dict, ...]:
+        """Описание инструментов; один и тот же объект на все вызовы."""
+        return _TOOLS_DEFINITION
@@ -1,45 +1,110 @@
 """Context manager for storing user conversation history."""
-from typing import Dict, List
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Final, List, Optional, Sequence
 import os
+import sys
+
+# Промпт по умолчанию, если assistant_prompt_ru.txt нет или он пуст
+_DEFAULT_SYSTEM_PROMPT: Final[str] = """\
+Ты — AI-ассистент по финансам. Помогаешь пользователю анализировать расходы из базы данных чеков.
+
+Доступные функции для работы с БД:
+- fetch_by_period(start_date, end_date) - записи за период (формат дат: DD.MM.YYYY)
+- get_last_n_days(n) - записи за последние N дней
+- get_current_week() - записи за текущую неделю (с понедельника)
+- get_current_month() - записи за месяц
+- get_yesterday() - записи за вчерашний день
+- get_previous_month() - записи за прошлый месяц
+- get_previous_year() - записи за прошлый год
+- fetch_by_category(level, name) - записи по категории
+- fetch_by_organization(organization) - поиск по контексту в названии организации (LIKE)
+- fetch_by_product_name(product_name) - поиск по контексту в названии товара (LIKE)
+- fetch_by_description(description) - поиск по контексту в комментариях (LIKE)
+- get_cheque_by_id(chequeid) - чек по номеру
+- get_last_cheque() - последний чек (по дате, ближайший к текущей)
+- get_summary(start_date, end_date) - сумма за период
+- get_summary_last_n_days(n) - сумма за N дней
+- get_summary_week() - сумма за неделю
+- get_summary_month() - сумма за месяц
+- get_grouped_by_category1(start_date, end_date) - группировка по категории 1 уровня
+- get_grouped_by_category2(start_date, end_date) - группировка по категории 2 уровня
+- get_grouped_by_category3(start_date, end_date) - группировка по категории 3 уровня
+- get_grouped_by_organization(start_date, end_date) - группировка по организациям
+- get_grouped_by_description(start_date, end_date) - группировка по комментариям
+- update_record(record_id, field, value) - обновить запись (record_id = номер позиции/строки в чеке; поля: price, discount, product_name, description, quantity, category1-3, organization, date)
+- update_description_by_cheque(chequeid, description) - добавить комментарий к чеку
+- update_description_by_organization(organization, description) - добавить комментарий ко всем чекам организации
+
+ВАЖНО: 
+- Username определяется автоматически из Telegram. НЕ спрашивай и НЕ передавай username.
+- "За неделю" = с понедельника текущей недели по сегодня
+- "За последние 7 дней" = текущая дата минус 7 дней по сегодня
+- "За месяц" = с 1 числа текущего месяца по сегодня
+- "Вчера" / "прошлый день" = вызови get_yesterday()
+- "Прошлый месяц" = вызови get_previous_month()
+- "Прошлый год" = вызови get_previous_year()
+- Последний чек = чек с датой ближайшей к текущей дате
+
+Отвечай кратко, по делу. Используй эмодзи для наглядности. Суммы округляй до 2 знаков."""
+
+# Роли хранятся одним строковым объектом на весь процесс
+_ROLES: Final[Dict[str, str]] = {role: sys.intern(role) for role in ("user", "assistant", "system", "tool")}
+
+_PROMPT_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "assistant_prompt_ru.txt")
+
+
+class UserState:
+    """Все данные одного пользователя: одна запись в словаре вместо четырех."""
+
+    __slots__ = ("messages", "last_cheque", "last_query", "pending_cheque")
+
+    def __init__(self, max_messages: int):
+        # deque(maxlen) сам вытесняет старые сообщения, без копирования списка
+        self.messages: Deque[Dict[str, str]] = deque(maxlen=max_messages)
+        self.last_cheque: Optional[int] = None
+        self.last_query: Optional[Dict] = None  # {type, params, result, username}
+        self.pending_cheque: Optional[Dict] = None
 
 
 class ContextManager:
-    def __init__(self, max_messages: int = 20):
+    def __init__(self, max_messages: int = 20, max_queries: int = 256, max_query_rows: int = 500):
         self.max_messages = max_messages
-        self._contexts: Dict[int, List[Dict[str, str]]] = {}
-        self._last_cheque: Dict[int, int] = {}  # user_id -> chequeid
-        self._last_query: Dict[int, Dict] = {}  # user_id -> {type, params, result, username}
-        self._pending_cheques: Dict[int, Dict] = {}  # user_id -> pending data
-    
+        # Результаты последних запросов: не больше max_queries пользователей; больше max_query_rows строк - не хранятся
+        self.max_queries = max_queries
+        self.max_query_rows = max_query_rows
+        self._users: Dict[int, UserState] = {}
+        self._query_lru: "OrderedDict[int, None]" = OrderedDict()
+        self._prompt_path = _PROMPT_PATH
+        # Промпт читается с диска один раз
+        self._system_prompt: Optional[str] = None
+
+    def _user(self, user_id: int) -> UserState:
+        user = self._users.get(user_id)
+        if user is None:
+            user = self._users[user_id] = UserState(self.max_messages)
+        return user
+
     def add_message(self, user_id: int, role: str, content: str) -> None:
-        if user_id not in self._contexts:
-            self._contexts[user_id] = []
-        
-        self._contexts[user_id].append({"role": role, "content": content})
-        
-        if len(self._contexts[user_id]) > self.max_messages:
-            self._contexts[user_id] = self._contexts[user_id][-self.max_messages:]
+        role = _ROLES.get(role) or sys.intern(role)
+        self._user(user_id).messages.append({"role": role, "content": content})
     
-    def get_messages(self, user_id: int) -> List[Dict[str, str]]:
-        return self._contexts.get(user_id, [])
+    def get_messages(self, user_id: int) -> Sequence[Dict[str, str]]:
+        """История пользователя без копирования; только для чтения, добавлять через add_message."""
+        user = self._users.get(user_id)
+        return user.messages if user is not None else ()
     
     def clear_context(self, user_id: int) -> None:
-        if user_id in self._contexts:
-            del self._contexts[user_id]
-        if user_id in self._last_cheque:
-            del self._last_cheque[user_id]
-        if user_id in self._last_query:
-            del self._last_query[user_id]
-        if user_id in self._pending_cheques:
-            del self._pending_cheques[user_id]
+        self._users.pop(user_id, None)
+        self._query_lru.pop(user_id, None)
     
     def set_last_cheque(self, user_id: int, chequeid: int) -> None:
         """Сохранить последний просмотренный чек для пользователя."""
-        self._last_cheque[user_id] = chequeid
+        self._user(user_id).last_cheque = chequeid
     
     def get_last_cheque(self, user_id: int) -> int | None:
         """Получить последний просмотренный чек для пользователя."""
-        return self._last_cheque.get(user_id)
+        user = self._users.get(user_id)
+        return user.last_cheque if user is not None else None
     
     def set_last_query(self, user_id: int, query_type: str, params: Dict, result: List[Dict], username: str) -> None:
         """
@@ -52,12 +117,26 @@ class ContextManager:
             result: Результат запроса (список словарей)
             username: Username пользователя для БД
         """
-        self._last_query[user_id] = {
+        # Слишком большой результат не кешируется: потребители берут result как полный набор
+        # (агрегаты, графики, выгрузки), урезанный дал бы неверные суммы. Пустой result - повторный запрос
+        truncated = bool(result) and len(result) > self.max_query_rows
+        self._user(user_id).last_query = {
             "type": query_type,
             "params": params,
-            "result": result,
-            "username": username
+            "result": [] if truncated else result,
+            "username": username,
+            "truncated": truncated,
         }
+        # Повторный запрос пользователя - один поиск в move_to_end, новый - одна вставка
+        try:
+            self._query_lru.move_to_end(user_id)
+        except KeyError:
+            self._query_lru[user_id] = None
+        while len(self._query_lru) > self.max_queries:
+            evicted, _ = self._query_lru.popitem(last=False)
+            user = self._users.get(evicted)
+            if user is not None:
+                user.last_query = None
     
     def get_last_query(self, user_id: int) -> Dict | None:
         """
@@ -69,7 +148,11 @@ class ContextManager:
         Returns:
             Словарь с данными последнего запроса или None, если запросов не было
         """
-        return self._last_query.get(user_id)
+        user = self._users.get(user_id)
+        if user is None or user.last_query is None:
+            return None
+        self._query_lru.move_to_end(user_id)
+        return user.last_query
     
     def clear_last_query(self, user_id: int) -> None:
         """
@@ -78,65 +161,36 @@ class ContextManager:
         Args:
             user_id: Уникальный ID пользователя Telegram (message.from_user.id)
         """
-        self._last_query.pop(user_id, None)
+        user = self._users.get(user_id)
+        if user is not None:
+            user.last_query = None
+        self._query_lru.pop(user_id, None)
 
     def set_pending_cheque(self, user_id: int, data: Dict) -> None:
-        self._pending_cheques[user_id] = data
+        self._user(user_id).pending_cheque = data
 
     def get_pending_cheque(self, user_id: int) -> Dict | None:
-        return self._pending_cheques.get(user_id)
+        user = self._users.get(user_id)
+        return user.pending_cheque if user is not None else None
 
     def clear_pending_cheque(self, user_id: int) -> None:
-        self._pending_cheques.pop(user_id, None)
+        user = self._users.get(user_id)
+        if user is not None:
+            user.pending_cheque = None
     
     def get_system_prompt(self) -> str:
+        if self._system_prompt is None:
+            self._system_prompt = self._load_system_prompt()
+        return self._system_prompt
+
+    def _load_system_prompt(self) -> str:
         try:
-            base_dir = os.path.dirname(os.path.dirname(__file__))
-            prompt_path = os.path.join(base_dir, "assistant_prompt_ru.txt")
-            with open(prompt_path, "r", encoding="utf-8") as f:
+            with open(self._prompt_path, "r", encoding="utf-8") as f:
                 content = f.read().strip()
                 if content:
                     return content
         except Exception:
             pass
-        return (
-            "Ты — AI-ассистент по финансам. Помогаешь пользователю анализировать расходы из базы данных чеков.\n\n"
-            "Доступные функции для работы с БД:\n"
-            "- fetch_by_period(start_date, end_date) - записи за период (формат дат: DD.MM.YYYY)\n"
-            "- get_last_n_days(n) - записи за последние N дней\n"
-            "- get_current_week() - записи за текущую неделю (с понедельника)\n"
-            "- get_current_month() - записи за месяц\n"
-            "- get_yesterday() - записи за вчерашний день\n"
-            "- get_previous_month() - записи за прошлый месяц\n"
-            "- get_previous_year() - записи за прошлый год\n"
-            "- fetch_by_category(level, name) - записи по категории\n"
-            "- fetch_by_organization(organization) - поиск по контексту в названии организации (LIKE)\n"
-            "- fetch_by_product_name(product_name) - поиск по контексту в названии товара (LIKE)\n"
-            "- fetch_by_description(description) - поиск по контексту в комментариях (LIKE)\n"
-            "- get_cheque_by_id(chequeid) - чек по номеру\n"
-            "- get_last_cheque() - последний чек (по дате, ближайший к текущей)\n"
-            "- get_summary(start_date, end_date) - сумма за период\n"
-            "- get_summary_last_n_days(n) - сумма за N дней\n"
-            "- get_summary_week() - сумма за неделю\n"
-            "- get_summary_month() - сумма за месяц\n"
-            "- get_grouped_by_category1(start_date, end_date) - группировка по категории 1 уровня\n"
-            "- get_grouped_by_category2(start_date, end_date) - группировка по категории 2 уровня\n"
-            "- get_grouped_by_category3(start_date, end_date) - группировка по категории 3 уровня\n"
-            "- get_grouped_by_organization(start_date, end_date) - группировка по организациям\n"
-            "- get_grouped_by_description(start_date, end_date) - группировка по комментариям\n"
-            "- update_record(record_id, field, value) - обновить запись (record_id = номер позиции/строки в чеке; поля: price, discount, product_name, description, quantity, category1-3, organization, date)\n"
-            "- update_description_by_cheque(chequeid, description) - добавить комментарий к чеку\n"
-            "- update_description_by_organization(organization, description) - добавить комментарий ко всем чекам организации\n\n"
-            "ВАЖНО: \n"
-            "- Username определяется автоматически из Telegram. НЕ спрашивай и НЕ передавай username.\n"
-            "- \"За неделю\" = с понедельника текущей недели по сегодня\n"
-            "- \"За последние 7 дней\" = текущая дата минус 7 дней по сегодня\n"
-            "- \"За месяц\" = с 1 числа текущего месяца по сегодня\n"
-            "- \"Вчера\" / \"прошлый день\" = вызови get_yesterday()\n"
-            "- \"Прошлый месяц\" = вызови get_previous_month()\n"
-            "- \"Прошлый год\" = вызови get_previous_year()\n"
-            "- Последний чек = чек с датой ближайшей к текущей дате\n\n"
-            "Отвечай кратко, по делу. Используй эмодзи для наглядности. Суммы округляй до 2 знаков."
-        )
+        return _DEFAULT_SYSTEM_PROMPT
 
 
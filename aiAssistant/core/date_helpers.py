@@ -1,74 +1,139 @@
 """Helper functions for date calculations."""
+from contextvars import ContextVar
 from datetime import datetime, timedelta
+from functools import lru_cache
 import calendar
 import re
+import time
+
+# Шаблоны parse_period_string
+_DAYS_RE = re.compile(r"(\d+)\s*дн")
+_YEAR_RE = re.compile(r"20\d{2}")
+# Слова без знаков препинания: "за (март)", "за-март", "«май»"
+_WORD_RE = re.compile(r"\w+")
+
+# "Сейчас" одно на весь запрос пользователя: (monotonic-время вычисления, now, now в DD.MM.YYYY).
+# Сбрасывается в начале хода ассистента; TTL страхует вызовы вне хода (смену суток).
+_TODAY_TTL = 60.0
+_today_cache: ContextVar[tuple[float, datetime, str] | None] = ContextVar("_today_cache", default=None)
+
+# Прошлые месяц и год меняются раз в месяц/год: (ключ текущего периода, результат)
+_prev_month_cache: tuple[tuple[int, int], tuple[str, str]] | None = None
+_prev_year_cache: tuple[int, tuple[str, str]] | None = None
+# Периоды от "сегодня" меняются раз в сутки: имя -> (сегодня в DD.MM.YYYY, результат)
+_day_periods: dict[str, tuple[str, tuple[str, str]]] = {}
+
+
+def _fmt(d: datetime) -> str:
+    """DD.MM.YYYY без разбора формата strftime."""
+    return f"{d.day:02d}.{d.month:02d}.{d.year:04d}"
+
+
+def reset_today_cache() -> None:
+    """Вызывается в начале обработки сообщения: даты считаются от нового "сейчас"."""
+    _today_cache.set(None)
+
+
+def _now_and_str() -> tuple[datetime, str]:
+    cached = _today_cache.get()
+    tick = time.monotonic()
+    if cached is not None and tick - cached[0] < _TODAY_TTL:
+        return cached[1], cached[2]
+    now = datetime.now()
+    today_str = _fmt(now)
+    _today_cache.set((tick, now, today_str))
+    return now, today_str
 
 
 def get_last_n_days(n: int) -> tuple[str, str]:
     """Возвращает период последних N дней (включая сегодня)."""
-    end_date = datetime.now()
+    end_date, end = _now_and_str()
     start_date = end_date - timedelta(days=n-1)
-    return start_date.strftime("%d.%m.%Y"), end_date.strftime("%d.%m.%Y")
+    return _fmt(start_date), end
 
 
 def get_current_week() -> tuple[str, str]:
     """Возвращает период текущей недели (с понедельника по сегодня)."""
-    today = datetime.now()
+    today, end = _now_and_str()
+    cached = _day_periods.get("week")
+    if cached is not None and cached[0] == end:
+        return cached[1]
     start_of_week = today - timedelta(days=today.weekday())
-    return start_of_week.strftime("%d.%m.%Y"), today.strftime("%d.%m.%Y")
+    result = _fmt(start_of_week), end
+    _day_periods["week"] = (end, result)
+    return result
 
 
 def get_current_month() -> tuple[str, str]:
     """Возвращает период текущего месяца (с 1 числа по сегодня)."""
-    today = datetime.now()
-    start_of_month = today.replace(day=1)
-    return start_of_month.strftime("%d.%m.%Y"), today.strftime("%d.%m.%Y")
+    today, end = _now_and_str()
+    cached = _day_periods.get("month")
+    if cached is not None and cached[0] == end:
+        return cached[1]
+    result = _fmt(today.replace(day=1)), end
+    _day_periods["month"] = (end, result)
+    return result
 
 
 def get_yesterday() -> tuple[str, str]:
     """Возвращает дату вчера."""
-    now = datetime.now()
-    target = (now - timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
-    formatted = target.strftime("%d.%m.%Y")
-    return formatted, formatted
+    now, today_str = _now_and_str()
+    cached = _day_periods.get("yesterday")
+    if cached is not None and cached[0] == today_str:
+        return cached[1]
+    formatted = _fmt(now - timedelta(days=1))
+    result = formatted, formatted
+    _day_periods["yesterday"] = (today_str, result)
+    return result
 
 
 def get_previous_month() -> tuple[str, str]:
     """Возвращает полный предыдущий месяц."""
-    today = datetime.now()
+    global _prev_month_cache
+    today, _ = _now_and_str()
+    key = (today.year, today.month)
+    cached = _prev_month_cache
+    if cached is not None and cached[0] == key:
+        return cached[1]
     first_of_current = today.replace(day=1)
     last_day_prev = first_of_current - timedelta(days=1)
     start_prev = last_day_prev.replace(day=1)
-    start = start_prev.strftime("%d.%m.%Y")
-    end = last_day_prev.strftime("%d.%m.%Y")
-    return start, end
+    result = _fmt(start_prev), _fmt(last_day_prev)
+    _prev_month_cache = (key, result)
+    return result
 
 
 def get_previous_year() -> tuple[str, str]:
     """Возвращает полный предыдущий год."""
-    today = datetime.now()
+    global _prev_year_cache
+    today, _ = _now_and_str()
+    cached = _prev_year_cache
+    if cached is not None and cached[0] == today.year:
+        return cached[1]
     prev_year = today.year - 1
-    start = datetime(prev_year, 1, 1).strftime("%d.%m.%Y")
-    end = datetime(prev_year, 12, 31).strftime("%d.%m.%Y")
-    return start, end
+    result = f"01.01.{prev_year:04d}", f"31.12.{prev_year:04d}"
+    _prev_year_cache = (today.year, result)
+    return result
 
 
 def get_last_n_months(n: int) -> tuple[str, str]:
-    """Возвращает период последних N месяцев."""
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=30*n)
-    return start_date.strftime("%d.%m.%Y"), end_date.strftime("%d.%m.%Y")
+    """Возвращает период последних N месяцев: с 1 числа месяца N месяцев назад по сегодня."""
+    today, end = _now_and_str()
+    year, month0 = divmod(today.year * 12 + today.month - 1 - n, 12)
+    return f"01.{month0 + 1:02d}.{year:04d}", end
 
 
 def get_full_current_month() -> tuple[str, str]:
     """Возвращает полный текущий месяц (с 1 по последний день месяца)."""
-    today = datetime.now()
+    today, _ = _now_and_str()
     start = today.replace(day=1)
     last_day = calendar.monthrange(today.year, today.month)[1]
     end = today.replace(day=last_day)
-    return start.strftime("%d.%m.%Y"), end.strftime("%d.%m.%Y")
+    return _fmt(start), _fmt(end)
 
 
+# Одни и те же даты (сегодня, начала месяцев) разбираются постоянно; datetime неизменяем
+@lru_cache(maxsize=256)
 def _parse_ddmmyyyy(s: str) -> datetime | None:
     try:
         return datetime.strptime(s, "%d.%m.%Y")
@@ -79,7 +144,11 @@ def _parse_ddmmyyyy(s: str) -> datetime | None:
 def normalize_to_current_month_if_same_month_wrong_year(start_date: str, end_date: str) -> tuple[str, str]:
     """If the provided period has a wrong year (e.g., 2023 instead of current year), 
     correct it to current year. Always use current year for date calculations."""
-    now = datetime.now()
+    now, today_str = _now_and_str()
+    # Частый случай: обе даты уже в текущем году (суффикс ".YYYY" из DD.MM.YYYY)
+    year_suffix = today_str[5:]
+    if isinstance(start_date, str) and isinstance(end_date, str) and start_date.endswith(year_suffix) and end_date.endswith(year_suffix):
+        return start_date, end_date
     current_year = now.year
     ds = _parse_ddmmyyyy(start_date)
     de = _parse_ddmmyyyy(end_date)
@@ -92,9 +161,8 @@ def normalize_to_current_month_if_same_month_wrong_year(start_date: str, end_dat
         start = f"{ds.day:02d}.{ds.month:02d}.{current_year}"
         # Для конечной даты: если это последний день месяца в старом году, используем последний день текущего месяца
         # Иначе просто исправляем год
-        if de.day == 31 or (de.month == 2 and de.day == 28) or (de.month in [4,6,9,11] and de.day == 30):
-            # Похоже на последний день месяца - используем последний день текущего месяца
-            import calendar
+        if de.day == calendar.monthrange(de.year, de.month)[1]:
+            # Последний день месяца - используем последний день этого месяца в текущем году
             last_day = calendar.monthrange(current_year, de.month)[1]
             end = f"{last_day:02d}.{de.month:02d}.{current_year}"
         else:
@@ -104,54 +172,78 @@ def normalize_to_current_month_if_same_month_wrong_year(start_date: str, end_dat
     return start_date, end_date
 
 
+# Признаки фраз периода: каждая подстрока ставит свой бит, текст просматривается один раз
+_YESTERDAY, _PAST, _PAST_DAY, _WEEK, _MONTH, _YEAR = (1 << i for i in range(6))
+_PHRASE_FLAGS = (
+    ("вчера", _YESTERDAY), ("last day", _YESTERDAY), ("yesterday", _YESTERDAY),
+    ("прошл", _PAST),
+    ("дня", _PAST_DAY), ("дней", _PAST_DAY), ("дни", _PAST_DAY), ("днём", _PAST_DAY), ("днем", _PAST_DAY), ("днень", _PAST_DAY),
+    ("недел", _WEEK), ("week", _WEEK),
+    ("месяц", _MONTH), ("месяч", _MONTH), ("month", _MONTH),
+    ("год", _YEAR), ("лет", _YEAR), ("year", _YEAR),
+)
+
+# Правила по порядку: все биты маски есть в тексте -> функция периода
+_PERIOD_RULES = (
+    (_YESTERDAY, get_yesterday),
+    (_PAST | _PAST_DAY, get_yesterday),
+    (_WEEK, get_current_week),
+    (_PAST | _MONTH, get_previous_month),
+    (_PAST | _YEAR, get_previous_year),
+    (_MONTH, get_current_month),
+)
+
+# Начала названий месяцев. Перебираются по порядку: "ма" (май) стоит после "март"
+_MONTHS: tuple[tuple[str, int], ...] = (
+    ("сентябр", 9), ("октябр", 10), ("феврал", 2), ("август", 8), ("декабр", 12), ("январ", 1),
+    ("апрел", 4), ("ноябр", 11), ("март", 3), ("июн", 6), ("июл", 7), ("ма", 5),
+)
+
+# Первые буквы названий месяцев: слова с другой первой буквой не проверяются
+_MONTH_FIRST_CHARS = frozenset(prefix[0] for prefix, _ in _MONTHS)
+
+
+def _month_from_tokens(text: str) -> int | None:
+    if _MONTH_FIRST_CHARS.isdisjoint(text):
+        return None
+    for token in _WORD_RE.findall(text):
+        if token[0] not in _MONTH_FIRST_CHARS:
+            continue
+        for month_name, month_num in _MONTHS:
+            if token.startswith(month_name):
+                return month_num
+    return None
+
+
 def parse_period_string(period: str) -> tuple[str, str] | None:
     """Парсит строки типа 'за неделю', 'за 7 дней', 'за октябрь'."""
     period_lower = period.lower().strip()
-    
-    if "вчера" in period_lower or "вчераш" in period_lower or ("прошл" in period_lower and re.search(r"дн(я|ей|и|ём|ем|ень)", period_lower)) or "last day" in period_lower or "yesterday" in period_lower:
-        return get_yesterday()
-    
-    if "недел" in period_lower or "week" in period_lower:
-        return get_current_week()
-    
-    if "прошл" in period_lower and (re.search(r"месяц|месяч|месяц[а-я]*", period_lower) or "month" in period_lower):
-        return get_previous_month()
-    
-    if "прошл" in period_lower and (re.search(r"год|года|году|годом|лет", period_lower) or "year" in period_lower):
-        return get_previous_year()
-    
-    if re.search(r"месяц|месяч|месяц[а-я]*", period_lower) or "month" in period_lower:
-        return get_current_month()
-    
-    days_match = re.search(r'(\d+)\s*дн', period_lower)
+    flags = 0
+    for phrase, bit in _PHRASE_FLAGS:
+        if phrase in period_lower:
+            flags |= bit
+
+    if flags:
+        for mask, helper in _PERIOD_RULES:
+            if flags & mask == mask:
+                return helper()
+
+    days_match = _DAYS_RE.search(period_lower)
     if days_match:
         n = int(days_match.group(1))
         return get_last_n_days(n)
-    
-    months = {
-        "январ": "01", "феврал": "02", "март": "03", "апрел": "04",
-        "ма": "05", "июн": "06", "июл": "07", "август": "08",
-        "сентябр": "09", "октябр": "10", "ноябр": "11", "декабр": "12"
-    }
-    
-    for month_name, month_num in months.items():
-        if month_name in period_lower:
-            year_match = re.search(r'20\d{2}', period_lower)
-            now = datetime.now()
-            year = year_match.group(0) if year_match else now.strftime("%Y")
-            start = f"01.{month_num}.{year}"
-            # Для текущего месяца конец = сегодня, иначе последний день месяца
-            if int(year) == now.year and int(month_num) == now.month:
-                end = now.strftime("%d.%m.%Y")
-            else:
-                last_day = calendar.monthrange(int(year), int(month_num))[1]
-                end = f"{last_day}.{month_num}.{year}"
-            return start, end
-    
-    return None
-
-
-
-
-
 
+    month = _month_from_tokens(period_lower)
+    if month is None:
+        return None
+    year_match = _YEAR_RE.search(period_lower)
+    now, today_str = _now_and_str()
+    year = int(year_match.group(0)) if year_match else now.year
+    start = f"01.{month:02d}.{year}"
+    # Для текущего месяца конец = сегодня, иначе последний день месяца
+    if year == now.year and month == now.month:
+        end = today_str
+    else:
+        last_day = calendar.monthrange(year, month)[1]
+        end = f"{last_day}.{month:02d}.{year}"
+    return start, end
@@ -0,0 +1,62 @@
+"""Token-bucket limiter for OpenAI requests (requests/min and tokens/min)."""
+import asyncio
+import threading
+import time
+from typing import Dict, List
+
+
+def estimate_tokens(messages: List[Dict], completion_reserve: int = 512) -> int:
+    """Грубая оценка: ~4 символа на токен плюс запас на ответ."""
+    return sum(len(m.get("content") or "") // 4 for m in messages) + completion_reserve
+
+
+class RateLimiter:
+    """
+    Два ведра: запросы и токены в минуту, пополняются по monotonic-времени.
+
+    acquire ждёт, пока в обоих ведрах хватит ёмкости, поэтому запросы
+    не упираются в 429 при всплесках нагрузки.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.max_requests = float(requests_per_minute)
+        self.max_tokens = float(tokens_per_minute)
+        self._requests = self.max_requests
+        self._tokens = self.max_tokens
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.max_requests, self._requests + elapsed * self.max_requests / 60.0)
+        self._tokens = min(self.max_tokens, self._tokens + elapsed * self.max_tokens / 60.0)
+
+    def _try_acquire(self, requests: float, tokens: float) -> float:
+        """Списывает ёмкость и возвращает 0 либо возвращает, сколько секунд ждать."""
+        # Запрос больше ведра иначе не пройдет никогда
+        requests = min(requests, self.max_requests)
+        tokens = min(tokens, self.max_tokens)
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._requests >= requests and self._tokens >= tokens:
+                self._requests -= requests
+                self._tokens -= tokens
+                return 0.0
+            wait_requests = (requests - self._requests) * 60.0 / self.max_requests
+            wait_tokens = (tokens - self._tokens) * 60.0 / self.max_tokens
+            return max(wait_requests, wait_tokens, 0.001)
+
+    def acquire(self, requests: float = 1, tokens: float = 0) -> None:
+        while True:
+            wait = self._try_acquire(requests, tokens)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def aacquire(self, requests: float = 1, tokens: float = 0) -> None:
+        while True:
+            wait = self._try_acquire(requests, tokens)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
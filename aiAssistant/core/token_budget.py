@@ -0,0 +1,77 @@
+"""Подсчет токенов и обрезка истории диалога под бюджет входных токенов."""
+from functools import lru_cache
+from typing import Dict, List
+
+try:
+    import tiktoken
+except ImportError:  # без tiktoken - оценка ~4 символа на токен
+    tiktoken = None
+
+# Служебные токены на каждое сообщение (роль, разделители)
+_MESSAGE_OVERHEAD = 4
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    if not text:
+        return 0
+    if tiktoken is None:
+        return len(text) // 4 + 1
+    return len(_encoding(model).encode(text))
+
+
+def message_tokens(message: Dict, model: str = "gpt-4o-mini") -> int:
+    tokens = _MESSAGE_OVERHEAD
+    content = message.get("content")
+    if isinstance(content, str):
+        tokens += count_tokens(content, model)
+    for tool_call in message.get("tool_calls") or ():
+        function = tool_call["function"] if isinstance(tool_call, dict) else tool_call.function
+        name = function["name"] if isinstance(function, dict) else function.name
+        arguments = function["arguments"] if isinstance(function, dict) else function.arguments
+        tokens += count_tokens(name, model) + count_tokens(arguments or "", model)
+    return tokens
+
+
+def trim_messages(messages: List[Dict], max_tokens: int, model: str = "gpt-4o-mini") -> List[Dict]:
+    """
+    Оставляет системные сообщения и самые свежие реплики, укладываясь в max_tokens.
+
+    Ответы инструментов (tool) держатся вместе с предшествующим сообщением assistant
+    с tool_calls: по отдельности OpenAI их не принимает. Последняя реплика
+    остается всегда, даже если одна превышает бюджет.
+    """
+    # Блок - сообщение вместе со следующими за ним ответами инструментов
+    blocks: List[List[Dict]] = []
+    for message in messages:
+        if message.get("role") == "system":
+            continue
+        if message.get("role") == "tool" and blocks:
+            blocks[-1].append(message)
+        else:
+            blocks.append([message])
+
+    # Ответ инструмента без своего вызова в начале истории не отправляем
+    if blocks and blocks[0][0].get("role") == "tool":
+        blocks = blocks[1:]
+
+    budget = max_tokens - sum(message_tokens(m, model) for m in messages if m.get("role") == "system")
+    kept = set()
+    for block in reversed(blocks):
+        cost = sum(message_tokens(m, model) for m in block)
+        if kept and cost > budget:
+            break
+        budget -= cost
+        kept.update(id(m) for m in block)
+
+    if len(kept) + sum(m.get("role") == "system" for m in messages) == len(messages):
+        return messages
+    return [m for m in messages if m.get("role") == "system" or id(m) in kept]
@@ -0,0 +1,222 @@
+"""Tools (function calling) available to the AI assistant."""
+from typing import Any, Callable, Dict, List, Sequence
+
+# Порядок регистрации = порядок в запросе; не меняется, чтобы не сбивать кеш префикса OpenAI
+TOOLS: List[Dict[str, Any]] = []
+
+
+def register_tool(name: str, description: str, /, required: Sequence[str] = (), **params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Добавляет описание инструмента в TOOLS; params - JSON-схемы параметров.
+
+    name и description только позиционные: у инструментов есть параметры с такими именами.
+    """
+    parameters: Dict[str, Any] = {"type": "object", "properties": params}
+    if params:
+        parameters["required"] = list(required)
+    definition = {"type": "function", "function": {"name": name, "description": description, "parameters": parameters}}
+    TOOLS.append(definition)
+    return definition
+
+
+def tool(name: str, description: str, /, required: Sequence[str] = (), **params: Dict[str, Any]) -> Callable:
+    """Декоратор для обработчика инструмента: регистрирует его описание."""
+    def decorator(fn: Callable) -> Callable:
+        register_tool(name, description, required, **params)
+        return fn
+    return decorator
+
+
+# Общие схемы параметров: один объект на все инструменты
+_N_DAYS = {"type": "integer", "description": "Количество дней"}
+_CHEQUE_ID = {"type": "integer", "description": "Номер чека"}
+_CHEQUE_ID_OPTIONAL = {"type": "integer", "description": "Номер чека (необязательно, если не указан - используется последний просмотренный)"}
+_START_DATE = {"type": "string", "description": "Дата начала в формате DD.MM.YYYY"}
+_END_DATE = {"type": "string", "description": "Дата конца в формате DD.MM.YYYY"}
+_GROUP_START_DATE = {"type": "string", "description": "Дата начала DD.MM.YYYY. ВСЕГДА используй текущий год (2025), никогда не используй старые годы!"}
+_GROUP_END_DATE = {"type": "string", "description": "Дата конца DD.MM.YYYY. ВСЕГДА используй текущий год (2025), никогда не используй старые годы!"}
+_NEW_VALUE = {"type": "string", "description": "Новое значение"}
+_PERIOD = ("start_date", "end_date")
+
+_GROUPED_HINT = (
+    " Если пользователь просит график или диаграмму, используй эту функцию - она автоматически построит круговую диаграмму."
+    " ВАЖНО: всегда используй текущий год (2025) в датах, никогда не используй старые годы типа 2023!"
+)
+
+
+register_tool(
+    "get_last_n_days",
+    "Получить записи за последние N дней (включая сегодня). Например: 'за последние 7 дней' - используй эту функцию с n=7",
+    required=("n",),
+    n=_N_DAYS,
+)
+register_tool("export_all_to_excel", "Выгрузить все записи текущего пользователя в Excel-файл (.dbData/Report.xlsx)")
+register_tool(
+    "export_to_excel_by_period",
+    "Выгрузить записи за период в Excel-файл (.dbData/Report.xlsx). Используй совместно с датами из хелперов периодов.",
+    required=_PERIOD,
+    start_date={"type": "string", "description": "Дата начала DD.MM.YYYY"},
+    end_date={"type": "string", "description": "Дата конца DD.MM.YYYY"},
+)
+register_tool(
+    "export_group_items_to_excel",
+    "Выгрузить в Excel все детальные записи (карточки товаров) по указанному сгруппированному значению из предыдущего запроса. "
+    "Использует период (даты) из последнего запроса группировки. Например: 'выгрузи в эксель все карточки по категории Продукты питания' - "
+    "выгрузит все записи где category1='Продукты питания' за тот же период, что был в предыдущем запросе.",
+    required=("group_value",),
+    group_value={
+        "type": "string",
+        "description": "Значение группы для фильтрации (например: 'Продукты питания', 'Электроника', название организации и т.д.). "
+        "Должно точно совпадать с одним из значений в результатах предыдущего запроса группировки.",
+    },
+)
+register_tool("get_current_week", "Получить записи за текущую неделю (с понедельника по сегодня). Используй для запроса 'за неделю'")
+register_tool("get_current_month", "Получить записи за текущий месяц (с 1 числа по сегодня). Используй для запроса 'за месяц'")
+register_tool("get_yesterday", "Получить записи за вчерашний день. Используй для запросов вида 'вчера', 'вчерашний день', 'last day'")
+register_tool("get_previous_month", "Получить записи за прошлый календарный месяц (полностью). Используй для запросов 'прошлый месяц', 'last month'")
+register_tool("get_previous_year", "Получить записи за предыдущий календарный год. Используй для запросов 'прошлый год', 'last year'")
+register_tool(
+    "fetch_by_period",
+    "Получить записи покупок за конкретный период. Используй когда пользователь указывает точные даты",
+    required=_PERIOD,
+    start_date=_START_DATE,
+    end_date=_END_DATE,
+)
+register_tool(
+    "get_summary_last_n_days",
+    "Получить общую сумму за последние N дней. Используй для 'общая сумма за 7 дней', 'сколько потратил за 30 дней' и т.п.",
+    required=("n",),
+    n=_N_DAYS,
+)
+register_tool("get_summary_week", "Получить общую сумму за текущую неделю (с понедельника). Используй для 'сумма за неделю'")
+register_tool("get_summary_month", "Получить общую сумму за текущий месяц. Используй для 'сумма за месяц'")
+register_tool(
+    "get_summary",
+    "Получить общую сумму за конкретный период. Используй когда пользователь указывает точные даты",
+    required=_PERIOD,
+    start_date=_START_DATE,
+    end_date=_END_DATE,
+)
+register_tool("get_cheque_by_id", "Получить чек текущего пользователя по номеру", required=("chequeid",), chequeid=_CHEQUE_ID)
+register_tool("get_last_cheque", "Получить последний чек текущего пользователя")
+register_tool(
+    "delete_cheque",
+    "Удалить чек текущего пользователя по номеру. Если номер не указан, используется последний просмотренный чек",
+    chequeid=_CHEQUE_ID_OPTIONAL,
+)
+register_tool(
+    "add_item_to_cheque",
+    "Добавить новую товарную позицию в существующий чек. Автоматически заполняются дата, организация из чека, категории через AI-классификацию. "
+    "Если номер чека не указан, используется последний просмотренный чек",
+    required=("product_name", "price"),
+    chequeid=_CHEQUE_ID_OPTIONAL,
+    product_name={"type": "string", "description": "Название товара"},
+    price={"type": "number", "description": "Цена товара"},
+    quantity={"type": "number", "description": "Количество (по умолчанию 1, допускает дробные значения)"},
+    discount={"type": "number", "description": "Скидка (по умолчанию 0)"},
+)
+register_tool(
+    "fetch_by_category",
+    "Получить покупки текущего пользователя по категории",
+    required=("level", "name"),
+    level={"type": "integer", "description": "Уровень категории (1, 2 или 3)"},
+    name={"type": "string", "description": "Название категории"},
+)
+register_tool(
+    "fetch_by_organization",
+    "Получить покупки текущего пользователя по организации. Ищет по вхождению текста (например: 'лента' найдет 'Лента', 'ЛЕНТА', 'Магазин Лента' и т.д.)",
+    required=("organization",),
+    organization={"type": "string", "description": "Название или часть названия организации"},
+)
+register_tool(
+    "fetch_by_product_name",
+    "Получить покупки по названию товара. Ищет по вхождению текста (например: 'молоко' найдет 'Молоко', 'Молоко 2.5%', 'Молоко домик' и т.д.)",
+    required=("product_name",),
+    product_name={"type": "string", "description": "Название или часть названия товара"},
+)
+register_tool(
+    "fetch_by_description",
+    "Получить покупки по комментарию/описанию. Ищет по вхождению текста в поле description",
+    required=("description",),
+    description={"type": "string", "description": "Текст для поиска в комментариях"},
+)
+register_tool(
+    "update_description_by_cheque",
+    "Добавить или изменить комментарий к чеку текущего пользователя. Если номер чека не указан, используется последний просмотренный чек. "
+    "ВСЕГДА передавай параметр 'description' с текстом комментария",
+    required=("description",),
+    chequeid=_CHEQUE_ID_OPTIONAL,
+    description={"type": "string", "description": "Текст комментария (обязательно, например: 'авоська', 'рабочие расходы' и т.д.)"},
+)
+register_tool(
+    "update_description_by_organization",
+    "Добавить комментарий ко всем чекам текущего пользователя в указанной организации",
+    required=("organization", "description"),
+    organization={"type": "string", "description": "Название организации"},
+    description={"type": "string", "description": "Текст комментария"},
+)
+register_tool(
+    "update_record",
+    "Обновить конкретное поле записи по ID. ID = номер позиции (строки) в чеке, который показывается рядом с товаром. "
+    "Используй для команд вида 'Позиция 102 измени цену 123.45' или 'Измени наименование товара в позиции 102 …'",
+    required=("record_id", "field", "value"),
+    record_id={"type": "integer", "description": "ID записи"},
+    field={"type": "string", "description": "Название поля (price, discount, product_name, description, quantity, category1, category2, category3, organization, date)"},
+    value=_NEW_VALUE,
+)
+register_tool(
+    "update_field_by_cheque",
+    "Обновить поле у всех записей конкретного чека текущего пользователя (например, дату у чека). Если номер чека не указан, используется последний просмотренный чек",
+    required=("field", "value"),
+    chequeid=_CHEQUE_ID_OPTIONAL,
+    field={"type": "string", "description": "Поле (например, date, description, organization)"},
+    value=_NEW_VALUE,
+)
+register_tool(
+    "get_grouped_by_category1",
+    "Группировка по категории 1 уровня за период. Показывает сумму по каждой категории." + _GROUPED_HINT,
+    required=_PERIOD,
+    start_date=_GROUP_START_DATE,
+    end_date=_GROUP_END_DATE,
+)
+register_tool(
+    "get_grouped_by_category2",
+    "Группировка по категории 2 уровня за период. Показывает сумму по каждой категории." + _GROUPED_HINT,
+    required=_PERIOD,
+    start_date=_GROUP_START_DATE,
+    end_date=_GROUP_END_DATE,
+)
+register_tool(
+    "get_grouped_stats_filtered",
+    "Группировка по полю (category1/2/3, organization, description) за период с дополнительными фильтрами (например: category1=Напитки)." + _GROUPED_HINT,
+    required=("field",) + _PERIOD,
+    field={"type": "string", "description": "Поле группировки: category1|category2|category3|organization|description"},
+    start_date=_GROUP_START_DATE,
+    end_date=_GROUP_END_DATE,
+    filters={
+        "type": "object",
+        "description": "Доп. фильтры: словарь {field: value}",
+        "additionalProperties": {"type": "string"},
+    },
+)
+register_tool(
+    "get_grouped_by_category3",
+    "Группировка по категории 3 уровня за период. Показывает сумму по каждой категории." + _GROUPED_HINT,
+    required=_PERIOD,
+    start_date=_GROUP_START_DATE,
+    end_date=_GROUP_END_DATE,
+)
+register_tool(
+    "get_grouped_by_organization",
+    "Группировка по организациям за период. Показывает сумму по каждой организации." + _GROUPED_HINT,
+    required=_PERIOD,
+    start_date=_GROUP_START_DATE,
+    end_date=_GROUP_END_DATE,
+)
+register_tool(
+    "get_grouped_by_description",
+    "Группировка по комментариям/тегам за период. Показывает сумму по каждому комментарию." + _GROUPED_HINT,
+    required=_PERIOD,
+    start_date=_GROUP_START_DATE,
+    end_date=_GROUP_END_DATE,
+)
@@ -2,8 +2,13 @@
 import os
 import sys
 import logging
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Tuple
+from typing import Iterator, List, Dict, Optional, Tuple
 
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 if PROJECT_ROOT not in sys.path:
@@ -11,7 +16,7 @@ if PROJECT_ROOT not in sys.path:
 
 from db.db_manager import (
     get_connection, init_db, bulk_insert_purchases,
-    get_next_cheque_id, check_duplicate_cheque
+    get_next_cheque_id, check_duplicate_cheque, norm_ymd as _norm_ymd
 )
 from config import DB_PATH
 
@@ -19,152 +24,239 @@ from config import DB_PATH
 logger = logging.getLogger(__name__)
 
 
-def _norm_ymd(date_str: str) -> str:
-    """Convert DD.MM.YYYY or DD-MM-YYYY to YYYY-MM-DD for correct string compare."""
+# Соединения переиспользуются: на каждый файл БД - до _POOL_SIZE читателей и один писатель
+_POOL_SIZE = 4
+# Кеш подготовленных запросов sqlite3 на соединение (по тексту SQL)
+_CACHED_STATEMENTS = 256
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA mmap_size=268435456",
+)
+
+
+class _PoolEntry:
+    """Открытые соединения одного файла БД."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.readers: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=_POOL_SIZE)
+        # Запись идет через одно соединение по очереди: WAL допускает одного писателя
+        self.writer: Optional[sqlite3.Connection] = None
+        self.write_lock = threading.Lock()
+
+    def open(self) -> sqlite3.Connection:
+        conn = get_connection(self.path, check_same_thread=False, cached_statements=_CACHED_STATEMENTS)
+        for pragma in _PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+
+_pools: Dict[str, _PoolEntry] = {}
+_pools_lock = threading.Lock()
+
+
+def _pool(db_path: Optional[str]) -> _PoolEntry:
+    path = db_path or DB_PATH
+    entry = _pools.get(path)
+    if entry is None:
+        with _pools_lock:
+            entry = _pools.setdefault(path, _PoolEntry(path))
+    return entry
+
+
+@contextmanager
+def _get_pooled(db_path: Optional[str] = None, write: bool = False) -> Iterator[sqlite3.Connection]:
+    """Соединение из пула; для write - общее соединение записи, транзакция завершается на выходе."""
+    entry = _pool(db_path)
+    if write:
+        with entry.write_lock:
+            if entry.writer is None:
+                entry.writer = entry.open()
+            with entry.writer as conn:
+                yield conn
+        return
     try:
-        if not date_str:
-            return date_str
-        s = str(date_str)
-        if "." in s and len(s) >= 10:
-            return f"{s[6:10]}-{s[3:5]}-{s[0:2]}"
-        if "-" in s and len(s) >= 10 and s[4] == "-":  # already ISO-like
-            return s[:10]
-        if "-" in s and len(s) >= 10 and s[2] == "-":  # DD-MM-YYYY
-            return f"{s[6:10]}-{s[3:5]}-{s[0:2]}"
-        return s[:10]
-    except Exception:
-        return date_str
-
-
-_DATE_EXPR_SQL = (
-    "CASE "
-    "WHEN date LIKE '__.__.____%' THEN substr(date,7,4)||'-'||substr(date,4,2)||'-'||substr(date,1,2) "
-    "WHEN date LIKE '__-__-____%' THEN substr(date,7,4)||'-'||substr(date,4,2)||'-'||substr(date,1,2) "
-    "WHEN date LIKE '____-__-__%' THEN substr(date,1,10) "
-    "ELSE date END"
+        conn = entry.readers.get_nowait()
+    except queue.Empty:
+        conn = entry.open()
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            entry.readers.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+
+def close_pools() -> None:
+    """Закрывает все соединения пула (остановка бота, тесты)."""
+    with _pools_lock:
+        entries = list(_pools.values())
+        _pools.clear()
+    for entry in entries:
+        with entry.write_lock:
+            if entry.writer is not None:
+                entry.writer.close()
+                entry.writer = None
+        while True:
+            try:
+                entry.readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class PurchaseRow(sqlite3.Row):
+    """
+    Строка purchases с доступом как у словаря (get, in, перебор ключей).
+
+    Имена колонок хранятся в курсоре один раз, а не в отдельном dict на каждую строку;
+    только для чтения, для изменения - dict(row).
+    """
+
+    __slots__ = ()
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except IndexError:
+            return default
+
+    def __contains__(self, key) -> bool:
+        return key in self.keys()
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def items(self):
+        return zip(self.keys(), sqlite3.Row.__iter__(self))
+
+
+def _fetch_rows(conn: sqlite3.Connection, sql: str, params: Tuple, limit: Optional[int] = None) -> List[PurchaseRow]:
+    # LIMIT - отдельным параметром: у запроса два варианта текста, оба остаются в кеше
+    if limit is not None:
+        sql = f"{sql} LIMIT ?"
+        params = (*params, limit)
+    cur = conn.cursor()
+    cur.row_factory = PurchaseRow
+    return cur.execute(sql, params).fetchall()
+
+
+# Тексты запросов собираются один раз: одинаковый текст - попадание в кеш подготовленных запросов
+_SQL_FETCH_BY_PERIOD = "SELECT * FROM purchases WHERE username = ? AND date_ymd BETWEEN ? AND ? ORDER BY date_ymd DESC"
+_SQL_FETCH_BY_CATEGORY = {
+    level: f"SELECT * FROM purchases WHERE category{level} = ? AND username = ? ORDER BY date DESC"
+    for level in (1, 2, 3)
+}
+_SQL_FETCH_BY_ORGANIZATION = (
+    "SELECT * FROM purchases WHERE username = ? AND instr(py_casefold(organization), ?) > 0 ORDER BY date DESC"
+)
+_SQL_SEARCH_FTS = (
+    "SELECT p.* FROM purchases_fts f JOIN purchases p ON p.id = f.rowid "
+    "WHERE purchases_fts MATCH ? AND p.username = ? ORDER BY p.date DESC"
+)
+_SQL_SEARCH_LIKE = {
+    column: f"SELECT * FROM purchases WHERE {column} LIKE ? AND username = ? ORDER BY date DESC"
+    for column in ("product_name", "description")
+}
+# Суммы чеков за период: дата и организация - первой позиции чека, порядок - как у fetch_by_period
+_SQL_GET_CHEQUE_BY_ID = "SELECT * FROM purchases WHERE chequeid = ? AND username = ? ORDER BY id"
+_SQL_GET_LAST_CHEQUE = (
+    "SELECT * FROM purchases WHERE username = ? "
+    "AND chequeid = (SELECT MAX(chequeid) FROM purchases WHERE username = ?) ORDER BY id"
+)
+_SQL_MAX_CHEQUEID = "SELECT MAX(chequeid) FROM purchases WHERE username = ?"
+_SQL_COUNT_BY_PERIOD = "SELECT COUNT(*) FROM purchases WHERE username = ? AND date_ymd BETWEEN ? AND ?"
+_SQL_SUMMARY = (
+    "SELECT COUNT(*) as count, COALESCE(ROUND(SUM(price), 2), 0.0) as total, COUNT(DISTINCT chequeid) as cheque_count "
+    "FROM purchases WHERE username = ? AND date_ymd BETWEEN ? AND ?"
 )
 
 
-def fetch_by_period(start_date: str, end_date: str, username: str, db_path: Optional[str] = None) -> List[Dict]:
-    with get_connection(db_path) as conn:
+def fetch_by_period(start_date: str, end_date: str, username: str, db_path: Optional[str] = None, limit: Optional[int] = None) -> List[PurchaseRow]:
+    with _get_pooled(db_path) as conn:
         ymd_start = _norm_ymd(start_date)
         ymd_end = _norm_ymd(end_date)
-        cur = conn.execute(
-            f"SELECT * FROM purchases WHERE ({_DATE_EXPR_SQL}) >= ? AND ({_DATE_EXPR_SQL}) <= ? AND username = ? "
-            "ORDER BY date DESC",
-            (ymd_start, ymd_end, username)
-        )
-        rows = cur.fetchall()
-        columns = [desc[0] for desc in cur.description]
-        return [dict(zip(columns, row)) for row in rows]
+        return _fetch_rows(conn, _SQL_FETCH_BY_PERIOD, (username, ymd_start, ymd_end), limit)
 
 
-def fetch_by_category(level: int, name: str, username: str, db_path: Optional[str] = None) -> List[Dict]:
-    category_field = f"category{level}"
-    with get_connection(db_path) as conn:
-        cur = conn.execute(
-            f"SELECT * FROM purchases WHERE {category_field} = ? AND username = ? ORDER BY date DESC",
-            (name, username)
-        )
-        rows = cur.fetchall()
-        columns = [desc[0] for desc in cur.description]
-        return [dict(zip(columns, row)) for row in rows]
+def count_by_period(start_date: str, end_date: str, username: str, db_path: Optional[str] = None) -> int:
+    """Число позиций за период: считается по индексу, без выборки строк."""
+    with _get_pooled(db_path) as conn:
+        return conn.execute(_SQL_COUNT_BY_PERIOD, (username, _norm_ymd(start_date), _norm_ymd(end_date))).fetchone()[0]
+
 
+def fetch_by_category(level: int, name: str, username: str, db_path: Optional[str] = None) -> List[PurchaseRow]:
+    sql = _SQL_FETCH_BY_CATEGORY.get(int(level))
+    if sql is None:
+        raise ValueError(f"Unsupported category level: {level}")
+    with _get_pooled(db_path) as conn:
+        return _fetch_rows(conn, sql, (name, username))
 
-def fetch_by_organization(organization: str, username: str, db_path: Optional[str] = None) -> List[Dict]:
-    org = (organization or "").strip()
-    variants = {org, org.lower(), org.upper(), org.title()}
-    likes = [f"%{v}%" for v in variants if v]
-    if not likes:
+
+def fetch_by_organization(organization: str, username: str, db_path: Optional[str] = None) -> List[PurchaseRow]:
+    # Поиск по вхождению без учета регистра (в том числе кириллицы); % и _ - обычные символы
+    needle = (organization or "").strip().casefold()
+    if not needle:
         return []
-    placeholders = " OR ".join(["organization LIKE ?"] * len(likes))
-    with get_connection(db_path) as conn:
-        cur = conn.execute(
-            f"SELECT * FROM purchases WHERE username = ? AND ({placeholders}) ORDER BY date DESC",
-            (username, *likes),
-        )
-        rows = cur.fetchall()
-        columns = [desc[0] for desc in cur.description]
-        return [dict(zip(columns, row)) for row in rows]
+    with _get_pooled(db_path) as conn:
+        return _fetch_rows(conn, _SQL_FETCH_BY_ORGANIZATION, (username, needle))
 
 
-def fetch_by_product_name(product_name: str, username: str, db_path: Optional[str] = None) -> List[Dict]:
-    like = f"%{product_name}%"
-    with get_connection(db_path) as conn:
-        cur = conn.execute(
-            "SELECT * FROM purchases WHERE product_name LIKE ? AND username = ? ORDER BY date DESC",
-            (like, username)
-        )
-        rows = cur.fetchall()
-        columns = [desc[0] for desc in cur.description]
-        return [dict(zip(columns, row)) for row in rows]
+# Короче 3 символов trigram-индекс не ищет
+_FTS_MIN_LENGTH = 3
 
 
-def fetch_by_description(description: str, username: str, db_path: Optional[str] = None) -> List[Dict]:
-    like = f"%{description}%"
-    with get_connection(db_path) as conn:
-        cur = conn.execute(
-            "SELECT * FROM purchases WHERE description LIKE ? AND username = ? ORDER BY date DESC",
-            (like, username)
-        )
-        rows = cur.fetchall()
-        columns = [desc[0] for desc in cur.description]
-        return [dict(zip(columns, row)) for row in rows]
+def _search_text(column: str, text: str, username: str, db_path: Optional[str]) -> List[PurchaseRow]:
+    """Поиск по вхождению text в column через purchases_fts, без FTS5 - через LIKE."""
+    text = text or ""
+    with _get_pooled(db_path) as conn:
+        if len(text) >= _FTS_MIN_LENGTH:
+            phrase = text.replace('"', '""')
+            try:
+                return _fetch_rows(conn, _SQL_SEARCH_FTS, (f'{column} : "{phrase}"', username))
+            except sqlite3.OperationalError:
+                pass
+        return _fetch_rows(conn, _SQL_SEARCH_LIKE[column], (f"%{text}%", username))
 
 
-def get_cheque_by_id(chequeid: int, username: str, db_path: Optional[str] = None) -> List[Dict]:
-    with get_connection(db_path) as conn:
-        cur = conn.execute(
-            "SELECT * FROM purchases WHERE chequeid = ? AND username = ? ORDER BY id",
-            (chequeid, username)
-        )
-        rows = cur.fetchall()
-        columns = [desc[0] for desc in cur.description]
-        return [dict(zip(columns, row)) for row in rows]
+def fetch_by_product_name(product_name: str, username: str, db_path: Optional[str] = None) -> List[PurchaseRow]:
+    return _search_text("product_name", product_name, username, db_path)
 
 
-def get_last_cheque(username: str, db_path: Optional[str] = None) -> List[Dict]:
-    with get_connection(db_path) as conn:
-        cur = conn.execute(
-            "SELECT MAX(chequeid) FROM purchases WHERE username = ?",
-            (username,)
-        )
-        row = cur.fetchone()
-        if not row or not row[0]:
-            return []
-        
-        return get_cheque_by_id(row[0], username, db_path)
+def fetch_by_description(description: str, username: str, db_path: Optional[str] = None) -> List[PurchaseRow]:
+    return _search_text("description", description, username, db_path)
+
+
+def get_cheque_by_id(chequeid: int, username: str, db_path: Optional[str] = None) -> List[PurchaseRow]:
+    with _get_pooled(db_path) as conn:
+        return _fetch_rows(conn, _SQL_GET_CHEQUE_BY_ID, (chequeid, username))
+
+
+def get_last_cheque(username: str, db_path: Optional[str] = None) -> List[PurchaseRow]:
+    with _get_pooled(db_path) as conn:
+        return _fetch_rows(conn, _SQL_GET_LAST_CHEQUE, (username, username))
 
 
 def get_max_chequeid(username: str, db_path: Optional[str] = None) -> Optional[int]:
-    with get_connection(db_path) as conn:
-        cur = conn.execute(
-            "SELECT MAX(chequeid) FROM purchases WHERE username = ?",
-            (username,)
-        )
+    with _get_pooled(db_path) as conn:
+        cur = conn.execute(_SQL_MAX_CHEQUEID, (username,))
         row = cur.fetchone()
         return int(row[0]) if row and row[0] is not None else None
 
 
 def get_summary(start_date: str, end_date: str, username: str, db_path: Optional[str] = None) -> Dict:
-    with get_connection(db_path) as conn:
+    with _get_pooled(db_path) as conn:
         ymd_start = _norm_ymd(start_date)
         ymd_end = _norm_ymd(end_date)
-        cur = conn.execute(
-            f"""SELECT 
-                COUNT(*) as count,
-                SUM(price) as total,
-                COUNT(DISTINCT chequeid) as cheque_count
-            FROM purchases 
-            WHERE ({_DATE_EXPR_SQL}) >= ? AND ({_DATE_EXPR_SQL}) <= ? AND username = ?""",
-            (ymd_start, ymd_end, username)
-        )
-        row = cur.fetchone()
-        return {
-            "count": row[0] if row else 0,
-            "total": round(row[1], 2) if row and row[1] else 0.0,
-            "cheque_count": row[2] if row else 0
-        }
+        cur = conn.execute(_SQL_SUMMARY, (username, ymd_start, ymd_end))
+        # Агрегат без GROUP BY всегда возвращает ровно одну строку
+        count, total, cheque_count = cur.fetchone()
+        return {"count": count, "total": total, "cheque_count": cheque_count}
 
 
 def update_record(record_id: int, field: str, value: str, db_path: Optional[str] = None) -> bool:
@@ -172,13 +264,21 @@ def update_record(record_id: int, field: str, value: str, db_path: Optional[str]
     if field not in allowed_fields:
         raise ValueError(f"Field '{field}' is not allowed for update")
     
-    with get_connection(db_path) as conn:
+    with _get_pooled(db_path, write=True) as conn:
         cursor = conn.cursor()
-        cursor.execute(
-            f"UPDATE purchases SET {field} = ? WHERE id = ?",
-            (value, record_id)
-        )
+        if field == "date":
+            cursor.execute(
+                "UPDATE purchases SET date = ?, date_ymd = ? WHERE id = ?",
+                (value, _norm_ymd(value), record_id)
+            )
+        else:
+            cursor.execute(
+                f"UPDATE purchases SET {field} = ? WHERE id = ?",
+                (value, record_id)
+            )
         conn.commit()
+        if field == "category1":
+            _invalidate_category1_cache()
         return cursor.rowcount > 0
 
 
@@ -186,18 +286,26 @@ def update_field_by_cheque(chequeid: int, field: str, value: str, username: str,
     allowed_fields = ["price", "discount", "description", "product_name", "quantity", "category1", "category2", "category3", "organization", "date"]
     if field not in allowed_fields:
         raise ValueError(f"Field '{field}' is not allowed for update")
-    with get_connection(db_path) as conn:
+    with _get_pooled(db_path, write=True) as conn:
         cursor = conn.cursor()
-        cursor.execute(
-            f"UPDATE purchases SET {field} = ? WHERE chequeid = ? AND username = ?",
-            (value, chequeid, username)
-        )
+        if field == "date":
+            cursor.execute(
+                "UPDATE purchases SET date = ?, date_ymd = ? WHERE chequeid = ? AND username = ?",
+                (value, _norm_ymd(value), chequeid, username)
+            )
+        else:
+            cursor.execute(
+                f"UPDATE purchases SET {field} = ? WHERE chequeid = ? AND username = ?",
+                (value, chequeid, username)
+            )
         conn.commit()
+        if field == "category1":
+            _invalidate_category1_cache()
         return cursor.rowcount
 
 
 def update_description_by_cheque(chequeid: int, description: str, username: str, db_path: Optional[str] = None) -> int:
-    with get_connection(db_path) as conn:
+    with _get_pooled(db_path, write=True) as conn:
         cursor = conn.cursor()
         cursor.execute(
             "UPDATE purchases SET description = ? WHERE chequeid = ? AND username = ?",
@@ -208,7 +316,7 @@ def update_description_by_cheque(chequeid: int, description: str, username: str,
 
 
 def update_description_by_organization(organization: str, description: str, username: str, db_path: Optional[str] = None) -> int:
-    with get_connection(db_path) as conn:
+    with _get_pooled(db_path, write=True) as conn:
         cursor = conn.cursor()
         cursor.execute(
             "UPDATE purchases SET description = ? WHERE organization = ? AND username = ?",
@@ -218,6 +326,17 @@ def update_description_by_organization(organization: str, description: str, user
         return cursor.rowcount
 
 
+# Результаты find_exact_category1 на время диалога: (db_path, username, значение) -> (время, категория).
+# Сбрасывается целиком при изменении category1 через этот модуль
+_CATEGORY1_CACHE_TTL = 30.0
+_CATEGORY1_CACHE_SIZE = 256
+_category1_cache: Dict[Tuple[Optional[str], str, str], Tuple[float, Optional[str]]] = {}
+
+
+def _invalidate_category1_cache() -> None:
+    _category1_cache.clear()
+
+
 def find_exact_category1(search_value: str, username: str, db_path: Optional[str] = None) -> Optional[str]:
     """
     Находит точное значение category1 в базе данных по поисковому значению.
@@ -232,17 +351,38 @@ def find_exact_category1(search_value: str, username: str, db_path: Optional[str
         Точное значение category1 из базы или None, если не найдено
     """
     if not search_value:
-        logger.warning(f"find_exact_category1: пустое значение поиска для username={username}")
+        logger.warning("find_exact_category1: пустое значение поиска для username=%s", username)
         return None
         
     search_value_clean = search_value.strip()
-    search_lower = search_value_clean.lower()
+    key = (db_path, username, search_value_clean)
+    now = time.monotonic()
+    cached = _category1_cache.get(key)
+    if cached is not None and now - cached[0] < _CATEGORY1_CACHE_TTL:
+        return cached[1]
     
-    logger.info(f"find_exact_category1: поиск '{search_value_clean}' (lower: '{search_lower}') для username={username}")
+    result = _lookup_category1(search_value_clean, username, db_path)
+    if len(_category1_cache) >= _CATEGORY1_CACHE_SIZE:
+        _category1_cache.clear()
+    _category1_cache[key] = (now, result)
+    return result
+
+
+def _lookup_category1(search_value_clean: str, username: str, db_path: Optional[str]) -> Optional[str]:
+    search_lower = search_value_clean.lower()
     
-    with get_connection(db_path) as conn:
+    with _get_pooled(db_path) as conn:
         cursor = conn.cursor()
         
+        # Точное совпадение - поиск по индексу (username, category1), без выборки всех категорий
+        row = cursor.execute(
+            "SELECT category1 FROM purchases WHERE username = ? AND category1 = ? LIMIT 1",
+            (username, search_value_clean)
+        ).fetchone()
+        if row:
+            logger.debug("find_exact_category1: найдено точное совпадение '%s'", row[0])
+            return row[0]
+        
         # Получаем все категории пользователя
         cursor.execute(
             "SELECT DISTINCT category1 FROM purchases WHERE category1 IS NOT NULL AND username = ?",
@@ -251,21 +391,22 @@ def find_exact_category1(search_value: str, username: str, db_path: Optional[str
         rows = cursor.fetchall()
         all_categories = [row[0].strip() for row in rows if row[0]]
         
-        logger.info(f"find_exact_category1: найдено {len(all_categories)} категорий для username={username}: {all_categories[:10]}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("find_exact_category1: найдено %d категорий для username=%s: %s", len(all_categories), username, all_categories[:10])
         
-        # Сначала пробуем точное совпадение
+        # Значения с пробелами по краям
         for category in all_categories:
             if category == search_value_clean:
-                logger.info(f"find_exact_category1: найдено точное совпадение '{category}'")
+                logger.info("find_exact_category1: найдено точное совпадение '%s'", category)
                 return category
         
         # Если не найдено, ищем без учета регистра
         for category in all_categories:
             if category.lower() == search_lower:
-                logger.info(f"find_exact_category1: найдено совпадение без учета регистра '{category}' для '{search_value_clean}'")
+                logger.info("find_exact_category1: найдено совпадение без учета регистра '%s' для '%s'", category, search_value_clean)
                 return category
         
-        logger.warning(f"find_exact_category1: категория '{search_value_clean}' не найдена среди {len(all_categories)} категорий")
+        logger.warning("find_exact_category1: категория '%s' не найдена среди %d категорий", search_value_clean, len(all_categories))
         return None
 
 
@@ -282,32 +423,44 @@ def merge_category1_groups(source_value: str, target_value: str, username: str,
     Returns:
         Tuple[int, bool]: (количество обновленных записей, True если source_value найден)
     """
-    with get_connection(db_path) as conn:
+    with _get_pooled(db_path, write=True) as conn:
         cursor = conn.cursor()
         
-        # Проверяем существование source_value
-        cursor.execute(
-            "SELECT COUNT(*) FROM purchases WHERE category1 = ? AND username = ?",
-            (source_value, username)
-        )
-        count = cursor.fetchone()[0]
-        
-        if count == 0:
-            return (0, False)
-        
-        # Выполняем обновление
+        # source_value найден, если UPDATE затронул хоть одну запись - отдельный COUNT не нужен
         cursor.execute(
             "UPDATE purchases SET category1 = ? WHERE category1 = ? AND username = ?",
             (target_value, source_value, username)
         )
         conn.commit()
+        _invalidate_category1_cache()
         
-        return (cursor.rowcount, True)
+        return (cursor.rowcount, cursor.rowcount > 0)
+
+
+# Поля группировки и готовый запрос для каждого. NULL в SQLite меньше любого значения,
+# поэтому при ORDER BY total DESC суммы NULL и так идут последними (NULLS LAST не нужен)
+_GROUP_FIELDS = frozenset({"category1", "category2", "category3", "organization", "description"})
+_CATEGORY_FIELDS = {level: f"category{level}" for level in (1, 2, 3)}
+_GROUPED_STATS_SQL = {
+    field: f"""
+        SELECT {field} as group_name,
+               COUNT(*) as count,
+               COUNT(DISTINCT chequeid) as cheque_count,
+               SUM(price) as total
+        FROM purchases
+        WHERE username = ? AND date_ymd BETWEEN ? AND ? AND {field} IS NOT NULL
+        GROUP BY {field}
+        ORDER BY total DESC
+    """
+    for field in _GROUP_FIELDS
+}
 
 
 def get_category_stats(level: int, start_date: Optional[str] = None, end_date: Optional[str] = None, username: Optional[str] = None, db_path: Optional[str] = None) -> List[Dict]:
-    category_field = f"category{level}"
-    with get_connection(db_path) as conn:
+    category_field = _CATEGORY_FIELDS.get(int(level))
+    if category_field is None:
+        raise ValueError(f"Unsupported category level: {level}")
+    with _get_pooled(db_path) as conn:
         query = f"""SELECT 
             {category_field} as category,
             COUNT(*) as count,
@@ -332,28 +485,11 @@ def get_category_stats(level: int, start_date: Optional[str] = None, end_date: O
 
 
 def get_grouped_stats(field: str, start_date: str, end_date: str, username: str, db_path: Optional[str] = None) -> List[Dict]:
-    allowed_fields = {"category1", "category2", "category3", "organization", "description"}
-    if field not in allowed_fields:
+    query = _GROUPED_STATS_SQL.get(field)
+    if query is None:
         raise ValueError(f"Unsupported group field: {field}")
-    with get_connection(db_path) as conn:
-        ymd_start = _norm_ymd(start_date)
-        ymd_end = _norm_ymd(end_date)
-        query = f"""
-            SELECT {field} as group_name,
-                   COUNT(*) as count,
-                   COUNT(DISTINCT chequeid) as cheque_count,
-                   SUM(price) as total
-            FROM purchases
-            WHERE ({_DATE_EXPR_SQL}) >= ? AND ({_DATE_EXPR_SQL}) <= ? AND username = ? AND {field} IS NOT NULL
-            GROUP BY {field}
-            ORDER BY total DESC NULLS LAST
-        """
-        # SQLite doesn't support NULLS LAST syntax; ignore error with fallback
-        try:
-            cur = conn.execute(query, (ymd_start, ymd_end, username))
-        except Exception:
-            query = query.replace(" NULLS LAST", "")
-            cur = conn.execute(query, (ymd_start, ymd_end, username))
+    with _get_pooled(db_path) as conn:
+        cur = conn.execute(query, (username, _norm_ymd(start_date), _norm_ymd(end_date)))
         rows = cur.fetchall()
         columns = [desc[0] for desc in cur.description]
         results = [dict(zip(columns, row)) for row in rows]
@@ -363,19 +499,18 @@ def get_grouped_stats(field: str, start_date: str, end_date: str, username: str,
 
 
 def get_grouped_stats_filtered(field: str, start_date: str, end_date: str, username: str, filters: Dict[str, str], db_path: Optional[str] = None) -> List[Dict]:
-    allowed_fields = {"category1", "category2", "category3", "organization", "description"}
-    if field not in allowed_fields:
+    if field not in _GROUP_FIELDS:
         raise ValueError(f"Unsupported group field: {field}")
     ymd_start = _norm_ymd(start_date)
     ymd_end = _norm_ymd(end_date)
-    params: List = [ymd_start, ymd_end, username]
-    where = [f"({_DATE_EXPR_SQL}) >= ?", f"({_DATE_EXPR_SQL}) <= ?", "username = ?"]
+    params: List = [username, ymd_start, ymd_end]
+    where = ["username = ?", "date_ymd BETWEEN ? AND ?"]
     for k, v in (filters or {}).items():
-        if k in allowed_fields:
+        if k in _GROUP_FIELDS:
             where.append(f"{k} = ?")
             params.append("" if v is None else str(v))
     where_clause = " AND ".join(where)
-    with get_connection(db_path) as conn:
+    with _get_pooled(db_path) as conn:
         query = f"""
             SELECT {field} as group_name,
                    COUNT(*) as count,
@@ -386,11 +521,12 @@ def get_grouped_stats_filtered(field: str, start_date: str, end_date: str, usern
             GROUP BY {field}
             ORDER BY total DESC
         """
-        logger.info(
-            "SQL[get_grouped_stats_filtered]: %s | params=%s",
-            " ".join(query.split()),
-            params,
-        )
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "SQL[get_grouped_stats_filtered]: %s | params=%s",
+                " ".join(query.split()),
+                params,
+            )
         cur = conn.execute(query, params)
         rows = cur.fetchall()
         columns = [desc[0] for desc in cur.description]
@@ -400,52 +536,47 @@ def get_grouped_stats_filtered(field: str, start_date: str, end_date: str, usern
         return results
 
 
+# Дата, организация и файл наследуются от последней позиции чека одним INSERT ... SELECT;
+# у нового чека дата - сегодня
+_SQL_ADD_ITEM_TO_CHEQUE = """
+    INSERT INTO purchases (chequeid, file_path, date, created_at, product_name, quantity, price, discount,
+                           category1, category2, category3, organization, username, description, date_ymd)
+    SELECT :chequeid, last.file_path, COALESCE(last.date, :today), :created_at, :product_name, :quantity, :price, :discount,
+           NULL, NULL, NULL, last.organization, :username, NULL, COALESCE(last.date_ymd, :today_ymd)
+    FROM (SELECT 1) LEFT JOIN (
+        SELECT file_path, date, organization, date_ymd FROM purchases
+        WHERE chequeid = :chequeid AND username = :username ORDER BY id DESC LIMIT 1
+    ) AS last
+"""
+
+
 def add_item_to_cheque(chequeid: int, product_name: str, price: float, username: str, quantity: float = 1.0, discount: float = 0.0, db_path: Optional[str] = None) -> int:
     if not product_name or price is None:
         raise ValueError("product_name and price are required")
-    with get_connection(db_path) as conn:
-        # try to inherit date/organization/file_path from existing rows of the cheque
-        cur = conn.execute(
-            "SELECT date, organization, file_path FROM purchases WHERE chequeid = ? AND username = ? ORDER BY id DESC LIMIT 1",
-            (chequeid, username)
-        )
-        row = cur.fetchone()
-        if row:
-            date_val, organization, file_path = row
-        else:
-            date_val = datetime.now().strftime("%d.%m.%Y")
-            organization = None
-            file_path = None
+    now = datetime.now()
+    today = now.strftime("%d.%m.%Y")
+    with _get_pooled(db_path, write=True) as conn:
         cursor = conn.cursor()
         cursor.execute(
-            (
-                "INSERT INTO purchases (chequeid, file_path, date, created_at, product_name, quantity, price, discount, "
-                "category1, category2, category3, organization, username, description) "
-                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
-            ),
-            (
-                chequeid,
-                file_path,
-                date_val,
-                datetime.now().isoformat(),
-                product_name,
-                float(quantity or 1),
-                float(price),
-                float(discount or 0.0),
-                None,
-                None,
-                None,
-                organization,
-                username,
-                None,
-            ),
+            _SQL_ADD_ITEM_TO_CHEQUE,
+            {
+                "chequeid": chequeid,
+                "username": username,
+                "today": today,
+                "today_ymd": _norm_ymd(today),
+                "created_at": now.isoformat(),
+                "product_name": product_name,
+                "quantity": float(quantity or 1),
+                "price": float(price),
+                "discount": float(discount or 0.0),
+            },
         )
         conn.commit()
         return cursor.lastrowid
 
 
 def delete_cheque(chequeid: int, username: str, db_path: Optional[str] = None) -> Tuple[int, Optional[str]]:
-    with get_connection(db_path) as conn:
+    with _get_pooled(db_path, write=True) as conn:
         cur = conn.execute(
             "SELECT file_path FROM purchases WHERE chequeid = ? AND username = ? LIMIT 1",
             (chequeid, username)
@@ -458,5 +589,6 @@ def delete_cheque(chequeid: int, username: str, db_path: Optional[str] = None) -
             (chequeid, username)
         )
         conn.commit()
+        _invalidate_category1_cache()
         return cursor.rowcount, file_path
 
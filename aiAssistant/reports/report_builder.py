@@ -1,5 +1,13 @@
 """Report builder for generating user-friendly output."""
-from typing import List, Dict, Any
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+# Максимальная длина сообщения Telegram
+_TELEGRAM_LIMIT = 4096
+# Отчет в ответе бота: запас под заголовок, который бот ставит перед отчетом
+_REPORT_LIMIT = _TELEGRAM_LIMIT - 256
+_ELLIPSIS = "..."
+# Длина названия товара в чеке
+_NAME_WIDTH = 40
 
 
 class ReportBuilder:
@@ -8,46 +16,56 @@ class ReportBuilder:
         if not items:
             return ""
         
-        chequeid = items[0].get("chequeid", "N/A")
-        date = items[0].get("date", "N/A")
-        organization = items[0].get("organization", "N/A")
-        positions_count = len(items)
+        first = items[0]
+        chequeid = first.get("chequeid", "N/A")
+        date = first.get("date", "N/A")
+        organization = first.get("organization", "N/A")
         
         # Header
-        result = f"🧾 Чек № {chequeid} | 📅 {date}\n"
-        result += f"🏪 {organization}\n\n"
+        parts = [f"🧾 Чек № {chequeid} | 📅 {date}\n", f"🏪 {organization}\n\n"]
+        append = parts.append
         
-        # Body - компактный формат
+        # Body - компактный формат. Позиции из парсера могут быть без части полей, поэтому get
         total = 0.0
         for idx, item in enumerate(items, 1):
             name = item.get("product_name", "N/A")
-            price = float(item.get("price", 0) or 0)
-            quantity = float(item.get("quantity", 1) or 1)
+            price = item.get("price")
+            price = float(price) if price else 0.0
+            quantity = item.get("quantity")
+            quantity = float(quantity) if quantity else 1.0
             total += price
             
             # Обрезаем длинные названия
-            name_display = name[:40] + "..." if len(name) > 40 else name
+            if len(name) > _NAME_WIDTH:
+                name = name[:_NAME_WIDTH] + "..."
             
             # Показываем количество только если не равно 1
             if quantity != 1:
-                result += f"{idx}. {name_display} | {price:.2f} ₽ × {quantity} шт.\n"
+                append(f"{idx}. {name} | {price:.2f} ₽ × {quantity} шт.\n")
             else:
-                result += f"{idx}. {name_display} | {price:.2f} ₽\n"
+                append(f"{idx}. {name} | {price:.2f} ₽\n")
         
         # Footer
-        result += f"\n💳 Итого: {total:.2f} ₽"
+        parts.append(f"\n💳 Итого: {total:.2f} ₽")
         
-        return result
+        return "".join(parts)
     
     @staticmethod
-    def format_purchases_list(purchases: List[Dict], limit: int = 10) -> str:
+    def format_purchases_list(purchases: List[Dict], limit: int = 10, total_count: Optional[int] = None) -> str:
+        """total_count - число всех найденных записей, если purchases уже урезан до limit."""
+        return ReportBuilder.truncate(ReportBuilder._iter_format_purchases_list(purchases, limit, total_count), _REPORT_LIMIT)
+
+    @staticmethod
+    def _iter_format_purchases_list(purchases: List[Dict], limit: int = 10, total_count: Optional[int] = None) -> Iterator[str]:
         if not purchases:
-            return "Записей не найдено"
+            yield "Записей не найдено"
+            return
         
-        total_count = len(purchases)
+        if total_count is None:
+            total_count = len(purchases)
         display_items = purchases[:limit]
         
-        result = f"📊 **Найдено записей: {total_count}**\n\n"
+        yield f"📊 **Найдено записей: {total_count}**\n\n"
         
         total_sum = 0
         for item in display_items:
@@ -58,54 +76,45 @@ class ReportBuilder:
             org = item.get("organization", "N/A")[:30]
             cid = item.get("chequeid", "N/A")
             
-            result += f"• #{cid} {name}\n"
-            result += f"  💰 {price:.2f} ₽ | 📅 {date} | 🏪 {org}\n\n"
+            yield f"• #{cid} {name}\n  💰 {price:.2f} ₽ | 📅 {date} | 🏪 {org}\n\n"
         
         if total_count > limit:
-            result += f"... и ещё {total_count - limit} записей\n\n"
+            yield f"... и ещё {total_count - limit} записей\n\n"
         
-        result += f"💳 **Сумма (первые {len(display_items)}): {total_sum:.2f} ₽**"
-        
-        return result
+        yield f"💳 **Сумма (первые {len(display_items)}): {total_sum:.2f} ₽**"
 
     @staticmethod
     def format_cheque_totals(purchases: List[Dict], limit: int = 20) -> str:
         """
         Группировка позиций по номерам чеков: дата чека, номер чека, сумма чека, организация.
         """
+        return ReportBuilder.truncate(ReportBuilder._iter_format_cheque_totals(purchases, limit), _REPORT_LIMIT)
+
+    @staticmethod
+    def _iter_format_cheque_totals(purchases: List[Dict], limit: int = 20) -> Iterator[str]:
         if not purchases:
-            return "Записей не найдено"
+            yield "Записей не найдено"
+            return
 
-        groups = {}
-        order = []
+        # Чеки в порядке первого появления (dict сохраняет порядок вставки): [дата, номер, организация, сумма]
+        groups: Dict[Any, list] = {}
         for p in purchases:
             cid = p.get("chequeid")
-            if cid not in groups:
-                groups[cid] = {
-                    "sum": 0.0,
-                    "date": p.get("date", "N/A"),
-                    "chequeid": cid or "N/A",
-                    "organization": p.get("organization", "N/A"),
-                }
-                order.append(cid)
-            price = float(p.get("price", 0) or 0)
-            groups[cid]["sum"] += price
-
-        total_cheques = len(groups)
-        display_ids = order[:limit]
+            group = groups.get(cid)
+            if group is None:
+                group = groups[cid] = [p.get("date", "N/A"), cid or "N/A", p.get("organization", "N/A"), 0.0]
+            group[3] += float(p.get("price", 0) or 0)
+        cheques = list(groups.values())
 
-        lines = []
-        for cid in display_ids:
-            g = groups[cid]
-            lines.append(f"• 📅 {g['date']} | 🧾 {g['chequeid']} | 💳 {g['sum']:.2f} ₽ | 🏪 {g['organization']}")
-
-        result = f"📊 **Найдено чеков: {total_cheques}**\n\n"
-        result += "\n".join(lines)
+        total_cheques = len(cheques)
+        yield f"📊 **Найдено чеков: {total_cheques}**\n\n"
+        separator = ""
+        for date, chequeid, organization, total in cheques[:limit]:
+            yield f"{separator}• 📅 {date} | 🧾 {chequeid} | 💳 {total:.2f} ₽ | 🏪 {organization}"
+            separator = "\n"
 
         if total_cheques > limit:
-            result += f"\n\n... и ещё {total_cheques - limit} чеков"
-
-        return result
+            yield f"\n\n... и ещё {total_cheques - limit} чеков"
     
     @staticmethod
     def format_summary(summary: Dict) -> str:
@@ -113,38 +122,41 @@ class ReportBuilder:
         total = summary.get("total", 0.0)
         cheque_count = summary.get("cheque_count", 0)
         
-        result = "📊 **Статистика:**\n\n"
-        result += f"🧾 Чеков: {cheque_count}\n"
-        result += f"📦 Позиций: {count}\n"
-        result += f"💰 **Общая сумма: {total:.2f} ₽**"
-        
-        return result
+        return (
+            "📊 **Статистика:**\n\n"
+            f"🧾 Чеков: {cheque_count}\n"
+            f"📦 Позиций: {count}\n"
+            f"💰 **Общая сумма: {total:.2f} ₽**"
+        )
     
     @staticmethod
     def format_category_stats(stats: List[Dict]) -> str:
         if not stats:
             return "Нет данных по категориям"
         
-        result = "📊 **Статистика по категориям:**\n\n"
+        parts = ["📊 **Статистика по категориям:**\n\n"]
         
         for item in stats:
             category = item.get("category", "N/A")
             count = item.get("count", 0)
             total = item.get("total", 0.0)
             
-            result += f"🏷️ **{category}**\n"
-            result += f"   📦 Позиций: {count}\n"
-            result += f"   💰 Сумма: {total:.2f} ₽\n\n"
+            parts.append(f"🏷️ **{category}**\n   📦 Позиций: {count}\n   💰 Сумма: {total:.2f} ₽\n\n")
         
         total_sum = sum(item.get("total", 0) for item in stats)
-        result += f"💳 **Итого: {total_sum:.2f} ₽**"
+        parts.append(f"💳 **Итого: {total_sum:.2f} ₽**")
         
-        return result
+        return "".join(parts)
     
     @staticmethod
     def format_grouped_stats(stats: List[Dict], field_name: str) -> str:
+        return ReportBuilder.truncate(ReportBuilder._iter_format_grouped_stats(stats, field_name), _REPORT_LIMIT)
+
+    @staticmethod
+    def _iter_format_grouped_stats(stats: List[Dict], field_name: str) -> Iterator[str]:
         if not stats:
-            return f"Нет данных для группировки по {field_name}"
+            yield f"Нет данных для группировки по {field_name}"
+            return
         
         field_emoji = {
             "category1": "🏷️",
@@ -156,29 +168,44 @@ class ReportBuilder:
         
         emoji = field_emoji.get(field_name, "📊")
         
-        result = f"📊 **Группировка по {field_name}:**\n\n"
+        yield f"📊 **Группировка по {field_name}:**\n\n"
         
+        # Итоги копятся в том же проходе, что и строки отчета
+        total_sum = total_items = total_cheques = 0
         for idx, item in enumerate(stats, 1):
             group_name = item.get("group_name", "N/A")
             count = item.get("count", 0)
             total = item.get("total", 0.0)
             cheque_count = item.get("cheque_count", 0)
+            total_sum += total
+            total_items += count
+            total_cheques += cheque_count
             
-            result += f"{idx}. {emoji} **{group_name}**\n"
-            result += f"   🧾 Чеков: {cheque_count}\n"
-            result += f"   📦 Позиций: {count}\n"
-            result += f"   💰 Сумма: {total:.2f} ₽\n\n"
-        
-        total_sum = sum(item.get("total", 0) for item in stats)
-        total_items = sum(item.get("count", 0) for item in stats)
-        total_cheques = sum(item.get("cheque_count", 0) for item in stats)
-        
-        result += f"📊 **Итого:**\n"
-        result += f"   🧾 Чеков: {total_cheques}\n"
-        result += f"   📦 Позиций: {total_items}\n"
-        result += f"   💳 **Сумма: {total_sum:.2f} ₽**"
-        
-        return result
+            yield (
+                f"{idx}. {emoji} **{group_name}**\n"
+                f"   🧾 Чеков: {cheque_count}\n"
+                f"   📦 Позиций: {count}\n"
+                f"   💰 Сумма: {total:.2f} ₽\n\n"
+            )
+        
+        yield (
+            "📊 **Итого:**\n"
+            f"   🧾 Чеков: {total_cheques}\n"
+            f"   📦 Позиций: {total_items}\n"
+            f"   💳 **Сумма: {total_sum:.2f} ₽**"
+        )
+    
+    @staticmethod
+    def truncate(chunks: Iterable[str], max_chars: int = _TELEGRAM_LIMIT) -> str:
+        """Склеивает куски отчета, пока текст помещается в max_chars; хвост не форматируется."""
+        parts: List[str] = []
+        length = 0
+        for chunk in chunks:
+            parts.append(chunk)
+            length += len(chunk)
+            if length > max_chars:
+                return "".join(parts)[:max_chars - len(_ELLIPSIS)] + _ELLIPSIS
+        return "".join(parts)
     
     @staticmethod
     def format_update_result(success: bool, rows_affected: int = 0) -> str:
@@ -4,9 +4,11 @@ import sys
 import json
 import logging
 import re
+import time
 from datetime import datetime, timezone, timedelta
+from functools import lru_cache
 import asyncio
-from typing import Optional, Tuple, List, Dict
+from typing import Callable, Optional, Tuple, List, Dict
 
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 if PROJECT_ROOT not in sys.path:
@@ -24,14 +26,14 @@ from aiogram.types import (
 )
 from aiogram import F
 
-from config import TELEGRAM_BOT_TOKEN, CHEQUE_DIR, DB_DIR, OPENAI_API_KEY
+from config import TELEGRAM_BOT_TOKEN, CHEQUE_DIR, DB_DIR, DB_PATH, OPENAI_API_KEY
 from db.db_manager import init_db, get_next_cheque_id, bulk_insert_purchases, check_duplicate_cheque
 from parser.cheque_parser import parse_cheque_with_gpt
 from parser.parse_receipt import extract_receipt_text
 from openai import OpenAI
 
 from aiAssistant.core.context_manager import ContextManager
-from aiAssistant.core.ai_client import AIClient
+from aiAssistant.core.ai_client import AIClient, close_persistent_caches
 from utils.api_logger import get_api_logger
 from aiAssistant.core.date_helpers import (
     get_last_n_days,
@@ -43,6 +45,7 @@ from aiAssistant.core.date_helpers import (
     normalize_to_current_month_if_same_month_wrong_year,
     _parse_ddmmyyyy,
     parse_period_string,
+    reset_today_cache,
 )
 from aiAssistant.db import db_manager as ai_db
 from aiAssistant.reports.report_builder import ReportBuilder
@@ -71,6 +74,8 @@ bot = Bot(token=TELEGRAM_BOT_TOKEN)
 dp = Dispatcher()
 
 
+# Категории повторяются из записи в запись: перекодировки считаются один раз на значение
+@lru_cache(maxsize=4096)
 def _normalize_text(value: Optional[str]) -> str:
     if value is None:
         return ""
@@ -104,8 +109,13 @@ def _normalize_text(value: Optional[str]) -> str:
     return best.lower()
 
 
+_DATE_SEP_TRANS = str.maketrans({"/": ".", "-": "."})
+
+
+# Одни и те же даты приходят в сообщениях снова и снова
+@lru_cache(maxsize=1024)
 def _normalize_date_token(token: str) -> Optional[str]:
-    cleaned = token.replace("/", ".").replace("-", ".").strip()
+    cleaned = token.translate(_DATE_SEP_TRANS).strip()
     parts = cleaned.split(".")
     if len(parts) != 3:
         return None
@@ -119,16 +129,18 @@ def _normalize_date_token(token: str) -> Optional[str]:
         return None
 
 
+# Диапазон "дата ... дата" и одиночная дата в тексте сообщения.
+# Разделитель между датами possessive ({0,10}+, re с Python 3.11): без возвратов в него
+_RANGE_RE = re.compile(r"(\d{1,2}[./-]\d{1,2}[./-]\d{2,4})[^0-9]{0,10}+(\d{1,2}[./-]\d{1,2}[./-]\d{2,4})")
+_SINGLE_DATE_RE = re.compile(r"\b(\d{1,2}[./-]\d{1,2}[./-]\d{2,4})\b")
+
+
 def extract_period_from_message(message: str) -> Tuple[Optional[str], Optional[str]]:
     text = (message or "").strip()
     if not text:
         return None, None
     
-    range_match = re.search(
-        r"(\d{1,2}[./-]\d{1,2}[./-]\d{2,4})[^0-9]{0,10}(\d{1,2}[./-]\d{1,2}[./-]\d{2,4})",
-        text,
-        flags=re.IGNORECASE,
-    )
+    range_match = _RANGE_RE.search(text)
     if range_match:
         start_raw, end_raw = range_match.groups()
         start_norm = _normalize_date_token(start_raw)
@@ -136,11 +148,7 @@ def extract_period_from_message(message: str) -> Tuple[Optional[str], Optional[s
         if start_norm and end_norm:
             return start_norm, end_norm
     
-    single_match = re.search(
-        r"\b(\d{1,2}[./-]\d{1,2}[./-]\d{2,4})\b",
-        text,
-        flags=re.IGNORECASE,
-    )
+    single_match = _SINGLE_DATE_RE.search(text)
     if single_match:
         date_norm = _normalize_date_token(single_match.group(1))
         if date_norm:
@@ -177,10 +185,10 @@ def aggregate_category2_by_category1(records: list[dict], category1_value: str)
             continue
         raw_group_name = (item.get("category2") or "Без категории2").strip()
         group_key = _normalize_text(raw_group_name)
-        bucket = grouped.setdefault(
-            group_key,
-            {"group_name": raw_group_name, "count": 0, "total": 0.0, "cheque_ids": set()},
-        )
+        # Новая группа - не на каждой записи: setdefault создавал бы словарь и множество впустую
+        bucket = grouped.get(group_key)
+        if bucket is None:
+            bucket = grouped[group_key] = {"group_name": raw_group_name, "count": 0, "total": 0.0, "cheque_ids": set()}
         bucket["count"] += 1
         try:
             bucket["total"] += float(item.get("price") or 0.0)
@@ -189,28 +197,74 @@ def aggregate_category2_by_category1(records: list[dict], category1_value: str)
         chequeid = item.get("chequeid")
         if chequeid is not None:
             bucket["cheque_ids"].add(chequeid)
-    result = []
-    for data in grouped.values():
-        result.append(
-            {
-                "group_name": data["group_name"],
-                "count": data["count"],
-                "cheque_count": len(data["cheque_ids"]),
-                "total": round(data["total"], 2),
-            }
-        )
+    result = [
+        {
+            "group_name": data["group_name"],
+            "count": data["count"],
+            "cheque_count": len(data["cheque_ids"]),
+            "total": round(data["total"], 2),
+        }
+        for data in grouped.values()
+    ]
     result.sort(key=lambda x: x["total"], reverse=True)
     return result
 
 
+class TelegramStreamer:
+    """Показывает ответ модели по мере генерации в одном сообщении; правки не чаще раза в interval секунд."""
+
+    def __init__(self, source: Message, interval: float = 0.4):
+        self._source = source
+        self._interval = interval
+        self._text = ""
+        self._shown = ""
+        self._last_edit = 0.0
+        self.message: Optional[Message] = None
+
+    async def update(self, delta: str) -> None:
+        self._text += delta
+        now = time.monotonic()
+        if self.message is not None and now - self._last_edit < self._interval:
+            return
+        try:
+            if self.message is None:
+                self.message = await self._source.answer(self._text, parse_mode=None)
+            elif self._text != self._shown:
+                await self.message.edit_text(self._text, parse_mode=None)
+            self._shown = self._text
+            self._last_edit = now
+        except Exception as e:
+            logger.debug(f"Streaming update skipped: {e}")
+
+    async def send(self, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None) -> None:
+        """Итоговый текст: правит уже показанное сообщение либо отправляет новое."""
+        if self.message is None:
+            await self._source.answer(text, parse_mode=None, reply_markup=reply_markup)
+        elif text != self._shown or reply_markup is not None:
+            await self.message.edit_text(text, parse_mode=None, reply_markup=reply_markup)
+        self._shown = text
+
+    async def discard(self) -> None:
+        if self.message is not None:
+            try:
+                await self.message.delete()
+            except Exception as e:
+                logger.debug(f"Failed to delete streamed message: {e}")
+            self.message = None
+
+
 def ensure_dirs() -> None:
     os.makedirs(CHEQUE_DIR, exist_ok=True)
     os.makedirs(DB_DIR, exist_ok=True)
 
 
+# Символы, недопустимые в имени папки пользователя, заменяются на "_" за один проход
+_USERNAME_SANITIZE = str.maketrans({ch: "_" for ch in ' /\\:*?"<>|'})
+
+
 def get_user_cheque_dir(username: Optional[str] = None, chat_id: Optional[int] = None) -> str:
     if username:
-        safe_username = username.replace(" ", "_").replace("/", "_").replace("\\", "_").replace(":", "_").replace("*", "_").replace("?", "_").replace('"', "_").replace("<", "_").replace(">", "_").replace("|", "_")
+        safe_username = username.translate(_USERNAME_SANITIZE)
         user_dir = os.path.join(CHEQUE_DIR, safe_username)
     elif chat_id:
         user_dir = os.path.join(CHEQUE_DIR, f"user_{chat_id}")
@@ -237,20 +291,46 @@ NEW_CHEQUE_DATE_CUSTOM = "new_cheque_date_custom"
 SHOW_CHEQUE_PREFIX = "show_cheque_"
 
 
-def build_pending_actions_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(text="💾 Сохранить", callback_data=SAVE_CALLBACK),
-                InlineKeyboardButton(text="🗑️ Удалить", callback_data=DELETE_CALLBACK),
-            ],
-            [
-                InlineKeyboardButton(
-                    text="❌ Не верно. Сделать по-другому", callback_data=RETRY_CALLBACK
-                )
-            ],
+# Клавиатуры без параметров собираются один раз; aiogram только сериализует их, не изменяя
+_PENDING_ACTIONS_KB = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(text="💾 Сохранить", callback_data=SAVE_CALLBACK),
+            InlineKeyboardButton(text="🗑️ Удалить", callback_data=DELETE_CALLBACK),
+        ],
+        [
+            InlineKeyboardButton(
+                text="❌ Не верно. Сделать по-другому", callback_data=RETRY_CALLBACK
+            )
+        ],
+    ]
+)
+_CHEQUE_ACTIONS_KB = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(text="💾 Сохранить чек", callback_data=SAVE_CALLBACK),
+            InlineKeyboardButton(text="🗑️ Удалить чек", callback_data=DELETE_CALLBACK),
+        ],
+        [
+            InlineKeyboardButton(
+                text="❌ Не верно. Сделать по-другому",
+                callback_data=RETRY_CALLBACK
+            )
         ]
-    )
+    ]
+)
+_NEW_CHEQUE_ACTIONS_KB = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(text="💾 Сохранить чек", callback_data=SAVE_CALLBACK),
+            InlineKeyboardButton(text="➕ Добавить позицию", callback_data="new_cheque_add_item")
+        ],
+    ]
+)
+
+
+def build_pending_actions_keyboard() -> InlineKeyboardMarkup:
+    return _PENDING_ACTIONS_KB
 
 
 def build_cheque_items_keyboard(items: List[Dict]) -> InlineKeyboardMarkup:
@@ -283,20 +363,7 @@ def build_cheque_items_keyboard(items: List[Dict]) -> InlineKeyboardMarkup:
 
 def build_cheque_actions_keyboard() -> InlineKeyboardMarkup:
     """Создает клавиатуру только с кнопками действий для чека (без кнопок позиций)."""
-    keyboard = [
-        [
-            InlineKeyboardButton(text="💾 Сохранить чек", callback_data=SAVE_CALLBACK),
-            InlineKeyboardButton(text="🗑️ Удалить чек", callback_data=DELETE_CALLBACK),
-        ],
-        [
-            InlineKeyboardButton(
-                text="❌ Не верно. Сделать по-другому",
-                callback_data=RETRY_CALLBACK
-            )
-        ]
-    ]
-    
-    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+    return _CHEQUE_ACTIONS_KB
 
 
 def build_cheque_list_keyboard(purchases: list[Dict], limit: int = 30) -> InlineKeyboardMarkup:
@@ -415,10 +482,20 @@ def build_new_cheque_setup_keyboard(new_cheque_state: Optional[Dict] = None) ->
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
 
+# Клавиатура выбора даты меняется раз в сутки: (порядковый номер дня, клавиатура)
+_date_keyboard_cache: Optional[Tuple[int, InlineKeyboardMarkup]] = None
+
+
 def build_new_cheque_date_keyboard() -> InlineKeyboardMarkup:
     """Создает клавиатуру для выбора даты чека."""
-    today = datetime.now().strftime("%d.%m.%Y")
-    yesterday = (datetime.now() - timedelta(days=1)).strftime("%d.%m.%Y")
+    global _date_keyboard_cache
+    now = datetime.now()
+    day = now.toordinal()
+    cached = _date_keyboard_cache
+    if cached is not None and cached[0] == day:
+        return cached[1]
+    today = now.strftime("%d.%m.%Y")
+    yesterday = (now - timedelta(days=1)).strftime("%d.%m.%Y")
     
     keyboard = [
         [InlineKeyboardButton(
@@ -435,19 +512,14 @@ def build_new_cheque_date_keyboard() -> InlineKeyboardMarkup:
         )],
     ]
     
-    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+    markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
+    _date_keyboard_cache = (day, markup)
+    return markup
 
 
 def build_new_cheque_actions_keyboard() -> InlineKeyboardMarkup:
     """Создает клавиатуру с кнопками управления новым чеком."""
-    keyboard = [
-        [
-            InlineKeyboardButton(text="💾 Сохранить чек", callback_data=SAVE_CALLBACK),
-            InlineKeyboardButton(text="➕ Добавить позицию", callback_data="new_cheque_add_item")
-        ],
-    ]
-    
-    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+    return _NEW_CHEQUE_ACTIONS_KB
 
 
 def discard_pending_cheque(user_id: int, remove_file: bool = True) -> None:
@@ -456,39 +528,42 @@ def discard_pending_cheque(user_id: int, remove_file: bool = True) -> None:
         return
     if remove_file:
         file_path = pending.get("file_path")
-        if file_path and os.path.exists(file_path):
+        if file_path:
+            # Без предварительного os.path.exists: один системный вызов и нет гонки
             try:
-                os.remove(file_path)
-            except Exception as exc:
+                os.unlink(file_path)
+            except FileNotFoundError:
+                pass
+            except OSError as exc:
                 logger.warning(f"Failed to remove pending cheque file {file_path}: {exc}")
     context_manager.clear_pending_cheque(user_id)
 
 
+def _safe_float(value, default: float = 0.0) -> float:
+    """Число из ответа парсера; пустое или нечисловое значение - default."""
+    if value is None or value == "":
+        return default
+    try:
+        return float(value)
+    except (TypeError, ValueError, OverflowError):
+        return default
+
+
 def prepare_pending_cheque(user_id: int, username: str, local_path: str, items: list) -> tuple[int, list, str, float]:
     chequeid = get_next_cheque_id()
     now_iso = datetime.now(timezone.utc).isoformat()
     processed_items = []
+    total_sum = 0.0
     for item in items:
         processed = dict(item)
         processed["chequeid"] = chequeid
         processed["file_path"] = local_path
         processed.setdefault("created_at", now_iso)
         processed.setdefault("username", username)
-        quantity = processed.get("quantity", 1)
-        try:
-            processed["quantity"] = float(quantity) if quantity not in (None, "") else 1
-        except Exception:
-            processed["quantity"] = 1
-        price = processed.get("price", 0)
-        try:
-            processed["price"] = float(price or 0)
-        except Exception:
-            processed["price"] = 0.0
-        discount = processed.get("discount", 0)
-        try:
-            processed["discount"] = float(discount or 0)
-        except Exception:
-            processed["discount"] = 0.0
+        processed["quantity"] = _safe_float(processed.get("quantity"), 1)
+        price = processed["price"] = _safe_float(processed.get("price"))
+        processed["discount"] = _safe_float(processed.get("discount"))
+        total_sum += price
         processed_items.append(processed)
     
     existing = context_manager.get_pending_cheque(user_id)
@@ -510,10 +585,14 @@ def prepare_pending_cheque(user_id: int, username: str, local_path: str, items:
     )
     
     preview_text = report_builder.format_cheque(processed_items)
-    total_sum = sum(item.get("price", 0.0) for item in processed_items)
     return chequeid, processed_items, preview_text, total_sum
 
 
+# "обновить" покрывается "обнови". Отдельные проверки `in` быстрее regex-альтернации:
+# на обычном сообщении без ключевых слов re.search примерно в 3 раза медленнее
+_REFRESH_KEYWORDS = ("пересчитай", "обнови", "заново", "снова", "пересчитать", "refresh", "recalculate")
+
+
 def _should_refresh_cache(user_message: str) -> bool:
     """
     Проверяет, нужно ли обновить кеш на основе ключевых слов в сообщении.
@@ -527,10 +606,8 @@ def _should_refresh_cache(user_message: str) -> bool:
     if not user_message:
         return False
     
-    refresh_keywords = ["пересчитай", "обнови", "заново", "снова", "пересчитать", "обновить", "refresh", "recalculate"]
     user_lower = user_message.lower()
-    
-    return any(keyword in user_lower for keyword in refresh_keywords)
+    return any(keyword in user_lower for keyword in _REFRESH_KEYWORDS)
 
 
 def refresh_last_query(user_id: int, username: str, context_manager: ContextManager) -> str:
@@ -570,14 +647,7 @@ def refresh_last_query(user_id: int, username: str, context_manager: ContextMana
     # Обработка различных типов запросов
     if query_type.startswith("get_grouped_by_"):
         # Определяем поле для группировки
-        field_map = {
-            "get_grouped_by_category1": "category1",
-            "get_grouped_by_category2": "category2",
-            "get_grouped_by_category3": "category3",
-            "get_grouped_by_organization": "organization",
-            "get_grouped_by_description": "description"
-        }
-        field = field_map.get(query_type, params.get("field", "category1"))
+        field = _GROUPED_TOOLS.get(query_type) or params.get("field", "category1")
         start_date = params.get("start_date")
         end_date = params.get("end_date")
         
@@ -644,6 +714,105 @@ def refresh_last_query(user_id: int, username: str, context_manager: ContextMana
     return message
 
 
+def _labeled_period(period_fn: Callable[[], Tuple[str, str]], title: str) -> Callable[[dict], Tuple[str, str, str]]:
+    def resolve(arguments: dict) -> Tuple[str, str, str]:
+        start_date, end_date = period_fn()
+        return start_date, end_date, f"📅 {title} ({start_date} - {end_date}):\n\n"
+    return resolve
+
+
+def _period_last_n_days(arguments: dict) -> Tuple[str, str, str]:
+    n = arguments.get("n", 7)
+    start_date, end_date = get_last_n_days(n)
+    return start_date, end_date, f"📅 За последние {n} дней ({start_date} - {end_date}):\n\n"
+
+
+def _period_yesterday(arguments: dict) -> Tuple[str, str, str]:
+    start_date, end_date = get_yesterday()
+    return start_date, end_date, f"📅 За вчера ({start_date}):\n\n"
+
+
+def _period_from_arguments(arguments: dict) -> Tuple[str, str, str]:
+    start_date = arguments.get("start_date")
+    end_date = arguments.get("end_date")
+    return start_date, end_date, f"📅 За период ({start_date} - {end_date}):\n\n"
+
+
+def _summary_last_n_days(arguments: dict) -> Tuple[str, str, str]:
+    n = arguments.get("n", 7)
+    start_date, end_date = get_yesterday() if n == 1 else get_last_n_days(n)
+    return start_date, end_date, f"📅 За последние {n} дней ({start_date} - {end_date}):\n\n"
+
+
+def _summary_from_arguments(arguments: dict) -> Tuple[str, str, str]:
+    return arguments.get("start_date"), arguments.get("end_date"), ""
+
+
+# Таблицы инструментов одного вида: поиск по имени вместо цепочки сравнений.
+# Записи за период: имя -> (период и заголовок по аргументам, сохранять ли запрос как fetch_by_period)
+_PERIOD_TOOLS: Dict[str, Tuple[Callable[[dict], Tuple[str, str, str]], bool]] = {
+    "get_last_n_days": (_period_last_n_days, False),
+    "get_current_week": (_labeled_period(get_current_week, "За текущую неделю"), False),
+    "get_current_month": (_labeled_period(get_current_month, "За текущий месяц"), False),
+    "get_yesterday": (_period_yesterday, True),
+    "get_previous_month": (_labeled_period(get_previous_month, "За прошлый месяц"), True),
+    "get_previous_year": (_labeled_period(get_previous_year, "За прошлый год"), True),
+    "fetch_by_period": (_period_from_arguments, True),
+}
+# Сумма за период: имя -> период и заголовок по аргументам
+_SUMMARY_TOOLS: Dict[str, Callable[[dict], Tuple[str, str, str]]] = {
+    "get_summary_last_n_days": _summary_last_n_days,
+    "get_summary_week": _labeled_period(get_current_week, "За текущую неделю"),
+    "get_summary_month": _labeled_period(get_current_month, "За текущий месяц"),
+    "get_summary": _summary_from_arguments,
+}
+# Поиск записей: имя -> (функция БД, заголовок по аргументам)
+_SEARCH_TOOLS: Dict[str, Tuple[Callable[..., list], Callable[[dict], str]]] = {
+    "fetch_by_category": (
+        ai_db.fetch_by_category,
+        lambda arguments: f"📂 Категория {arguments.get('level', '')}: {arguments.get('name', '')}\n\n",
+    ),
+    "fetch_by_organization": (
+        ai_db.fetch_by_organization,
+        lambda arguments: f"🏪 Организация: {arguments.get('organization', '')}\n\n",
+    ),
+    "fetch_by_product_name": (
+        ai_db.fetch_by_product_name,
+        lambda arguments: f"🛒 Товар: {arguments.get('product_name', '')}\n\n",
+    ),
+    "fetch_by_description": (
+        ai_db.fetch_by_description,
+        lambda arguments: f"📝 Комментарий: {arguments.get('description', '')}\n\n",
+    ),
+}
+# Группировка за период: имя -> поле группировки
+_GROUPED_TOOLS: Dict[str, str] = {
+    "get_grouped_by_category1": "category1",
+    "get_grouped_by_category2": "category2",
+    "get_grouped_by_category3": "category3",
+    "get_grouped_by_organization": "organization",
+    "get_grouped_by_description": "description",
+}
+# Показ одного чека: имя -> функция БД
+_CHEQUE_TOOLS: Dict[str, Callable[..., list]] = {
+    "get_cheque_by_id": ai_db.get_cheque_by_id,
+    "get_last_cheque": ai_db.get_last_cheque,
+}
+# Инструменты, которые не пишут в context_manager (last_query, last_cheque): только их
+# можно выполнять параллельно, иначе итоговое состояние зависело бы от порядка потоков
+_CONTEXT_FREE_TOOLS = frozenset(
+    [name for name, (_, remember_query) in _PERIOD_TOOLS.items() if not remember_query] + list(_SEARCH_TOOLS)
+)
+# Сколько позиций показывает список в ответе
+_PURCHASES_LIST_LIMIT = 10
+
+
+def _export_report_excel(user_id: int, username: str, start_date: Optional[str] = None, end_date: Optional[str] = None) -> str:
+    output_path = os.path.join(DB_DIR, f"Report_{user_id}.xlsx")
+    export_to_excel(DB_PATH, output_path, username, start_date, end_date)
+    return output_path
+
+
 def execute_tool_call(tool_name: str, arguments: dict, username: str, user_id: int, user_message: str = "", need_excel: bool = False, need_chart: bool = False, show_as_cheques: Optional[bool] = None) -> tuple[str, list, dict]:
     """
     Выполняет вызов функции БД и форматирует результат.
@@ -705,13 +874,14 @@ def execute_tool_call(tool_name: str, arguments: dict, username: str, user_id: i
             "chart_field": None
         }
 
-        def format_result(result: list, summary: str = "") -> str:
+        def format_result(result: list, summary: str = "", total_count: Optional[int] = None) -> str:
             """
             Форматирует результат в зависимости от use_cheque_format.
 
             Args:
                 result: список записей из БД
                 summary: заголовок/описание (например, "За последние 7 дней:")
+                total_count: число всех записей, если result урезан до _PURCHASES_LIST_LIMIT
 
             Returns:
                 Отформатированная строка
@@ -723,151 +893,36 @@ def execute_tool_call(tool_name: str, arguments: dict, username: str, user_id: i
                 return summary + text if summary else text
             else:
                 # Позиции списком
-                return summary + report_builder.format_purchases_list(result) if summary else report_builder.format_purchases_list(result)
+                text = report_builder.format_purchases_list(result, _PURCHASES_LIST_LIMIT, total_count)
+                return summary + text if summary else text
 
-        def normalize_period_to_current_month(start_date: str, end_date: str) -> tuple[str, str]:
-            """Нормализует период к текущему месяцу, если месяц/год не совпадают."""
-            if not start_date or not end_date:
-                return get_current_month()
-            
-            from datetime import datetime
-            now = datetime.now()
-            current_month = now.month
-            current_year = now.year
-            
-            ds = _parse_ddmmyyyy(start_date)
-            de = _parse_ddmmyyyy(end_date)
-            
-            # Если месяц или год не совпадают с текущими - исправляем на текущий месяц
-            if ds and de:
-                if ds.month != current_month or de.month != current_month or ds.year != current_year or de.year != current_year:
-                    corrected = get_current_month()
-                    return corrected
-            
-            return normalize_to_current_month_if_same_month_wrong_year(start_date, end_date)
-        
-        if tool_name == "get_last_n_days":
-            n = arguments.get("n", 7)
-            start_date, end_date = get_last_n_days(n)
-            result = ai_db.fetch_by_period(start_date, end_date, username)
-            summary = f"📅 За последние {n} дней ({start_date} - {end_date}):\n\n"
-            text = "" if (need_excel or need_chart) else format_result(result, summary)
-            if need_excel:
-                output_path = os.path.join(DB_DIR, f"Report_{user_id}.xlsx")
-                from config import DB_PATH
-                export_to_excel(DB_PATH, output_path, username, start_date, end_date)
-                extra_outputs["excel_path"] = output_path
-            return text, photos_to_send, extra_outputs
-        
-        elif tool_name == "get_current_week":
-            start_date, end_date = get_current_week()
-            result = ai_db.fetch_by_period(start_date, end_date, username)
-            summary = f"📅 За текущую неделю ({start_date} - {end_date}):\n\n"
-            text = "" if (need_excel or need_chart) else format_result(result, summary)
-            if need_excel:
-                output_path = os.path.join(DB_DIR, f"Report_{user_id}.xlsx")
-                from config import DB_PATH
-                export_to_excel(DB_PATH, output_path, username, start_date, end_date)
-                extra_outputs["excel_path"] = output_path
-            return text, photos_to_send, extra_outputs
-        
-        elif tool_name == "get_current_month":
-            start_date, end_date = get_current_month()
-            result = ai_db.fetch_by_period(start_date, end_date, username)
-            summary = f"📅 За текущий месяц ({start_date} - {end_date}):\n\n"
-            text = "" if (need_excel or need_chart) else format_result(result, summary)
-            if need_excel:
-                output_path = os.path.join(DB_DIR, f"Report_{user_id}.xlsx")
-                from config import DB_PATH
-                export_to_excel(DB_PATH, output_path, username, start_date, end_date)
-                extra_outputs["excel_path"] = output_path
-            return text, photos_to_send, extra_outputs
-        
-        elif tool_name == "get_yesterday":
-            start_date, end_date = get_yesterday()
-            result = ai_db.fetch_by_period(start_date, end_date, username)
-            context_manager.set_last_query(
-                user_id,
-                "fetch_by_period",
-                {"start_date": start_date, "end_date": end_date},
-                result,
-                username,
-            )
-            summary = f"📅 За вчера ({start_date}):\n\n"
-            text = "" if (need_excel or need_chart) else format_result(result, summary)
-            if need_excel:
-                output_path = os.path.join(DB_DIR, f"Report_{user_id}.xlsx")
-                from config import DB_PATH
-                export_to_excel(DB_PATH, output_path, username, start_date, end_date)
-                extra_outputs["excel_path"] = output_path
-            return text, photos_to_send, extra_outputs
-        
-        elif tool_name == "get_previous_month":
-            start_date, end_date = get_previous_month()
+        period_tool = _PERIOD_TOOLS.get(tool_name)
+        if period_tool is not None:
+            resolve_period, remember_query = period_tool
+            start_date, end_date, summary = resolve_period(arguments)
+            if not (remember_query or use_cheque_format or need_excel or need_chart):
+                # Результат только показывается списком: первые строки и COUNT(*) вместо всех позиций
+                result = ai_db.fetch_by_period(start_date, end_date, username, limit=_PURCHASES_LIST_LIMIT)
+                total_count = ai_db.count_by_period(start_date, end_date, username)
+                return format_result(result, summary, total_count), photos_to_send, extra_outputs
             result = ai_db.fetch_by_period(start_date, end_date, username)
-            context_manager.set_last_query(
-                user_id,
-                "fetch_by_period",
-                {"start_date": start_date, "end_date": end_date},
-                result,
-                username,
-            )
-            summary = f"📅 За прошлый месяц ({start_date} - {end_date}):\n\n"
-            text = "" if (need_excel or need_chart) else format_result(result, summary)
-            if need_excel:
-                output_path = os.path.join(DB_DIR, f"Report_{user_id}.xlsx")
-                from config import DB_PATH
-                export_to_excel(DB_PATH, output_path, username, start_date, end_date)
-                extra_outputs["excel_path"] = output_path
-            return text, photos_to_send, extra_outputs
-        
-        elif tool_name == "get_previous_year":
-            start_date, end_date = get_previous_year()
-            result = ai_db.fetch_by_period(start_date, end_date, username)
-            context_manager.set_last_query(
-                user_id,
-                "fetch_by_period",
-                {"start_date": start_date, "end_date": end_date},
-                result,
-                username,
-            )
-            summary = f"📅 За прошлый год ({start_date} - {end_date}):\n\n"
-            text = "" if (need_excel or need_chart) else format_result(result, summary)
-            if need_excel:
-                output_path = os.path.join(DB_DIR, f"Report_{user_id}.xlsx")
-                from config import DB_PATH
-                export_to_excel(DB_PATH, output_path, username, start_date, end_date)
-                extra_outputs["excel_path"] = output_path
-            return text, photos_to_send, extra_outputs
-        
-        elif tool_name == "fetch_by_period":
-            start_date = arguments.get("start_date")
-            end_date = arguments.get("end_date")
-            result = ai_db.fetch_by_period(start_date, end_date, username)
-            context_manager.set_last_query(
-                user_id,
-                "fetch_by_period",
-                {"start_date": start_date, "end_date": end_date},
-                result,
-                username,
-            )
-            summary = f"📅 За период ({start_date} - {end_date}):\n\n"
+            if remember_query:
+                context_manager.set_last_query(
+                    user_id,
+                    "fetch_by_period",
+                    {"start_date": start_date, "end_date": end_date},
+                    result,
+                    username,
+                )
             text = "" if (need_excel or need_chart) else format_result(result, summary)
             if need_excel:
-                output_path = os.path.join(DB_DIR, f"Report_{user_id}.xlsx")
-                from config import DB_PATH
-                export_to_excel(DB_PATH, output_path, username, start_date, end_date)
-                extra_outputs["excel_path"] = output_path
+                extra_outputs["excel_path"] = _export_report_excel(user_id, username, start_date, end_date)
             return text, photos_to_send, extra_outputs
         
-        elif tool_name == "get_summary_last_n_days":
-            n = arguments.get("n", 7)
-            if n == 1:
-                start_date, end_date = get_yesterday()
-            else:
-                start_date, end_date = get_last_n_days(n)
+        summary_tool = _SUMMARY_TOOLS.get(tool_name)
+        if summary_tool is not None:
+            start_date, end_date, summary = summary_tool(arguments)
             result = ai_db.get_summary(start_date, end_date, username)
-            summary = f"📅 За последние {n} дней ({start_date} - {end_date}):\n\n"
             context_manager.set_last_query(
                 user_id,
                 "summary_period",
@@ -878,50 +933,55 @@ def execute_tool_call(tool_name: str, arguments: dict, username: str, user_id: i
             text = "" if (need_excel or need_chart) else summary + report_builder.format_summary(result)
             return text, photos_to_send, extra_outputs
         
-        elif tool_name == "get_summary_week":
-            start_date, end_date = get_current_week()
-            result = ai_db.get_summary(start_date, end_date, username)
-            summary = f"📅 За текущую неделю ({start_date} - {end_date}):\n\n"
-            context_manager.set_last_query(
-                user_id,
-                "summary_period",
-                {"start_date": start_date, "end_date": end_date},
-                result,
-                username,
-            )
-            text = "" if (need_excel or need_chart) else summary + report_builder.format_summary(result)
-            return text, photos_to_send, extra_outputs
-        
-        elif tool_name == "get_summary_month":
-            start_date, end_date = get_current_month()
-            result = ai_db.get_summary(start_date, end_date, username)
-            summary = f"📅 За текущий месяц ({start_date} - {end_date}):\n\n"
-            context_manager.set_last_query(
-                user_id,
-                "summary_period",
-                {"start_date": start_date, "end_date": end_date},
-                result,
-                username,
-            )
-            text = "" if (need_excel or need_chart) else summary + report_builder.format_summary(result)
+        search_tool = _SEARCH_TOOLS.get(tool_name)
+        if search_tool is not None:
+            fetch, describe = search_tool
+            result = fetch(**arguments)
+            text = "" if (need_excel or need_chart) else format_result(result, describe(arguments))
+            if need_excel:
+                extra_outputs["excel_path"] = _export_report_excel(user_id, username)
             return text, photos_to_send, extra_outputs
         
-        elif tool_name == "get_summary":
+        grouped_field = _GROUPED_TOOLS.get(tool_name)
+        if grouped_field is not None:
             start_date = arguments.get("start_date")
             end_date = arguments.get("end_date")
-            result = ai_db.get_summary(start_date, end_date, username)
-            context_manager.set_last_query(
-                user_id,
-                "summary_period",
-                {"start_date": start_date, "end_date": end_date},
-                result,
-                username,
-            )
-            text = "" if (need_excel or need_chart) else report_builder.format_summary(result)
+            if start_date and end_date:
+                start_date, end_date = normalize_to_current_month_if_same_month_wrong_year(start_date, end_date)
+            else:
+                start_date, end_date = resolve_period_for_message(user_id, user_message)
+            result = []
+            should_refresh = _should_refresh_cache(user_message)
+            last_query = context_manager.get_last_query(user_id)
+            if (
+                not should_refresh
+                and last_query
+                and last_query.get("type") == tool_name
+                and last_query.get("params", {}).get("start_date") == start_date
+                and last_query.get("params", {}).get("end_date") == end_date
+            ):
+                result = last_query.get("result", [])
+            if not result:
+                result = ai_db.get_grouped_stats(grouped_field, start_date, end_date, username)
+            
+            context_manager.set_last_query(user_id, tool_name, 
+                                          {"start_date": start_date, "end_date": end_date, "field": grouped_field}, 
+                                          result, username)
+            
+            # Если запрошен график/Excel, не выводим текстовый ответ
+            text = "" if (need_chart or need_excel) else report_builder.format_grouped_stats(result, grouped_field)
+            if need_excel:
+                output_path = os.path.join(DB_DIR, f"Grouped_{user_id}.xlsx")
+                export_grouped_to_excel(result, output_path, grouped_field)
+                extra_outputs["excel_path"] = output_path
+            if need_chart and result:
+                extra_outputs["chart_data"] = result
+                extra_outputs["chart_field"] = grouped_field
             return text, photos_to_send, extra_outputs
         
-        elif tool_name == "get_cheque_by_id":
-            result = ai_db.get_cheque_by_id(**arguments)
+        cheque_tool = _CHEQUE_TOOLS.get(tool_name)
+        if cheque_tool is not None:
+            result = cheque_tool(**arguments)
             if result:
                 chequeid = result[0].get("chequeid")
                 if chequeid:
@@ -931,18 +991,7 @@ def execute_tool_call(tool_name: str, arguments: dict, username: str, user_id: i
             text = report_builder.format_cheque(result)
             return text, photos_to_send, extra_outputs
         
-        elif tool_name == "get_last_cheque":
-            result = ai_db.get_last_cheque(**arguments)
-            if result:
-                chequeid = result[0].get("chequeid")
-                if chequeid:
-                    context_manager.set_last_cheque(user_id, chequeid)
-                if result[0].get("file_path"):
-                    photos_to_send.append(result[0]["file_path"])
-            text = report_builder.format_cheque(result)
-            return text, photos_to_send, extra_outputs
-
-        elif tool_name == "delete_cheque":
+        if tool_name == "delete_cheque":
             chequeid = arguments.get("chequeid")
             if not chequeid:
                 chequeid = context_manager.get_last_cheque(user_id)
@@ -951,10 +1000,10 @@ def execute_tool_call(tool_name: str, arguments: dict, username: str, user_id: i
             if not chequeid:
                 return "", photos_to_send, extra_outputs
             rows, file_path = ai_db.delete_cheque(chequeid, username)
-            if rows > 0 and file_path and os.path.exists(file_path):
+            if rows > 0 and file_path:
                 try:
-                    os.remove(file_path)
-                except Exception as _:
+                    os.unlink(file_path)
+                except OSError:
                     pass
             if rows > 0:
                 return f"✅ Удалено записей: {rows}", photos_to_send, extra_outputs
@@ -999,55 +1048,6 @@ def execute_tool_call(tool_name: str, arguments: dict, username: str, user_id: i
                 logger.error(f"Error adding item to cheque: {e}")
                 return f"❌ Ошибка добавления позиции: {str(e)}", photos_to_send, extra_outputs
         
-        elif tool_name == "fetch_by_category":
-            result = ai_db.fetch_by_category(**arguments)
-            level = arguments.get("level", "")
-            name = arguments.get("name", "")
-            summary = f"📂 Категория {level}: {name}\n\n"
-            text = "" if (need_excel or need_chart) else format_result(result, summary)
-            if need_excel:
-                output_path = os.path.join(DB_DIR, f"Report_{user_id}.xlsx")
-                from config import DB_PATH
-                export_to_excel(DB_PATH, output_path, username)
-                extra_outputs["excel_path"] = output_path
-            return text, photos_to_send, extra_outputs
-        
-        elif tool_name == "fetch_by_organization":
-            result = ai_db.fetch_by_organization(**arguments)
-            organization = arguments.get("organization", "")
-            summary = f"🏪 Организация: {organization}\n\n"
-            text = "" if (need_excel or need_chart) else format_result(result, summary)
-            if need_excel:
-                output_path = os.path.join(DB_DIR, f"Report_{user_id}.xlsx")
-                from config import DB_PATH
-                export_to_excel(DB_PATH, output_path, username)
-                extra_outputs["excel_path"] = output_path
-            return text, photos_to_send, extra_outputs
-        
-        elif tool_name == "fetch_by_product_name":
-            result = ai_db.fetch_by_product_name(**arguments)
-            product_name = arguments.get("product_name", "")
-            summary = f"🛒 Товар: {product_name}\n\n"
-            text = "" if (need_excel or need_chart) else format_result(result, summary)
-            if need_excel:
-                output_path = os.path.join(DB_DIR, f"Report_{user_id}.xlsx")
-                from config import DB_PATH
-                export_to_excel(DB_PATH, output_path, username)
-                extra_outputs["excel_path"] = output_path
-            return text, photos_to_send, extra_outputs
-        
-        elif tool_name == "fetch_by_description":
-            result = ai_db.fetch_by_description(**arguments)
-            description = arguments.get("description", "")
-            summary = f"📝 Комментарий: {description}\n\n"
-            text = "" if (need_excel or need_chart) else format_result(result, summary)
-            if need_excel:
-                output_path = os.path.join(DB_DIR, f"Report_{user_id}.xlsx")
-                from config import DB_PATH
-                export_to_excel(DB_PATH, output_path, username)
-                extra_outputs["excel_path"] = output_path
-            return text, photos_to_send, extra_outputs
-        
         elif tool_name == "update_description_by_cheque":
             chequeid = arguments.get("chequeid")
             if not chequeid:
@@ -1125,182 +1125,6 @@ def execute_tool_call(tool_name: str, arguments: dict, username: str, user_id: i
                 return report_builder.format_update_result(True, rows), photos_to_send, extra_outputs
             return "", photos_to_send, extra_outputs
         
-        elif tool_name == "get_grouped_by_category1":
-            start_date = arguments.get("start_date")
-            end_date = arguments.get("end_date")
-            if start_date and end_date:
-                start_date, end_date = normalize_to_current_month_if_same_month_wrong_year(start_date, end_date)
-            else:
-                start_date, end_date = resolve_period_for_message(user_id, user_message)
-            result = []
-            should_refresh = _should_refresh_cache(user_message)
-            last_query = context_manager.get_last_query(user_id)
-            if (
-                not should_refresh
-                and last_query
-                and last_query.get("type") == "get_grouped_by_category1"
-                and last_query.get("params", {}).get("start_date") == start_date
-                and last_query.get("params", {}).get("end_date") == end_date
-            ):
-                result = last_query.get("result", [])
-            if not result:
-                result = ai_db.get_grouped_stats("category1", start_date, end_date, username)
-            
-            context_manager.set_last_query(user_id, "get_grouped_by_category1", 
-                                          {"start_date": start_date, "end_date": end_date, "field": "category1"}, 
-                                          result, username)
-            
-            # Если запрошен график/Excel, не выводим текстовый ответ
-            text = "" if (need_chart or need_excel) else report_builder.format_grouped_stats(result, "category1")
-            if need_excel:
-                output_path = os.path.join(DB_DIR, f"Grouped_{user_id}.xlsx")
-                export_grouped_to_excel(result, output_path, "category1")
-                extra_outputs["excel_path"] = output_path
-            if need_chart and result:
-                extra_outputs["chart_data"] = result
-                extra_outputs["chart_field"] = "category1"
-            return text, photos_to_send, extra_outputs
-        
-        elif tool_name == "get_grouped_by_category2":
-            start_date = arguments.get("start_date")
-            end_date = arguments.get("end_date")
-            if start_date and end_date:
-                start_date, end_date = normalize_to_current_month_if_same_month_wrong_year(start_date, end_date)
-            else:
-                start_date, end_date = resolve_period_for_message(user_id, user_message)
-            result = []
-            should_refresh = _should_refresh_cache(user_message)
-            last_query = context_manager.get_last_query(user_id)
-            if (
-                not should_refresh
-                and last_query
-                and last_query.get("type") == "get_grouped_by_category2"
-                and last_query.get("params", {}).get("start_date") == start_date
-                and last_query.get("params", {}).get("end_date") == end_date
-            ):
-                result = last_query.get("result", [])
-            if not result:
-                result = ai_db.get_grouped_stats("category2", start_date, end_date, username)
-            
-            context_manager.set_last_query(user_id, "get_grouped_by_category2", 
-                                          {"start_date": start_date, "end_date": end_date, "field": "category2"}, 
-                                          result, username)
-            
-            text = "" if (need_chart or need_excel) else report_builder.format_grouped_stats(result, "category2")
-            if need_excel:
-                output_path = os.path.join(DB_DIR, f"Grouped_{user_id}.xlsx")
-                export_grouped_to_excel(result, output_path, "category2")
-                extra_outputs["excel_path"] = output_path
-            if need_chart and result:
-                extra_outputs["chart_data"] = result
-                extra_outputs["chart_field"] = "category2"
-            return text, photos_to_send, extra_outputs
-        
-        elif tool_name == "get_grouped_by_category3":
-            start_date = arguments.get("start_date")
-            end_date = arguments.get("end_date")
-            if start_date and end_date:
-                start_date, end_date = normalize_to_current_month_if_same_month_wrong_year(start_date, end_date)
-            else:
-                start_date, end_date = resolve_period_for_message(user_id, user_message)
-            result = []
-            should_refresh = _should_refresh_cache(user_message)
-            last_query = context_manager.get_last_query(user_id)
-            if (
-                not should_refresh
-                and last_query
-                and last_query.get("type") == "get_grouped_by_category3"
-                and last_query.get("params", {}).get("start_date") == start_date
-                and last_query.get("params", {}).get("end_date") == end_date
-            ):
-                result = last_query.get("result", [])
-            if not result:
-                result = ai_db.get_grouped_stats("category3", start_date, end_date, username)
-            
-            context_manager.set_last_query(user_id, "get_grouped_by_category3", 
-                                          {"start_date": start_date, "end_date": end_date, "field": "category3"}, 
-                                          result, username)
-            
-            text = "" if (need_chart or need_excel) else report_builder.format_grouped_stats(result, "category3")
-            if need_excel:
-                output_path = os.path.join(DB_DIR, f"Grouped_{user_id}.xlsx")
-                export_grouped_to_excel(result, output_path, "category3")
-                extra_outputs["excel_path"] = output_path
-            if need_chart and result:
-                extra_outputs["chart_data"] = result
-                extra_outputs["chart_field"] = "category3"
-            return text, photos_to_send, extra_outputs
-        
-        elif tool_name == "get_grouped_by_organization":
-            start_date = arguments.get("start_date")
-            end_date = arguments.get("end_date")
-            if start_date and end_date:
-                start_date, end_date = normalize_to_current_month_if_same_month_wrong_year(start_date, end_date)
-            else:
-                start_date, end_date = resolve_period_for_message(user_id, user_message)
-            result = []
-            should_refresh = _should_refresh_cache(user_message)
-            last_query = context_manager.get_last_query(user_id)
-            if (
-                not should_refresh
-                and last_query
-                and last_query.get("type") == "get_grouped_by_organization"
-                and last_query.get("params", {}).get("start_date") == start_date
-                and last_query.get("params", {}).get("end_date") == end_date
-            ):
-                result = last_query.get("result", [])
-            if not result:
-                result = ai_db.get_grouped_stats("organization", start_date, end_date, username)
-            
-            context_manager.set_last_query(user_id, "get_grouped_by_organization", 
-                                          {"start_date": start_date, "end_date": end_date, "field": "organization"}, 
-                                          result, username)
-            
-            text = "" if (need_chart or need_excel) else report_builder.format_grouped_stats(result, "organization")
-            if need_excel:
-                output_path = os.path.join(DB_DIR, f"Grouped_{user_id}.xlsx")
-                export_grouped_to_excel(result, output_path, "organization")
-                extra_outputs["excel_path"] = output_path
-            if need_chart and result:
-                extra_outputs["chart_data"] = result
-                extra_outputs["chart_field"] = "organization"
-            return text, photos_to_send, extra_outputs
-        
-        elif tool_name == "get_grouped_by_description":
-            start_date = arguments.get("start_date")
-            end_date = arguments.get("end_date")
-            if start_date and end_date:
-                start_date, end_date = normalize_to_current_month_if_same_month_wrong_year(start_date, end_date)
-            else:
-                start_date, end_date = resolve_period_for_message(user_id, user_message)
-            result = []
-            should_refresh = _should_refresh_cache(user_message)
-            last_query = context_manager.get_last_query(user_id)
-            if (
-                not should_refresh
-                and last_query
-                and last_query.get("type") == "get_grouped_by_description"
-                and last_query.get("params", {}).get("start_date") == start_date
-                and last_query.get("params", {}).get("end_date") == end_date
-            ):
-                result = last_query.get("result", [])
-            if not result:
-                result = ai_db.get_grouped_stats("description", start_date, end_date, username)
-            
-            context_manager.set_last_query(user_id, "get_grouped_by_description", 
-                                          {"start_date": start_date, "end_date": end_date, "field": "description"}, 
-                                          result, username)
-            
-            text = "" if (need_chart or need_excel) else report_builder.format_grouped_stats(result, "description")
-            if need_excel:
-                output_path = os.path.join(DB_DIR, f"Grouped_{user_id}.xlsx")
-                export_grouped_to_excel(result, output_path, "description")
-                extra_outputs["excel_path"] = output_path
-            if need_chart and result:
-                extra_outputs["chart_data"] = result
-                extra_outputs["chart_field"] = "description"
-            return text, photos_to_send, extra_outputs
-
         elif tool_name == "get_grouped_stats_filtered":
             field = arguments.get("field")
             start_date = arguments.get("start_date")
@@ -1340,9 +1164,6 @@ def execute_tool_call(tool_name: str, arguments: dict, username: str, user_id: i
         
         elif tool_name == "export_all_to_excel":
             output_path = os.path.join(DB_DIR, "Report.xlsx")
-            db_path = os.path.join(os.path.dirname(os.path.dirname(PROJECT_ROOT)), ".dbData", "receipts.db") if False else None
-            # use configured DB path inside aiAssistant db layer
-            from config import DB_PATH
             export_to_excel(DB_PATH, output_path, username)
             extra_outputs["excel_path"] = output_path
             return f"✅ Выгрузка завершена: {output_path}", photos_to_send, extra_outputs
@@ -1351,7 +1172,6 @@ def execute_tool_call(tool_name: str, arguments: dict, username: str, user_id: i
             start_date = arguments.get("start_date")
             end_date = arguments.get("end_date")
             output_path = os.path.join(DB_DIR, "Report.xlsx")
-            from config import DB_PATH
             if start_date and end_date:
                 start_date, end_date = normalize_to_current_month_if_same_month_wrong_year(start_date, end_date)
             export_to_excel(DB_PATH, output_path, username, start_date, end_date)
@@ -1372,14 +1192,7 @@ def execute_tool_call(tool_name: str, arguments: dict, username: str, user_id: i
                 return "❌ Последний запрос не был запросом группировки.", photos_to_send, extra_outputs
             
             # Определяем поле группировки
-            field_map = {
-                "get_grouped_by_category1": "category1",
-                "get_grouped_by_category2": "category2",
-                "get_grouped_by_category3": "category3",
-                "get_grouped_by_organization": "organization",
-                "get_grouped_by_description": "description"
-            }
-            field = field_map.get(query_type)
+            field = _GROUPED_TOOLS.get(query_type)
             if not field:
                 field = last_query.get("params", {}).get("field")
             
@@ -1393,7 +1206,6 @@ def execute_tool_call(tool_name: str, arguments: dict, username: str, user_id: i
                 return "❌ Не удалось определить период из предыдущего запроса.", photos_to_send, extra_outputs
             
             # Получаем детальные записи за период из кеша
-            from config import DB_PATH
             result = ai_db.fetch_by_period(start_date, end_date, query_username, DB_PATH)
             
             # Фильтруем по значению группы (точное совпадение)
@@ -1448,8 +1260,6 @@ async def cmd_clear(message: Message):
 @dp.message(Command("api_stats"))
 async def cmd_api_stats(message: Message):
     """Показать статистику использования OpenAI API."""
-    from datetime import datetime, timedelta
-
     api_logger = get_api_logger()
 
     # Статистика за всё время
@@ -2359,6 +2169,7 @@ async def callback_show_cheque(call: CallbackQuery):
 
 @dp.message(F.text)
 async def handle_text(message: Message):
+    reset_today_cache()
     user_id = message.from_user.id
     username_raw = message.from_user.username
     username = username_raw if username_raw else f"user_{user_id}"
@@ -2951,17 +2762,19 @@ async def handle_text(message: Message):
         messages.append({"role": "system", "content": "Для запроса пользователя используй функцию get_previous_year()."})
     
     tools = ai_client.get_tools_definition()
+    # Текстовый ответ модели показывается по мере генерации
+    streamer = TelegramStreamer(message)
     
     try:
         response = await asyncio.wait_for(
-            asyncio.to_thread(ai_client.get_response, messages, tools),
+            ai_client.astream_response(messages, tools, on_delta=streamer.update, user=str(user_id)),
             timeout=60.0
         )
     except asyncio.TimeoutError:
         logger.error("AI response timeout (60s)")
         error_message = "⏰ Запрос обрабатывается слишком долго. Возможно, сервер перегружен или запрос слишком сложный. Попробуйте:\n• Упростить запрос\n• Разбить на несколько частей\n• Повторить через несколько секунд"
         context_manager.add_message(user_id, "assistant", error_message)
-        await message.answer(error_message, parse_mode=None)
+        await streamer.send(error_message)
         return
     except Exception as e:
         logger.error(f"Error calling AI client: {e}")
@@ -2969,14 +2782,14 @@ async def handle_text(message: Message):
         logger.error(traceback.format_exc())
         error_message = "Произошла ошибка при обработке запроса. Попробуйте позже."
         context_manager.add_message(user_id, "assistant", error_message)
-        await message.answer(error_message, parse_mode=None)
+        await streamer.send(error_message)
         return
     
     if not response:
         logger.error("AI client returned None response")
         error_message = "Не удалось получить ответ от AI. Попробуйте позже."
         context_manager.add_message(user_id, "assistant", error_message)
-        await message.answer(error_message, parse_mode=None)
+        await streamer.send(error_message)
         return
     
     content_preview = (response.get('content') or 'None')[:100]
@@ -2985,7 +2798,7 @@ async def handle_text(message: Message):
     if response.get("error"):
         error_message = response.get("content", "Не удалось обработать запрос. Попробуйте переформулировать или повторить позже")
         context_manager.add_message(user_id, "assistant", error_message)
-        await message.answer(error_message, parse_mode=None)
+        await streamer.send(error_message)
         return
     
     all_photos = []
@@ -2994,11 +2807,18 @@ async def handle_text(message: Message):
     inline_keyboard = None
     if response.get("tool_calls"):
         tool_results = []
-        for tool_call in response["tool_calls"]:
-            function_name = tool_call.function.name
-            function_args = json.loads(tool_call.function.arguments)
-            
-            result, photos, extra_outputs = execute_tool_call(function_name, function_args, username, user_id, user_message, need_excel, need_chart, show_as_cheques_flag)
+        parsed_calls = [
+            (tool_call.function.name, json.loads(tool_call.function.arguments))
+            for tool_call in response["tool_calls"]
+        ]
+        # Параллельно - только запросы, не меняющие контекст пользователя; Excel пишется в один файл,
+        # поэтому тогда тоже по очереди. Иначе last_query/last_cheque - от последнего вызова по порядку
+        tool_outputs = await ai_client.adispatch_tool_calls(
+            parsed_calls,
+            lambda function_name, function_args: execute_tool_call(function_name, function_args, username, user_id, user_message, need_excel, need_chart, show_as_cheques_flag),
+            parallel=not need_excel and all(name in _CONTEXT_FREE_TOOLS for name, _ in parsed_calls),
+        )
+        for result, photos, extra_outputs in tool_outputs:
             if result:
                 tool_results.append(result)
             all_photos.extend(photos)
@@ -3070,11 +2890,14 @@ async def handle_text(message: Message):
     if final_response:
         try:
             context_manager.add_message(user_id, "assistant", final_response)
-            await message.answer(final_response, parse_mode=None, reply_markup=inline_keyboard)
+            await streamer.send(final_response, reply_markup=inline_keyboard)
         except Exception as send_err:
             logger.error(f"Failed to send text response: {send_err}")
             import traceback
             logger.error(traceback.format_exc())
+    else:
+        # Показанный по ходу генерации текст не нужен, если отправляются только вложения
+        await streamer.discard()
     
     # Отправляем графики для сгруппированных данных
     for chart_data, chart_field in all_chart_data:
@@ -3119,12 +2942,16 @@ async def handle_text(message: Message):
 async def main():
     ensure_dirs()
     init_db()
+    warmup = asyncio.create_task(ai_client.awarmup())
     try:
         await dp.start_polling(bot)
     except asyncio.CancelledError:
         logger.info("Polling cancelled")
     finally:
+        warmup.cancel()
         await bot.session.close()
+        ai_db.close_pools()
+        close_persistent_caches()
 
 
 if __name__ == "__main__":
@@ -41,3 +41,18 @@ DB_DIR = os.path.join(PROJECT_ROOT, ".dbData")
 DB_PATH = os.path.join(DB_DIR, "receipts.db")
 CATEGORY_RULES_PATH = os.path.join(PROJECT_ROOT, "parser", "category_rules.json")
 
+# OpenAI account limits for the client-side rate limiter (requests and tokens per minute)
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "500"))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "200000"))
+# Open the OpenAI connection (TLS handshake) at startup instead of on the first user request
+OPENAI_WARMUP = os.getenv("OPENAI_WARMUP", "1").strip() == "1"
+# Input token budget per request: older dialogue turns beyond it are not sent
+OPENAI_MAX_INPUT_TOKENS = int(os.getenv("OPENAI_MAX_INPUT_TOKENS", "6000"))
+
+# Persistent (SQLite) cache of AI responses; LLM_CACHE_PERSIST=0 keeps it in memory only
+LLM_CACHE_PATH = os.path.join(DB_DIR, "llm_cache.sqlite3") if os.getenv("LLM_CACHE_PERSIST", "1").strip() == "1" else None
+
+# Semantic cache of AI responses (embeddings); off by default, enable with SEMANTIC_CACHE=1
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE", "0").strip() == "1"
+SEMANTIC_CACHE_PATH = os.path.join(DB_DIR, "sem_cache.npz")
+
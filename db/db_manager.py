@@ -23,15 +23,43 @@ SCHEMA_SQL = (
         category3 TEXT,
         organization TEXT,
         username TEXT,
-        description TEXT
+        description TEXT,
+        date_ymd TEXT
     );
     """
 )
 
+# date в YYYY-MM-DD для старых строк без date_ymd; новые заполняются через norm_ymd
+_DATE_YMD_SQL = (
+    "CASE "
+    "WHEN date LIKE '__.__.____%' THEN substr(date,7,4)||'-'||substr(date,4,2)||'-'||substr(date,1,2) "
+    "WHEN date LIKE '__-__-____%' THEN substr(date,7,4)||'-'||substr(date,4,2)||'-'||substr(date,1,2) "
+    "WHEN date LIKE '____-__-__%' THEN substr(date,1,10) "
+    "ELSE date END"
+)
+
+
+def norm_ymd(date_str: str) -> str:
+    """Convert DD.MM.YYYY or DD-MM-YYYY to YYYY-MM-DD for correct string compare."""
+    if not date_str:
+        return date_str
+    s = str(date_str)
+    # Те же шаблоны, что и в _DATE_YMD_SQL: разделители на позициях 2 и 5, иначе ISO как есть
+    if len(s) >= 10 and s[2] in ".-" and s[5] == s[2]:
+        return f"{s[6:10]}-{s[3:5]}-{s[0:2]}"
+    return s[:10]
+
 
-def get_connection(db_path: Optional[str] = None) -> sqlite3.Connection:
+def _casefold(value: Optional[str]) -> Optional[str]:
+    return value.casefold() if isinstance(value, str) else value
+
+
+def get_connection(db_path: Optional[str] = None, check_same_thread: bool = True, cached_statements: int = 128) -> sqlite3.Connection:
     path = db_path or DB_PATH
-    return sqlite3.connect(path)
+    conn = sqlite3.connect(path, check_same_thread=check_same_thread, cached_statements=cached_statements)
+    # LIKE и lower() в SQLite меняют регистр только у ASCII; для кириллицы - py_casefold
+    conn.create_function("py_casefold", 1, _casefold, deterministic=True)
+    return conn
 
 
 def init_db(db_path: Optional[str] = None) -> None:
@@ -113,6 +141,15 @@ def migrate_db(db_path: Optional[str] = None) -> None:
                         cursor.execute("ALTER TABLE purchases_tmp RENAME TO purchases")
                     except Exception:
                         cursor.execute("DROP TABLE IF EXISTS purchases_tmp")
+
+            # Дата для сравнения диапазонов по индексу: колонка date_ymd вместо CASE в каждом запросе
+            columns = [row[1] for row in cursor.execute("PRAGMA table_info(purchases)").fetchall()]
+            if "date_ymd" not in columns:
+                try:
+                    cursor.execute("ALTER TABLE purchases ADD COLUMN date_ymd TEXT")
+                except Exception:
+                    pass
+            cursor.execute(f"UPDATE purchases SET date_ymd = {_DATE_YMD_SQL} WHERE date_ymd IS NULL AND date IS NOT NULL")
             conn.commit()
         except Exception:
             # Ignore migration errors to avoid startup crash; inserts will still surface issues
@@ -121,6 +158,15 @@ def migrate_db(db_path: Optional[str] = None) -> None:
         create_indexes(conn)
 
 
+_USER_LOOKUP_INDEXES = (
+    ("idx_purchases_user_cheque", "chequeid"),
+    ("idx_purchases_user_cat1", "category1"),
+    ("idx_purchases_user_cat2", "category2"),
+    ("idx_purchases_user_cat3", "category3"),
+    ("idx_purchases_user_org", "organization"),
+)
+
+
 def create_indexes(conn: sqlite3.Connection) -> None:
     cursor = conn.cursor()
     try:
@@ -132,9 +178,74 @@ def create_indexes(conn: sqlite3.Connection) -> None:
         if "idx_username" not in existing_indexes:
             cursor.execute("CREATE INDEX idx_username ON purchases(username)")
         
+        # Порядок индекса совпадает с ORDER BY выгрузки в Excel: без сортировки во временном B-tree
+        if "idx_purchases_user_date_id" not in existing_indexes:
+            cursor.execute("CREATE INDEX idx_purchases_user_date_id ON purchases(username, date DESC, id ASC)")
+        
+        # Фильтр периода: username = ? AND date_ymd BETWEEN ? AND ?. chequeid и price в индексе
+        # покрывают сводку за период (COUNT/SUM/COUNT(DISTINCT chequeid)) без чтения таблицы
+        created = False
+        if "idx_purchases_user_date_cheque" not in existing_indexes:
+            cursor.execute("CREATE INDEX idx_purchases_user_date_cheque ON purchases(username, date_ymd, chequeid, price)")
+            created = True
+        # Прежний индекс (username, date_ymd) - префикс нового, лишний на вставках
+        if "idx_purchases_date_ymd" in existing_indexes:
+            cursor.execute("DROP INDEX idx_purchases_date_ymd")
+        
+        # Поиск и изменение по username = ? AND <колонка> = ?: чек, категории, организация
+        for name, columns in _USER_LOOKUP_INDEXES:
+            if name not in existing_indexes:
+                cursor.execute(f"CREATE INDEX {name} ON purchases(username, {columns})")
+                created = True
+        
+        # Статистика для планировщика: без нее при равных условиях он может выбрать idx_username
+        if created:
+            cursor.execute("ANALYZE purchases")
+        
         conn.commit()
     except Exception as e:
         pass
+    create_fts(conn)
+
+
+# Полнотекстовый индекс по названию товара и комментарию. trigram ищет подстроки
+# (как LIKE '%...%') без учета регистра, в том числе кириллицы; запрос от 3 символов
+_FTS_TRIGGERS_SQL = (
+    """
+    CREATE TRIGGER IF NOT EXISTS purchases_fts_ai AFTER INSERT ON purchases BEGIN
+        INSERT INTO purchases_fts(rowid, product_name, description) VALUES (new.id, new.product_name, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS purchases_fts_ad AFTER DELETE ON purchases BEGIN
+        INSERT INTO purchases_fts(purchases_fts, rowid, product_name, description) VALUES ('delete', old.id, old.product_name, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS purchases_fts_au AFTER UPDATE OF product_name, description ON purchases BEGIN
+        INSERT INTO purchases_fts(purchases_fts, rowid, product_name, description) VALUES ('delete', old.id, old.product_name, old.description);
+        INSERT INTO purchases_fts(rowid, product_name, description) VALUES (new.id, new.product_name, new.description);
+    END
+    """,
+)
+
+
+def create_fts(conn: sqlite3.Connection) -> None:
+    cursor = conn.cursor()
+    try:
+        exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='purchases_fts'").fetchone()
+        if not exists:
+            cursor.execute(
+                "CREATE VIRTUAL TABLE purchases_fts USING fts5("
+                "product_name, description, content='purchases', content_rowid='id', tokenize='trigram')"
+            )
+            cursor.execute("INSERT INTO purchases_fts(purchases_fts) VALUES ('rebuild')")
+        for sql in _FTS_TRIGGERS_SQL:
+            cursor.execute(sql)
+        conn.commit()
+    except sqlite3.OperationalError:
+        # SQLite без FTS5/trigram: поиск остается на LIKE
+        conn.rollback()
 
 
 def get_next_cheque_id(db_path: Optional[str] = None) -> int:
@@ -151,8 +262,8 @@ def insert_purchase(record: Dict, db_path: Optional[str] = None) -> int:
         cursor.execute(
             (
                 "INSERT INTO purchases (chequeid, file_path, date, created_at, product_name, quantity, price, "
-                "discount, category1, category2, category3, organization, username, description) "
-                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                "discount, category1, category2, category3, organization, username, description, date_ymd) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
             ),
             (
                 record.get("chequeid"),
@@ -169,6 +280,7 @@ def insert_purchase(record: Dict, db_path: Optional[str] = None) -> int:
                 record.get("organization"),
                 record.get("username"),
                 record.get("description"),
+                norm_ymd(record.get("date")),
             ),
         )
         conn.commit()
@@ -181,8 +293,8 @@ def bulk_insert_purchases(records: List[Dict], db_path: Optional[str] = None) ->
         cursor.executemany(
             (
                 "INSERT INTO purchases (chequeid, file_path, date, created_at, product_name, quantity, price, "
-                "discount, category1, category2, category3, organization, username, description) "
-                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                "discount, category1, category2, category3, organization, username, description, date_ymd) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
             ),
             [
                 (
@@ -200,6 +312,7 @@ def bulk_insert_purchases(records: List[Dict], db_path: Optional[str] = None) ->
                     rec.get("organization"),
                     rec.get("username"),
                     rec.get("description"),
+                    norm_ymd(rec.get("date")),
                 )
                 for rec in records
             ],
@@ -15,6 +15,11 @@ from .category_rules import categorize_product, normalize_categories
 
 key = OPENAI_API_KEY
 
+_CLASSIFY_PROMPT = (
+    "Классифицируй товар по трём уровням категорий. Верни ТОЛЬКО JSON-объект "
+    "с полями category1, category2, category3. Без пояснений."
+)
+
 
 def _read_file_as_base64(path: str) -> str:
     with open(path, "rb") as f:
@@ -27,6 +32,42 @@ def _load_parsing_prompt() -> str:
         return f.read().strip()
 
 
+def _strip_code_fence(text: str) -> str:
+    text = text.strip()
+    if text.startswith("```"):
+        m = re.search(r"```(?:json)?\s*([\s\S]*?)```", text, flags=re.IGNORECASE)
+        if m:
+            text = m.group(1).strip()
+    if text.lower().startswith("json\n"):
+        text = text.split("\n", 1)[1]
+    return text
+
+
+def _categories_from_text(text: Optional[str]) -> Optional[Dict[str, str]]:
+    """Разбирает ответ классификатора; None, если категорий в нем нет."""
+    if not text:
+        return None
+    try:
+        obj = json.loads(_strip_code_fence(text))
+    except ValueError:
+        return None
+    if not isinstance(obj, dict):
+        return None
+    cat1 = (obj.get("category1") or "").strip()
+    cat2 = (obj.get("category2") or "").strip()
+    cat3 = (obj.get("category3") or "").strip()
+    if cat1 or cat2 or cat3:
+        return {"category1": cat1, "category2": cat2, "category3": cat3}
+    return None
+
+
+def _classify_messages(name: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": _CLASSIFY_PROMPT},
+        {"role": "user", "content": f"Наименование: {name}"},
+    ]
+
+
 def parse_cheque_with_gpt(
     image_path: str,
     hint_text: Optional[str] = None,
@@ -142,16 +183,7 @@ def parse_cheque_with_gpt(
 
     content = response.choices[0].message.content
     # Try to extract JSON if model wrapped it in code fences
-    text = content.strip()
-    if text.startswith("```"):
-        # strip outer triple backticks and optional language tag
-        # ```json\n...\n```
-        m = re.search(r"```(?:json)?\s*([\s\S]*?)```", text, flags=re.IGNORECASE)
-        if m:
-            text = m.group(1).strip()
-    # Fallback: remove a leading 'json' line if present
-    if text.lower().startswith("json\n"):
-        text = text.split("\n", 1)[1]
+    text = _strip_code_fence(content)
 
     parsed = json.loads(text)
     if not isinstance(parsed, list):
@@ -161,38 +193,12 @@ def parse_cheque_with_gpt(
         try:
             clf_resp = client.chat.completions.create(
                 model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": (
-                            "Классифицируй товар по трём уровням категорий. Верни ТОЛЬКО JSON-объект "
-                            "с полями category1, category2, category3. Без пояснений."
-                        ),
-                    },
-                    {
-                        "role": "user",
-                        "content": f"Наименование: {name}",
-                    },
-                ],
+                messages=_classify_messages(name),
                 temperature=0.0,
             )
-            ctext = clf_resp.choices[0].message.content.strip()
-            if ctext.startswith("```"):
-                m2 = re.search(r"```(?:json)?\s*([\s\S]*?)```", ctext, flags=re.IGNORECASE)
-                if m2:
-                    ctext = m2.group(1).strip()
-            if ctext.lower().startswith("json\n"):
-                ctext = ctext.split("\n", 1)[1]
-            obj = json.loads(ctext)
-            if isinstance(obj, dict):
-                cat1 = (obj.get("category1") or "").strip()
-                cat2 = (obj.get("category2") or "").strip()
-                cat3 = (obj.get("category3") or "").strip()
-                if cat1 or cat2 or cat3:
-                    return {"category1": cat1, "category2": cat2, "category3": cat3}
+            return _categories_from_text(clf_resp.choices[0].message.content)
         except Exception:
-            pass
-        return None
+            return None
 
     for item in parsed:
         name = item.get("product_name") or ""
@@ -0,0 +1,423 @@
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from aiAssistant.core.ai_cache import ResponseCache, dumps_sorted, make_cache_key, is_cacheable
+from aiAssistant.core.ai_client import AIClient, close_persistent_caches
+
+
+@pytest.fixture(autouse=True)
+def _no_persistent_cache(monkeypatch):
+    import config
+
+    monkeypatch.setattr(config, "LLM_CACHE_PATH", None)
+    monkeypatch.setattr(config, "OPENAI_WARMUP", False)
+
+
+def _tool_call(name):
+    return SimpleNamespace(id="call_1", function=SimpleNamespace(name=name, arguments="{}"))
+
+
+class _FakeCompletions:
+    def __init__(self, tool_name=None):
+        self.calls = 0
+        self.tool_name = tool_name
+
+    def create(self, **kwargs):
+        self.calls += 1
+        tool_calls = [_tool_call(self.tool_name)] if self.tool_name else None
+        message = SimpleNamespace(content="ok", tool_calls=tool_calls)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+def _client(tool_name=None):
+    client = AIClient(api_key="sk-test")
+    completions = _FakeCompletions(tool_name)
+    client.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    return client, completions
+
+
+def test_cache_key_is_stable_and_sensitive_to_messages():
+    msgs = [{"role": "user", "content": "за неделю"}]
+    assert make_cache_key("m", msgs, None, 0.3) == make_cache_key("m", [dict(msgs[0])], None, 0.3)
+    assert make_cache_key("m", msgs, None, 0.3) != make_cache_key("m", [{"role": "user", "content": "за месяц"}], None, 0.3)
+
+
+def test_dumps_sorted_orders_keys_and_keeps_cyrillic():
+    raw = dumps_sorted({"b": "чек", "a": [1, {"d": None, "c": 2.5}]})
+
+    assert json.loads(raw) == {"a": [1, {"c": 2.5, "d": None}], "b": "чек"}
+    assert raw.index(b'"a"') < raw.index(b'"b"')
+    assert "чек".encode("utf-8") in raw
+
+
+def test_response_cache_evicts_lru_and_expires():
+    cache = ResponseCache(max_size=2, ttl=600)
+    cache.set("a", {"content": "a"})
+    cache.set("b", {"content": "b"})
+    cache.get("a")
+    cache.set("c", {"content": "c"})
+    assert cache.get("b") is None
+    assert cache.get("a") == {"content": "a"}
+
+    cache.set("d", {"content": "d"}, ttl=-1)
+    assert cache.get("d") is None
+
+
+def test_mutating_tool_calls_are_not_cacheable():
+    assert is_cacheable({"content": "x", "tool_calls": [_tool_call("get_summary")], "error": None})
+    assert not is_cacheable({"content": "x", "tool_calls": [_tool_call("delete_cheque")], "error": None})
+    assert not is_cacheable({"content": "x", "tool_calls": [_tool_call("update_record")], "error": None})
+    assert not is_cacheable({"content": "x", "tool_calls": None, "error": "timeout"})
+
+
+def test_get_response_serves_repeated_request_from_cache():
+    client, completions = _client("get_current_week")
+    messages = [{"role": "user", "content": "траты за неделю"}]
+
+    first = client.get_response(messages, [{"type": "function"}])
+    second = client.get_response(messages, [{"type": "function"}])
+
+    assert completions.calls == 1
+    assert second is first
+
+
+def test_get_response_does_not_cache_mutating_calls():
+    client, completions = _client("delete_cheque")
+    messages = [{"role": "user", "content": "удали чек 5"}]
+
+    client.get_response(messages)
+    client.get_response(messages)
+
+    assert completions.calls == 2
+
+
+def test_semantic_cache_serves_similar_read_only_queries(tmp_path):
+    from aiAssistant.core.ai_cache import SemanticCache
+
+    cache = SemanticCache(threshold=0.9)
+    payload = {"content": None, "tool_calls": [_tool_call("get_current_week")], "error": None}
+    cache.add("ns", "траты за неделю", [1.0, 0.0, 0.0], payload)
+
+    hit = cache.lookup("ns", "покажи траты за неделю", [0.99, 0.05, 0.0])
+    assert hit["tool_calls"][0].function.name == "get_current_week"
+    assert cache.lookup("other", "покажи траты за неделю", [0.99, 0.05, 0.0]) is None
+    assert cache.lookup("ns", "траты за месяц", [0.0, 1.0, 0.0]) is None
+
+    cache.add("ns", "удали чек 5", [0.0, 0.0, 1.0], {"content": None, "tool_calls": [_tool_call("delete_cheque")], "error": None})
+    assert len(cache) == 1
+
+    path = str(tmp_path / "sem_cache.npz")
+    cache.save(path)
+    restored = SemanticCache(threshold=0.9, path=path)
+    assert restored.lookup("ns", "траты за неделю", [1.0, 0.0, 0.0]) is not None
+
+
+def test_semantic_cache_requires_matching_numbers():
+    from aiAssistant.core.ai_cache import SemanticCache
+
+    cache = SemanticCache(threshold=0.9)
+    cache.add("ns", "за 7 дней", [1.0, 0.0], {"content": None, "tool_calls": [_tool_call("get_last_n_days")], "error": None})
+
+    assert cache.lookup("ns", "за 10 дней", [1.0, 0.0]) is None
+    assert cache.lookup("ns", "покажи за 7 дней", [1.0, 0.0]) is not None
+
+
+def test_aget_response_uses_async_client_and_shared_cache():
+    import asyncio
+
+    client, completions = _client("get_summary")
+
+    class _AsyncCompletions:
+        async def create(self, **kwargs):
+            return completions.create(**kwargs)
+
+    client.aclient = SimpleNamespace(chat=SimpleNamespace(completions=_AsyncCompletions()))
+    messages = [{"role": "user", "content": "итоги"}]
+
+    first = asyncio.run(client.aget_response(messages))
+    second = client.get_response(messages)
+
+    assert first["tool_calls"][0].function.name == "get_summary"
+    assert second is first
+    assert completions.calls == 1
+
+
+def test_adispatch_tool_calls_keeps_order_and_serializes_mutations():
+    import asyncio
+    import threading
+    import time
+
+    client, _ = _client()
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def handler(name, args):
+        with lock:
+            active.append(name)
+            peak.append(len(active))
+        time.sleep(0.05)
+        with lock:
+            active.remove(name)
+        return f"{name}:{args['n']}"
+
+    reads = [("get_current_week", {"n": 1}), ("fetch_by_period", {"n": 2})]
+    assert asyncio.run(client.adispatch_tool_calls(reads, handler)) == ["get_current_week:1", "fetch_by_period:2"]
+    assert max(peak) == 2
+
+    peak.clear()
+    mixed = [("get_last_cheque", {"n": 1}), ("delete_cheque", {"n": 2})]
+    assert asyncio.run(client.adispatch_tool_calls(mixed, handler)) == ["get_last_cheque:1", "delete_cheque:2"]
+    assert max(peak) == 1
+
+
+def test_get_response_retries_transient_errors(monkeypatch):
+    from openai import APIConnectionError
+    import aiAssistant.core.ai_client as ai_client_module
+
+    class _ConnectionDropped(APIConnectionError):
+        def __init__(self):
+            Exception.__init__(self, "connection dropped")
+
+    monkeypatch.setattr(ai_client_module.time, "sleep", lambda _: None)
+    client, completions = _client()
+    original_create = completions.create
+    failures = [_ConnectionDropped()]
+
+    def flaky_create(**kwargs):
+        if failures:
+            raise failures.pop()
+        return original_create(**kwargs)
+
+    completions.create = flaky_create
+    result = client.get_response([{"role": "user", "content": "привет"}])
+
+    assert result["error"] is None
+    assert result["content"] == "ok"
+
+
+def test_get_response_maps_final_error_to_code(monkeypatch):
+    from openai import APIConnectionError
+    import aiAssistant.core.ai_client as ai_client_module
+
+    class _ConnectionDropped(APIConnectionError):
+        def __init__(self):
+            Exception.__init__(self, "connection dropped")
+
+    def failing_create(**kwargs):
+        raise _ConnectionDropped()
+
+    monkeypatch.setattr(ai_client_module.time, "sleep", lambda _: None)
+    client, completions = _client()
+    completions.create = failing_create
+    result = client.get_response([{"role": "user", "content": "привет"}])
+
+    assert result["error"] == "connection"
+    assert result["tool_calls"] is None
+    assert client._error_result(ValueError("boom"))["error"] == "unknown"
+
+
+def test_retry_delay_honors_retry_after():
+    from aiAssistant.core.ai_client import _retry_delay
+
+    error = SimpleNamespace(response=SimpleNamespace(headers={"retry-after": "2"}))
+    assert _retry_delay(0, error) == 2.0
+    assert 0 <= _retry_delay(5, Exception()) <= 8
+
+
+def test_tools_definition_is_built_once():
+    client, _ = _client()
+    tools = client.get_tools_definition()
+
+    assert tools is client.get_tools_definition()
+    assert {"get_last_n_days", "delete_cheque"} <= {t["function"]["name"] for t in tools}
+
+
+def test_user_friendly_error_messages():
+    client, _ = _client()
+
+    assert "много времени" in client._get_user_friendly_error_message(Exception("Request Timed Out"))
+    assert "Слишком много запросов" in client._get_user_friendly_error_message(Exception("HTTP 429"))
+    assert "Сейчас не могу" in client._get_user_friendly_error_message(Exception("unsupported_country_region"))
+    assert "подключением" in client._get_user_friendly_error_message(Exception("Network unreachable"))
+    assert "переформулировать" in client._get_user_friendly_error_message(Exception("boom"))
+
+
+def test_clients_share_one_openai_instance():
+    first = AIClient(api_key="sk-shared")
+    second = AIClient(api_key="sk-shared")
+
+    assert first.client is second.client
+    assert first.aclient is second.aclient
+
+
+def _chunk(content=None, tool_calls=None):
+    delta = SimpleNamespace(content=content, tool_calls=tool_calls)
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+def _tool_delta(index, id=None, name=None, arguments=None):
+    return SimpleNamespace(index=index, id=id, function=SimpleNamespace(name=name, arguments=arguments))
+
+
+def test_stream_response_yields_text_and_returns_result():
+    client, completions = _client()
+    completions.create = lambda **kwargs: iter([_chunk("При"), _chunk("вет"), _chunk(None)])
+
+    stream = client.stream_response([{"role": "user", "content": "привет"}])
+    pieces = []
+    try:
+        while True:
+            pieces.append(next(stream))
+    except StopIteration as stop:
+        result = stop.value
+
+    assert pieces == ["При", "вет"]
+    assert result == {"content": "Привет", "tool_calls": None, "error": None}
+
+
+def test_astream_response_assembles_tool_calls():
+    import asyncio
+
+    client, _ = _client()
+    chunks = [
+        _chunk(tool_calls=[_tool_delta(0, id="call_1", name="get_last_n_days", arguments='{"n"')]),
+        _chunk(tool_calls=[_tool_delta(0, arguments=": 7}")]),
+    ]
+
+    class _AsyncStream:
+        def __init__(self):
+            self._chunks = iter(chunks)
+
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            try:
+                return next(self._chunks)
+            except StopIteration:
+                raise StopAsyncIteration
+
+    class _AsyncCompletions:
+        async def create(self, **kwargs):
+            assert kwargs["stream"] is True
+            return _AsyncStream()
+
+    client.aclient = SimpleNamespace(chat=SimpleNamespace(completions=_AsyncCompletions()))
+    deltas = []
+
+    async def on_delta(text):
+        deltas.append(text)
+
+    result = asyncio.run(client.astream_response([{"role": "user", "content": "за 7 дней"}], on_delta=on_delta))
+
+    assert deltas == []
+    assert result["tool_calls"][0].function.name == "get_last_n_days"
+    assert result["tool_calls"][0].function.arguments == '{"n": 7}'
+
+
+def test_get_response_passes_hashed_user_id():
+    client, completions = _client()
+    seen = {}
+    original_create = completions.create
+
+    def create(**kwargs):
+        seen.update(kwargs)
+        return original_create(**kwargs)
+
+    completions.create = create
+    client.get_response([{"role": "user", "content": "итоги за год"}], user="12345")
+
+    assert seen["user"] != "12345"
+    assert len(seen["user"]) == 32
+
+
+def test_sqlite_response_cache_survives_reopen(tmp_path):
+    from aiAssistant.core.ai_cache import SQLiteResponseCache
+
+    path = str(tmp_path / "llm_cache.sqlite3")
+    cache = SQLiteResponseCache(path, ttl=600)
+    payload = {"content": None, "tool_calls": [_tool_call("get_summary")], "error": None}
+    cache.set("k", payload)
+    cache.set("old", payload, ttl=-10)
+    cache.close()
+
+    reopened = SQLiteResponseCache(path, ttl=600)
+    assert reopened.get("k")["tool_calls"][0].function.name == "get_summary"
+    assert reopened.get("old") is None
+    assert reopened.get("missing") is None
+    reopened.close()
+
+
+def test_get_response_reads_persistent_cache_after_restart(tmp_path, monkeypatch):
+    import config
+
+    monkeypatch.setattr(config, "LLM_CACHE_PATH", str(tmp_path / "llm_cache.sqlite3"))
+    messages = [{"role": "user", "content": "итоги за неделю"}]
+
+    first, first_completions = _client("get_summary_week")
+    first.get_response(messages)
+    close_persistent_caches()
+    restarted, restarted_completions = _client("get_summary_week")
+    result = restarted.get_response(messages)
+
+    assert first_completions.calls == 1
+    assert restarted_completions.calls == 0
+    assert result["tool_calls"][0].function.name == "get_summary_week"
+    close_persistent_caches()
+
+
+def test_clients_share_persistent_cache(tmp_path, monkeypatch):
+    import config
+
+    monkeypatch.setattr(config, "LLM_CACHE_PATH", str(tmp_path / "llm_cache.sqlite3"))
+    first, second = AIClient(api_key="sk-test"), AIClient(api_key="sk-test")
+
+    assert first._persistent_cache is second._persistent_cache
+    close_persistent_caches()
+    assert first._persistent_cache._stop.is_set()
+
+
+def test_warmup_retrieves_model_and_swallows_errors():
+    from aiAssistant.core.ai_client import _warmup
+
+    retrieved = []
+    ok = SimpleNamespace(models=SimpleNamespace(retrieve=lambda model, timeout: retrieved.append(model)))
+    _warmup(ok, "gpt-4o-mini")
+    assert retrieved == ["gpt-4o-mini"]
+
+    def fail(model, timeout):
+        raise ConnectionError("offline")
+
+    _warmup(SimpleNamespace(models=SimpleNamespace(retrieve=fail)), "gpt-4o-mini")
+
+
+@pytest.mark.parametrize("api_key", ["", "YOUR_OPENAI_KEY", "pk-123"])
+def test_invalid_api_key_is_rejected_every_time(monkeypatch, api_key):
+    import config
+
+    monkeypatch.setattr(config, "OPENAI_API_KEY", "")
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            AIClient(api_key=api_key or None)
+
+
+def test_tools_definition_is_consistent():
+    tools = AIClient(api_key="sk-test").get_tools_definition()
+    names = [t["function"]["name"] for t in tools]
+
+    assert len(names) == len(set(names))
+    for t in tools:
+        params = t["function"]["parameters"]
+        assert set(params.get("required", ())) <= set(params["properties"])
+
+
+def test_clients_with_same_key_share_rate_limiter():
+    assert AIClient(api_key="sk-test")._rate_limiter is AIClient(api_key="sk-test")._rate_limiter
+    assert AIClient(api_key="sk-other")._rate_limiter is not AIClient(api_key="sk-test")._rate_limiter
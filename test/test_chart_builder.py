@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from PIL import Image
+
+from aiAssistant.charts.chart_builder import create_pie_chart
+
+
+GROUPED = [
+    {"group_name": "Продукты", "total": 300.5},
+    {"group_name": None, "total": 100},
+    {"group_name": "Пусто", "total": 0},
+]
+
+
+@pytest.mark.parametrize("backend", ["pillow", "matplotlib"])
+def test_create_pie_chart_returns_png(backend):
+    buf = create_pie_chart(GROUPED, "category1", backend=backend)
+
+    img = Image.open(buf)
+    assert img.format == "PNG"
+    assert img.width > 0 and img.height > 0
+
+
+def test_create_pie_chart_rejects_non_positive_values():
+    with pytest.raises(ValueError):
+        create_pie_chart([{"group_name": "a", "total": 0}], "category1")
+    with pytest.raises(ValueError):
+        create_pie_chart([], "category1")
+
+
+def test_matplotlib_backend_reuses_figure_between_calls():
+    first = Image.open(create_pie_chart(GROUPED, "category1", backend="matplotlib"))
+    many = [{"group_name": f"g{i}", "total": i + 1} for i in range(20)]
+    second = Image.open(create_pie_chart(many, "category1", backend="matplotlib"))
+
+    assert second.height > first.height
@@ -0,0 +1,83 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from aiAssistant.core.context_manager import ContextManager
+
+
+def test_add_message_keeps_last_max_messages():
+    cm = ContextManager(max_messages=3)
+    for i in range(5):
+        cm.add_message(1, "user", str(i))
+
+    assert [m["content"] for m in cm.get_messages(1)] == ["2", "3", "4"]
+    assert list(cm.get_messages(2)) == []
+
+
+def test_clear_context_drops_all_user_state():
+    cm = ContextManager()
+    cm.add_message(1, "user", "привет")
+    cm.set_last_cheque(1, 42)
+    cm.set_pending_cheque(1, {"items": []})
+    cm.set_last_query(1, "get_summary", {}, [], "u")
+
+    cm.clear_context(1)
+
+    assert list(cm.get_messages(1)) == []
+    assert cm.get_last_cheque(1) is None
+    assert cm.get_pending_cheque(1) is None
+    assert cm.get_last_query(1) is None
+
+
+def test_system_prompt_is_read_once(tmp_path):
+    prompt = tmp_path / "prompt.txt"
+    prompt.write_text("  Ты - ассистент  \n", encoding="utf-8")
+    cm = ContextManager()
+    cm._prompt_path = str(prompt)
+
+    assert cm.get_system_prompt() == "Ты - ассистент"
+    prompt.unlink()
+    assert cm.get_system_prompt() == "Ты - ассистент"
+
+
+def test_clearing_unknown_user_is_noop():
+    cm = ContextManager()
+    cm.add_message(1, "user", "привет")
+
+    cm.clear_context(999)
+    cm.clear_last_query(999)
+    cm.clear_pending_cheque(999)
+
+    assert len(list(cm.get_messages(1))) == 1
+    assert 999 not in cm._users
+
+
+def test_add_message_interns_role():
+    cm = ContextManager()
+    role = "".join(["assi", "stant"])
+    cm.add_message(1, role, "ok")
+
+    assert next(iter(cm.get_messages(1)))["role"] is sys.intern("assistant")
+
+
+def test_get_messages_returns_history_without_copy():
+    cm = ContextManager()
+    cm.add_message(1, "user", "a")
+
+    assert cm.get_messages(1) is cm.get_messages(1)
+    assert cm.get_messages(1)[-1]["content"] == "a"
+    assert cm.get_messages(2) == ()
+
+
+def test_last_query_is_bounded_per_process_and_per_result():
+    cm = ContextManager(max_queries=2, max_query_rows=3)
+    cm.set_last_query(1, "get_grouped_by_category1", {}, [{"total": i} for i in range(5)], "u1")
+    cm.set_last_query(2, "get_summary", {}, [], "u2")
+    cm.get_last_query(1)
+    cm.set_last_query(3, "get_summary", {}, [], "u3")
+
+    assert cm.get_last_query(2) is None
+    first = cm.get_last_query(1)
+    assert first["truncated"] and first["result"] == []
+    assert cm.get_last_query(3)["truncated"] is False
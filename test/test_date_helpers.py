@@ -0,0 +1,158 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from aiAssistant.core.date_helpers import (
+    get_current_month,
+    get_current_week,
+    get_last_n_days,
+    get_previous_month,
+    get_previous_year,
+    get_yesterday,
+    normalize_to_current_month_if_same_month_wrong_year,
+    parse_period_string,
+)
+
+
+@pytest.mark.parametrize(
+    "text, helper",
+    [
+        ("за вчера", get_yesterday),
+        ("в прошлые дни", get_yesterday),
+        ("за неделю", get_current_week),
+        ("прошлый месяц", get_previous_month),
+        ("за прошлый год", get_previous_year),
+        ("за месяц", get_current_month),
+    ],
+)
+def test_parse_period_string_keywords(text, helper):
+    assert parse_period_string(text) == helper()
+
+
+def test_parse_period_string_days_and_named_month():
+    assert parse_period_string("за 10 дней") == get_last_n_days(10)
+    assert parse_period_string("октябрь 2024") == ("01.10.2024", "31.10.2024")
+    assert parse_period_string("февраль 2024") == ("01.02.2024", "29.02.2024")
+    assert parse_period_string("за март 2023") == ("01.03.2023", "31.03.2023")
+    assert parse_period_string("за мая 2023") == ("01.05.2023", "31.05.2023")
+    assert parse_period_string("что-то другое") is None
+    assert parse_period_string("сумма") is None
+
+
+@pytest.mark.parametrize("text", ["за (март) 2023", "за «март» 2023", "траты за,март 2023", "за-март 2023"])
+def test_parse_period_string_month_next_to_punctuation(text):
+    assert parse_period_string(text) == ("01.03.2023", "31.03.2023")
+
+
+def test_get_last_n_days_includes_today():
+    start, end = get_last_n_days(7)
+    today = datetime.now()
+    assert end == today.strftime("%d.%m.%Y")
+    assert start == (today - timedelta(days=6)).strftime("%d.%m.%Y")
+
+
+def test_normalize_wrong_year_moves_period_to_current_year():
+    year = datetime.now().year
+    assert normalize_to_current_month_if_same_month_wrong_year("01.11.2023", "30.11.2023") == (f"01.11.{year}", f"30.11.{year}")
+    assert normalize_to_current_month_if_same_month_wrong_year("05.03.2023", "10.03.2023") == (f"05.03.{year}", f"10.03.{year}")
+    assert normalize_to_current_month_if_same_month_wrong_year("bad", "10.03.2023") == ("bad", "10.03.2023")
+
+
+def test_today_is_computed_once_per_turn(monkeypatch):
+    import aiAssistant.core.date_helpers as dh
+
+    calls = []
+
+    class _FakeDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            calls.append(1)
+            return datetime(2025, 3, 15, 12, 0)
+
+    monkeypatch.setattr(dh, "datetime", _FakeDatetime)
+    dh.reset_today_cache()
+
+    assert dh.get_current_week() == ("10.03.2025", "15.03.2025")
+    assert dh.get_current_month() == ("01.03.2025", "15.03.2025")
+    assert dh.get_previous_month() == ("01.02.2025", "28.02.2025")
+    assert len(calls) == 1
+
+    dh.reset_today_cache()
+    dh.get_yesterday()
+    assert len(calls) == 2
+    dh.reset_today_cache()
+
+
+@pytest.mark.parametrize("n, expected_start", [(1, "01.02.2025"), (3, "01.12.2024"), (15, "01.12.2023"), (0, "01.03.2025")])
+def test_get_last_n_months_counts_calendar_months(monkeypatch, n, expected_start):
+    import aiAssistant.core.date_helpers as dh
+
+    monkeypatch.setattr(dh, "_now_and_str", lambda: (datetime(2025, 3, 15), "15.03.2025"))
+
+    assert dh.get_last_n_months(n) == (expected_start, "15.03.2025")
+
+
+def test_fmt_pads_day_month_and_year():
+    from aiAssistant.core.date_helpers import _fmt
+
+    assert _fmt(datetime(2025, 1, 5)) == "05.01.2025"
+    assert _fmt(datetime(2025, 11, 30)) == datetime(2025, 11, 30).strftime("%d.%m.%Y")
+
+
+def test_parse_ddmmyyyy_is_cached():
+    from aiAssistant.core.date_helpers import _parse_ddmmyyyy
+
+    assert _parse_ddmmyyyy("05.11.2025") is _parse_ddmmyyyy("05.11.2025")
+    assert _parse_ddmmyyyy("31.02.2025") is None
+
+
+def test_normalize_wrong_year_maps_leap_day_to_month_end():
+    import calendar
+
+    year = datetime.now().year
+    last_feb = calendar.monthrange(year, 2)[1]
+    assert normalize_to_current_month_if_same_month_wrong_year("01.02.2024", "29.02.2024") == (f"01.02.{year}", f"{last_feb:02d}.02.{year}")
+    assert normalize_to_current_month_if_same_month_wrong_year("01.02.2024", "28.02.2024") == (f"01.02.{year}", f"28.02.{year}")
+
+
+def test_normalize_keeps_current_year_dates_without_parsing(monkeypatch):
+    import aiAssistant.core.date_helpers as dh
+
+    year = datetime.now().year
+    monkeypatch.setattr(dh, "_parse_ddmmyyyy", lambda s: pytest.fail("should not parse"))
+
+    assert dh.normalize_to_current_month_if_same_month_wrong_year(f"01.03.{year}", f"31.03.{year}") == (f"01.03.{year}", f"31.03.{year}")
+
+
+def test_previous_month_and_year_follow_calendar_rollover(monkeypatch):
+    import aiAssistant.core.date_helpers as dh
+
+    now = [(datetime(2025, 1, 31), "31.01.2025")]
+    monkeypatch.setattr(dh, "_now_and_str", lambda: now[0])
+
+    assert dh.get_previous_month() == ("01.12.2024", "31.12.2024")
+    assert dh.get_previous_year() == ("01.01.2024", "31.12.2024")
+    now[0] = (datetime(2025, 2, 1), "01.02.2025")
+    assert dh.get_previous_month() == ("01.01.2025", "31.01.2025")
+    now[0] = (datetime(2026, 2, 1), "01.02.2026")
+    assert dh.get_previous_month() == ("01.01.2026", "31.01.2026")
+    assert dh.get_previous_year() == ("01.01.2025", "31.12.2025")
+
+
+def test_day_periods_are_recomputed_when_the_day_changes(monkeypatch):
+    import aiAssistant.core.date_helpers as dh
+
+    now = [(datetime(2025, 3, 31, 23, 59), "31.03.2025")]
+    monkeypatch.setattr(dh, "_now_and_str", lambda: now[0])
+
+    assert dh.get_current_month() == ("01.03.2025", "31.03.2025")
+    assert dh.get_current_week() == ("31.03.2025", "31.03.2025")
+    assert dh.get_yesterday() == ("30.03.2025", "30.03.2025")
+    now[0] = (datetime(2025, 4, 1, 0, 1), "01.04.2025")
+    assert dh.get_current_month() == ("01.04.2025", "01.04.2025")
+    assert dh.get_current_week() == ("31.03.2025", "01.04.2025")
+    assert dh.get_yesterday() == ("31.03.2025", "31.03.2025")
@@ -0,0 +1,284 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from db.db_manager import init_db, bulk_insert_purchases
+from aiAssistant.db import db_manager as ai_db
+
+
+def _record(chequeid, date, product_name, price, username="test_user", **extra):
+    record = {
+        "chequeid": chequeid,
+        "date": date,
+        "product_name": product_name,
+        "price": price,
+        "category1": "Продукты",
+        "organization": "Магазин",
+        "username": username,
+    }
+    record.update(extra)
+    return record
+
+
+@pytest.fixture(autouse=True)
+def _close_pools():
+    yield
+    ai_db.close_pools()
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "receipts.db")
+    init_db(path)
+    bulk_insert_purchases(
+        [
+            _record(1, "01.11.2025", "Яблоки", 120.5),
+            _record(1, "01.11.2025", "Груши", 80),
+            _record(2, "2025-11-03", "Бананы", 99.9),
+            _record(3, "30-10-2025", "Хлеб", 40),
+            _record(4, "03.11.2025", "Чужой товар", 10, username="other_user"),
+        ],
+        path,
+    )
+    return path
+
+
+def test_fetch_by_period_uses_date_ymd_for_all_date_formats(db_path):
+    rows = ai_db.fetch_by_period("01.11.2025", "30.11.2025", "test_user", db_path)
+    assert sorted(r["product_name"] for r in rows) == ["Бананы", "Груши", "Яблоки"]
+
+    summary = ai_db.get_summary("30.10.2025", "03.11.2025", "test_user", db_path)
+    assert summary == {"count": 4, "total": 340.4, "cheque_count": 3}
+
+
+def test_period_filter_is_an_index_range_seek(db_path):
+    with sqlite3.connect(db_path) as conn:
+        plan = " ".join(
+            row[-1]
+            for row in conn.execute(
+                "EXPLAIN QUERY PLAN SELECT * FROM purchases WHERE username = ? AND date_ymd BETWEEN ? AND ?",
+                ("test_user", "2025-11-01", "2025-11-30"),
+            )
+        )
+    assert "idx_purchases_user_date_cheque" in plan
+
+
+def test_summary_reads_only_the_covering_index(db_path):
+    with sqlite3.connect(db_path) as conn:
+        plan = " ".join(
+            row[-1]
+            for row in conn.execute(f"EXPLAIN QUERY PLAN {ai_db._SQL_SUMMARY}", ("test_user", "2025-11-01", "2025-11-30"))
+        )
+    assert "COVERING INDEX idx_purchases_user_date_cheque" in plan
+    assert ai_db.get_summary("01.01.2020", "31.12.2020", "test_user", db_path) == {"count": 0, "total": 0.0, "cheque_count": 0}
+
+
+def test_init_db_backfills_date_ymd_for_legacy_rows(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE purchases (id INTEGER PRIMARY KEY AUTOINCREMENT, chequeid INTEGER, file_path TEXT, date TEXT, "
+            "created_at TEXT, product_name TEXT, quantity REAL DEFAULT 1, price REAL, discount REAL, category1 TEXT, "
+            "category2 TEXT, category3 TEXT, organization TEXT, username TEXT, description TEXT)"
+        )
+        conn.execute("INSERT INTO purchases (chequeid, date, product_name, price, username) VALUES (1, '05.02.2024', 'Сыр', 300, 'u')")
+
+    init_db(path)
+
+    assert [r["product_name"] for r in ai_db.fetch_by_period("01.02.2024", "29.02.2024", "u", path)] == ["Сыр"]
+
+
+def test_date_updates_keep_date_ymd_in_sync(db_path):
+    ai_db.update_field_by_cheque(1, "date", "15.12.2025", "test_user", db_path)
+
+    assert ai_db.fetch_by_period("01.11.2025", "30.11.2025", "test_user", db_path)[0]["product_name"] == "Бананы"
+    assert len(ai_db.fetch_by_period("01.12.2025", "31.12.2025", "test_user", db_path)) == 2
+
+
+def test_fetch_by_organization_is_case_insensitive_for_cyrillic(tmp_path):
+    path = str(tmp_path / "orgs.db")
+    init_db(path)
+    bulk_insert_purchases(
+        [
+            _record(1, "01.11.2025", "Молоко", 90, organization="ЛЕНТА"),
+            _record(2, "02.11.2025", "Сыр", 300, organization="Магазин ЛенТа"),
+            _record(3, "03.11.2025", "Хлеб", 40, organization="Пятерочка 100%"),
+        ],
+        path,
+    )
+
+    assert sorted(r["chequeid"] for r in ai_db.fetch_by_organization("лента", "test_user", path)) == [1, 2]
+    assert [r["chequeid"] for r in ai_db.fetch_by_organization("100%", "test_user", path)] == [3]
+    assert [r["chequeid"] for r in ai_db.fetch_by_organization("%", "test_user", path)] == [3]
+    assert ai_db.fetch_by_organization("  ", "test_user", path) == []
+
+
+def test_text_search_uses_fts_and_follows_updates(tmp_path):
+    path = str(tmp_path / "fts.db")
+    init_db(path)
+    bulk_insert_purchases(
+        [
+            _record(1, "01.11.2025", "Молоко 2.5%", 90, description="авоська"),
+            _record(2, "02.11.2025", "МОЛОКО Домик", 110),
+            _record(3, "03.11.2025", "Хлеб", 40),
+            _record(4, "03.11.2025", "Молоко", 80, username="other_user"),
+        ],
+        path,
+    )
+
+    assert sorted(r["chequeid"] for r in ai_db.fetch_by_product_name("молоко", "test_user", path)) == [1, 2]
+    assert [r["chequeid"] for r in ai_db.fetch_by_product_name("2.5%", "test_user", path)] == [1]
+    assert [r["chequeid"] for r in ai_db.fetch_by_product_name("еб", "test_user", path)] == [3]
+    assert [r["chequeid"] for r in ai_db.fetch_by_description("АВОСЬ", "test_user", path)] == [1]
+
+    ai_db.update_description_by_cheque(2, "работа", "test_user", path)
+    ai_db.delete_cheque(1, "test_user", path)
+
+    assert [r["chequeid"] for r in ai_db.fetch_by_description("работ", "test_user", path)] == [2]
+    assert ai_db.fetch_by_description("авось", "test_user", path) == []
+
+
+def test_find_exact_category1_prefers_exact_then_case_insensitive(db_path):
+    bulk_insert_purchases(
+        [
+            _record(5, "04.11.2025", "Сок", 100, category1="Напитки"),
+            _record(6, "04.11.2025", "Вода", 50, category1=" Бытовая химия "),
+        ],
+        db_path,
+    )
+
+    assert ai_db.find_exact_category1("Напитки", "test_user", db_path) == "Напитки"
+    assert ai_db.find_exact_category1("  напитки ", "test_user", db_path) == "Напитки"
+    assert ai_db.find_exact_category1("Бытовая химия", "test_user", db_path) == "Бытовая химия"
+    assert ai_db.find_exact_category1("Одежда", "test_user", db_path) is None
+    assert ai_db.find_exact_category1("Напитки", "other_user", db_path) is None
+
+
+def test_pooled_connections_are_reused_and_use_wal(db_path):
+    with ai_db._get_pooled(db_path) as conn:
+        first = conn
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    with ai_db._get_pooled(db_path) as conn:
+        assert conn is first
+        with ai_db._get_pooled(db_path) as nested:
+            assert nested is not first
+
+    ai_db.update_record(1, "price", "100", db_path)
+    assert ai_db.get_summary("01.11.2025", "01.11.2025", "test_user", db_path)["total"] == 180.0
+
+
+def test_fetch_by_period_orders_by_calendar_date(db_path):
+    rows = ai_db.fetch_by_period("30.10.2025", "30.11.2025", "test_user", db_path)
+    assert [r["date"] for r in rows][0] == "2025-11-03"
+    assert [r["date"] for r in rows][-1] == "30-10-2025"
+    with pytest.raises(ValueError):
+        ai_db.fetch_by_category(4, "Продукты", "test_user", db_path)
+
+
+def test_fetch_rows_behave_like_read_only_dicts(db_path, tmp_path):
+    from Export2Excel.exporter import _export_filtered_to_excel
+    from openpyxl import load_workbook
+
+    row = ai_db.get_cheque_by_id(1, "test_user", db_path)[0]
+    assert row.get("product_name") == "Яблоки" and row["price"] == 120.5
+    assert row.get("missing", "-") == "-"
+    assert "category1" in row and "Яблоки" not in row
+    assert dict(row)["organization"] == "Магазин"
+    assert list(row)[:2] == ["id", "chequeid"]
+
+    output_path = _export_filtered_to_excel(ai_db.fetch_by_period("01.11.2025", "30.11.2025", "test_user", db_path), str(tmp_path / "g.xlsx"))
+    header = next(load_workbook(output_path).active.iter_rows(values_only=True))
+    assert len(header) == 11
+
+
+def test_get_last_cheque_returns_rows_of_max_chequeid(db_path):
+    assert [r["product_name"] for r in ai_db.get_last_cheque("test_user", db_path)] == ["Хлеб"]
+    assert ai_db.get_last_cheque("nobody", db_path) == []
+
+
+def test_add_item_to_cheque_inherits_cheque_fields(db_path):
+    from datetime import datetime
+
+    ai_db.add_item_to_cheque(2, "Киви", 55, "test_user", quantity=3, db_path=db_path)
+    ai_db.add_item_to_cheque(99, "Чай", 70, "test_user", db_path=db_path)
+
+    added = ai_db.get_cheque_by_id(2, "test_user", db_path)[-1]
+    assert (added["product_name"], added["date"], added["organization"], added["quantity"]) == ("Киви", "2025-11-03", "Магазин", 3.0)
+    new = ai_db.get_cheque_by_id(99, "test_user", db_path)[0]
+    today = datetime.now()
+    assert new["date"] == today.strftime("%d.%m.%Y") and new["date_ymd"] == today.strftime("%Y-%m-%d")
+    assert new["organization"] is None
+
+
+@pytest.mark.parametrize(
+    "sql, index",
+    [
+        ("SELECT * FROM purchases WHERE chequeid = ? AND username = ?", "idx_purchases_user_cheque"),
+        ("UPDATE purchases SET description = ? WHERE chequeid = ? AND username = ?", "idx_purchases_user_cheque"),
+        ("SELECT * FROM purchases WHERE category2 = ? AND username = ?", "idx_purchases_user_cat2"),
+        ("UPDATE purchases SET category1 = ? WHERE category1 = ? AND username = ?", "idx_purchases_user_cat1"),
+        ("UPDATE purchases SET description = ? WHERE organization = ? AND username = ?", "idx_purchases_user_org"),
+    ],
+)
+def test_user_lookups_use_composite_indexes(db_path, sql, index):
+    with sqlite3.connect(db_path) as conn:
+        params = (None,) * sql.count("?")
+        plan = " ".join(row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+    assert index in plan
+
+
+def test_merge_category1_groups_reports_rowcount_and_presence(db_path):
+    assert ai_db.merge_category1_groups("Продукты", "Еда", "test_user", db_path) == (4, True)
+    assert ai_db.merge_category1_groups("Продукты", "Еда", "test_user", db_path) == (0, False)
+    assert ai_db.find_exact_category1("Еда", "test_user", db_path) == "Еда"
+
+
+def test_grouped_stats_use_prebuilt_queries(db_path):
+    bulk_insert_purchases([_record(5, "04.11.2025", "Сок", 100, category1="Напитки")], db_path)
+
+    stats = ai_db.get_grouped_stats("category1", "01.11.2025", "30.11.2025", "test_user", db_path)
+    assert [(s["group_name"], s["count"], s["cheque_count"], s["total"]) for s in stats] == [
+        ("Продукты", 3, 2, 300.4),
+        ("Напитки", 1, 1, 100.0),
+    ]
+    filtered = ai_db.get_grouped_stats_filtered(
+        "organization", "01.11.2025", "30.11.2025", "test_user", {"category1": "Напитки"}, db_path
+    )
+    assert [(s["group_name"], s["total"]) for s in filtered] == [("Магазин", 100.0)]
+    with pytest.raises(ValueError):
+        ai_db.get_grouped_stats("price", "01.11.2025", "30.11.2025", "test_user", db_path)
+
+
+def test_find_exact_category1_caches_until_category_changes(db_path, monkeypatch):
+    assert ai_db.find_exact_category1("напитки", "test_user", db_path) is None
+    bulk_insert_purchases([_record(5, "04.11.2025", "Сок", 100, category1="Напитки")], db_path)
+    assert ai_db.find_exact_category1("напитки", "test_user", db_path) is None
+
+    monkeypatch.setattr(ai_db, "_CATEGORY1_CACHE_TTL", 0.0)
+    assert ai_db.find_exact_category1("напитки", "test_user", db_path) == "Напитки"
+    monkeypatch.undo()
+
+    ai_db.update_field_by_cheque(5, "category1", "Соки", "test_user", db_path)
+    assert ai_db.find_exact_category1("напитки", "test_user", db_path) is None
+    ai_db.merge_category1_groups("Соки", "Напитки", "test_user", db_path)
+    assert ai_db.find_exact_category1("напитки", "test_user", db_path) == "Напитки"
+
+
+@pytest.mark.parametrize("value", ["01.11.2025", "30-10-2025", "2025-11-03", "2025-11-03 10:15", "01.11.2025 12:00"])
+def test_norm_ymd_matches_backfill_expression(value):
+    from db.db_manager import _DATE_YMD_SQL, norm_ymd
+
+    with sqlite3.connect(":memory:") as conn:
+        backfilled = conn.execute(f"SELECT {_DATE_YMD_SQL} FROM (SELECT ? AS date)", (value,)).fetchone()[0]
+    assert norm_ymd(value) == backfilled[:10]
+
+
+def test_fetch_by_period_limit_and_count(db_path):
+    assert [r["product_name"] for r in ai_db.fetch_by_period("30.10.2025", "30.11.2025", "test_user", db_path, limit=1)] == ["Бананы"]
+    full = ai_db.fetch_by_period("30.10.2025", "30.11.2025", "test_user", db_path)
+    assert ai_db.count_by_period("30.10.2025", "30.11.2025", "test_user", db_path) == len(full)
+    assert ai_db.count_by_period("01.01.2020", "31.01.2020", "test_user", db_path) == 0
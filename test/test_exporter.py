@@ -0,0 +1,201 @@
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from openpyxl import load_workbook
+
+from db.db_manager import init_db, bulk_insert_purchases
+from Export2Excel.exporter import export_to_excel, export_grouped_to_excel, _export_filtered_to_excel, _iter_rows, _coerce_date, _coerce_generic, _estimate_column_widths
+
+
+def _record(chequeid, date, product_name, price, quantity=1, username="test_user"):
+    return {
+        "chequeid": chequeid,
+        "file_path": f"/tmp/cheque_{chequeid}.jpg",
+        "date": date,
+        "product_name": product_name,
+        "quantity": quantity,
+        "price": price,
+        "discount": 0,
+        "category1": "Продукты",
+        "category2": "Фрукты",
+        "category3": None,
+        "organization": "Магазин",
+        "username": username,
+        "description": None,
+    }
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "receipts.db")
+    init_db(path)
+    bulk_insert_purchases(
+        [
+            _record(1, "01.11.2025", "Яблоки", 120.5, quantity=2),
+            _record(1, "01.11.2025", "Груши", 80),
+            _record(2, "03.11.2025", "Бананы", 99.9),
+            _record(3, "03.11.2025", "Чужой товар", 10, username="other_user"),
+        ],
+        path,
+    )
+    return path
+
+
+def test_export_to_excel_writes_user_rows_in_output_order(db_path, tmp_path):
+    output_path = str(tmp_path / "out" / "Report.xlsx")
+
+    export_to_excel(db_path, output_path, "test_user")
+
+    ws = load_workbook(output_path).active
+    rows = list(ws.iter_rows(values_only=True))
+    header = rows[0]
+    assert header[:6] == (
+        "id (идентификатор записи)",
+        "номер чека",
+        "дата чека",
+        "наименование продукта",
+        "количество",
+        "цена",
+    )
+    assert "пользователь" not in header
+    assert "путь к файлу фото" not in header
+    assert len(rows) == 4
+    names = [row[3] for row in rows[1:]]
+    assert "Чужой товар" not in names
+    first = next(row for row in rows[1:] if row[3] == "Яблоки")
+    assert first[2] == datetime(2025, 11, 1)
+    assert first[4] == 2
+    assert first[5] == pytest.approx(120.5)
+    assert ws.freeze_panes == "A2"
+    assert ws.auto_filter.ref == "A1:K4"
+    assert ws.column_dimensions["D"].width == len("наименование продукта") + 2
+    assert {cell.alignment.horizontal for cell in ws[2] if cell.value is not None} == {"left"}
+
+
+def test_export_to_excel_xlsxwriter_backend_matches_openpyxl(db_path, tmp_path):
+    pytest.importorskip("xlsxwriter")
+    openpyxl_path = str(tmp_path / "openpyxl.xlsx")
+    xlsxwriter_path = str(tmp_path / "xlsxwriter.xlsx")
+
+    export_to_excel(db_path, openpyxl_path, "test_user", "01.11.2025", "30.11.2025")
+    export_to_excel(db_path, xlsxwriter_path, "test_user", "01.11.2025", "30.11.2025", backend="xlsxwriter")
+
+    expected = list(load_workbook(openpyxl_path).active.iter_rows(values_only=True))
+    ws = load_workbook(xlsxwriter_path).active
+    assert list(ws.iter_rows(values_only=True)) == expected
+    assert ws.freeze_panes == "A2"
+    assert ws.auto_filter.ref == "A1:K4"
+
+
+def test_iter_rows_streams_all_chunks(db_path):
+    with _iter_rows(db_path, "test_user", chunk_size=1) as (columns, rows):
+        fetched = list(rows)
+
+    assert columns[:5] == ["id", "chequeid", "date", "product_name", "quantity"]
+    assert len(fetched) == 3
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("05.11.2025", datetime(2025, 11, 5)),
+        ("2025-11-05T10:20:30+00:00", datetime(2025, 11, 5)),
+        (datetime(2025, 1, 2), datetime(2025, 1, 2)),
+        ("31.02.2025", "31.02.2025"),
+        ("вчера", "вчера"),
+        (None, None),
+    ],
+)
+def test_coerce_date(value, expected):
+    assert _coerce_date(value) == expected
+
+
+def test_export_filtered_to_excel_reorders_quantity_after_product(tmp_path):
+    output_path = str(tmp_path / "GroupItems.xlsx")
+    data = [
+        {"id": 1, "chequeid": 7, "date": "05.11.2025", "product_name": "Сыр", "price": "150.5", "quantity": 1, "username": "u"},
+    ]
+
+    _export_filtered_to_excel(data, output_path)
+
+    ws = load_workbook(output_path).active
+    rows = list(ws.iter_rows(values_only=True))
+    assert rows[0] == ("id (идентификатор записи)", "номер чека", "дата чека", "наименование продукта", "количество", "цена")
+    assert rows[1] == (1, 7, datetime(2025, 11, 5), "Сыр", 1, pytest.approx(150.5))
+
+
+def test_export_filtered_to_excel_rejects_empty_data(tmp_path):
+    with pytest.raises(ValueError):
+        _export_filtered_to_excel([], str(tmp_path / "empty.xlsx"))
+
+
+def test_export_grouped_to_excel_formats_totals(tmp_path):
+    output_path = str(tmp_path / "Grouped.xlsx")
+    grouped = [
+        {"group_name": "Продукты", "count": 3, "cheque_count": 2, "total": 300.456},
+        {"group_name": None, "count": 1, "cheque_count": 1, "total": 10},
+    ]
+
+    export_grouped_to_excel(grouped, output_path, "category1")
+
+    ws = load_workbook(output_path).active
+    assert ws["A1"].value == "категория 1 уровня"
+    assert ws["A1"].font.bold
+    assert ws["A3"].value is None or ws["A3"].value == ""
+    assert ws["D2"].value == pytest.approx(300.456)
+    assert ws["D2"].number_format == "0.00"
+    assert ws.freeze_panes == "A2"
+    assert ws.auto_filter.ref == "A1:D3"
+    assert ws["A1"].fill.fgColor.rgb == "FFDDDDDD"
+
+
+def test_estimate_column_widths_uses_display_lengths():
+    rows = [(1.5, 120.456, datetime(2025, 1, 2)), (1.5, 7, None)]
+
+    widths = _estimate_column_widths(["q", "p", "d"], rows, ["quantity", "price", "date"])
+
+    assert widths == [3, 6, 10]
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [("12", 12), ("1,5", 1.5), ("2.25", 2.25), (3, 3), ("abc", "abc"), ("1.2.3", "1.2.3"), (None, None)],
+)
+def test_coerce_generic(value, expected):
+    assert _coerce_generic(value) == expected
+
+
+def test_export_filtered_to_excel_accepts_generator(tmp_path):
+    output_path = str(tmp_path / "Stream.xlsx")
+    data = ({"id": i, "product_name": f"p{i}", "file_path": "/tmp/x.jpg"} for i in range(3))
+
+    _export_filtered_to_excel(data, output_path)
+
+    rows = list(load_workbook(output_path).active.iter_rows(values_only=True))
+    assert rows[0] == ("id (идентификатор записи)", "наименование продукта")
+    assert rows[1:] == [(0, "p0"), (1, "p1"), (2, "p2")]
+
+
+def test_export_to_excel_without_rows_writes_header_only(db_path, tmp_path):
+    output_path = str(tmp_path / "nested" / "Empty.xlsx")
+
+    export_to_excel(db_path, output_path, "nobody")
+    export_to_excel(db_path, output_path, "nobody")
+
+    rows = list(load_workbook(output_path).active.iter_rows(values_only=True))
+    assert len(rows) == 1
+    assert rows[0][0] == "id (идентификатор записи)"
+
+
+def test_iter_rows_opens_database_read_only(tmp_path):
+    path = str(tmp_path / "my receipts #1.db")
+    init_db(path)
+    bulk_insert_purchases([_record(1, "01.11.2025", "Яблоки", 10)], path)
+
+    with _iter_rows(path, "test_user") as (columns, rows):
+        assert len(list(rows)) == 1
@@ -0,0 +1,32 @@
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from aiAssistant.core.rate_limiter import RateLimiter, estimate_tokens
+
+
+def test_estimate_tokens_counts_content_and_reserve():
+    messages = [{"role": "system", "content": "x" * 40}, {"role": "assistant", "content": None}]
+    assert estimate_tokens(messages) == 10 + 512
+
+
+def test_acquire_waits_when_request_bucket_is_empty():
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=10**6)
+    for _ in range(600):
+        limiter.acquire(1, 1)
+
+    started = time.monotonic()
+    limiter.acquire(1, 1)
+    assert time.monotonic() - started >= 0.05
+
+
+def test_aacquire_waits_for_tokens():
+    limiter = RateLimiter(requests_per_minute=1000, tokens_per_minute=6000)
+    limiter.acquire(1, 6000)
+
+    started = time.monotonic()
+    asyncio.run(limiter.aacquire(1, 10))
+    assert time.monotonic() - started >= 0.05
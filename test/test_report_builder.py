@@ -0,0 +1,91 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from aiAssistant.reports.report_builder import ReportBuilder
+
+
+def _item(chequeid, product_name, price, quantity=1, date="01.11.2025", organization="Лента"):
+    return {
+        "chequeid": chequeid,
+        "date": date,
+        "organization": organization,
+        "product_name": product_name,
+        "price": price,
+        "quantity": quantity,
+    }
+
+
+def test_format_cheque():
+    items = [_item(7, "Молоко", 89.9), _item(7, "Очень длинное название товара для проверки обрезки", 10, quantity=2)]
+
+    assert ReportBuilder.format_cheque(items) == (
+        "🧾 Чек № 7 | 📅 01.11.2025\n"
+        "🏪 Лента\n\n"
+        "1. Молоко | 89.90 ₽\n"
+        "2. Очень длинное название товара для провер... | 10.00 ₽ × 2.0 шт.\n"
+        "\n💳 Итого: 99.90 ₽"
+    )
+    assert ReportBuilder.format_cheque([]) == ""
+
+
+def test_format_purchases_list_limits_rows():
+    items = [_item(1, "Хлеб", 40), _item(2, "Сыр", 300), _item(3, "Чай", 70)]
+
+    assert ReportBuilder.format_purchases_list(items, limit=2) == (
+        "📊 **Найдено записей: 3**\n\n"
+        "• #1 Хлеб\n  💰 40.00 ₽ | 📅 01.11.2025 | 🏪 Лента\n\n"
+        "• #2 Сыр\n  💰 300.00 ₽ | 📅 01.11.2025 | 🏪 Лента\n\n"
+        "... и ещё 1 записей\n\n"
+        "💳 **Сумма (первые 2): 340.00 ₽**"
+    )
+    assert ReportBuilder.format_purchases_list(items[:2], limit=2, total_count=3) == ReportBuilder.format_purchases_list(items, limit=2)
+
+
+def test_format_cheque_totals_groups_by_cheque():
+    items = [_item(1, "Хлеб", 40), _item(1, "Сыр", 300), _item(2, "Чай", 70, date="02.11.2025")]
+
+    assert ReportBuilder.format_cheque_totals(items, limit=1) == (
+        "📊 **Найдено чеков: 2**\n\n"
+        "• 📅 01.11.2025 | 🧾 1 | 💳 340.00 ₽ | 🏪 Лента"
+        "\n\n... и ещё 1 чеков"
+    )
+
+
+def test_format_grouped_stats_totals():
+    stats = [
+        {"group_name": "Продукты", "count": 3, "cheque_count": 2, "total": 410.0},
+        {"group_name": "Напитки", "count": 1, "cheque_count": 1, "total": 70.5},
+    ]
+
+    assert ReportBuilder.format_grouped_stats(stats, "category1") == (
+        "📊 **Группировка по category1:**\n\n"
+        "1. 🏷️ **Продукты**\n   🧾 Чеков: 2\n   📦 Позиций: 3\n   💰 Сумма: 410.00 ₽\n\n"
+        "2. 🏷️ **Напитки**\n   🧾 Чеков: 1\n   📦 Позиций: 1\n   💰 Сумма: 70.50 ₽\n\n"
+        "📊 **Итого:**\n   🧾 Чеков: 3\n   📦 Позиций: 4\n   💳 **Сумма: 480.50 ₽**"
+    )
+    assert ReportBuilder.format_grouped_stats([], "organization") == "Нет данных для группировки по organization"
+
+
+def test_truncate_stops_consuming_chunks_at_limit():
+    consumed = []
+
+    def chunks():
+        for i in range(1000):
+            consumed.append(i)
+            yield f"строка {i}\n"
+
+    text = ReportBuilder.truncate(chunks(), max_chars=100)
+    assert len(text) == 100 and text.endswith("...")
+    assert len(consumed) < 20
+    assert ReportBuilder.truncate(ReportBuilder._iter_format_grouped_stats([], "organization")) == (
+        "Нет данных для группировки по organization"
+    )
+
+
+def test_format_grouped_stats_fits_telegram_message():
+    stats = [{"group_name": f"Магазин {i}", "count": 1, "cheque_count": 1, "total": 10.0} for i in range(500)]
+
+    text = ReportBuilder.format_grouped_stats(stats, "organization")
+    assert len(text) < 4096 and text.endswith("...")
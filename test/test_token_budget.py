@@ -0,0 +1,51 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from aiAssistant.core.token_budget import message_tokens, trim_messages
+
+
+def _msg(role, content, **extra):
+    return {"role": role, "content": content, **extra}
+
+
+def test_trim_keeps_short_history_unchanged():
+    messages = [_msg("system", "s"), _msg("user", "привет"), _msg("assistant", "здравствуйте")]
+
+    assert trim_messages(messages, 6000) is messages
+
+
+def test_trim_drops_oldest_turns_and_keeps_system():
+    system = _msg("system", "правила")
+    old = [_msg("user", "старый вопрос " * 50), _msg("assistant", "старый ответ " * 50)]
+    recent = [_msg("user", "за неделю"), _msg("assistant", "1000 ₽")]
+    hint = _msg("system", "используй get_previous_month()")
+    messages = [system, *old, *recent, hint]
+    budget = sum(message_tokens(m) for m in (system, *recent, hint)) + 5
+
+    assert trim_messages(messages, budget) == [system, *recent, hint]
+
+
+def test_trim_keeps_tool_results_with_their_call():
+    call = _msg("assistant", None, tool_calls=[{"id": "c1", "type": "function", "function": {"name": "get_summary", "arguments": "{}"}}])
+    result = _msg("tool", "x" * 400, tool_call_id="c1")
+    messages = [_msg("user", "сводка"), call, result, _msg("user", "ещё")]
+    budget = message_tokens(messages[-1]) + 1
+
+    trimmed = trim_messages(messages, budget)
+
+    assert trimmed == [messages[-1]]
+    assert not any(m["role"] == "tool" for m in trimmed)
+
+
+def test_trim_drops_orphan_tool_result_at_start():
+    messages = [_msg("tool", "{}", tool_call_id="c0"), _msg("user", "вопрос")]
+
+    assert trim_messages(messages, 6000) == [messages[1]]
+
+
+def test_trim_keeps_last_turn_over_budget():
+    messages = [_msg("user", "длинный вопрос " * 100)]
+
+    assert trim_messages(messages, 10) == messages